@@ -0,0 +1,158 @@
+"""
+Benchmark registrations using local stand-ins of the external tools.
+
+Registers 1 to 1000 apps with `register_batch` using stand-ins for
+singularity, python/pip and virtualenvwrapper (see `standins.py`) with a
+configurable latency and image size, and measures the cost of cache hits
+of `_get_or_create_image` (image in the optdir or in the image store).
+
+Usage:
+
+    python benchmarks/bench_registration.py --apps 1 10 100 1000 --kind python
+"""
+
+from os.path import abspath
+from os.path import dirname
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import standins  # noqa: E402 pylint: disable=C0413
+from register_apps import batch  # noqa: E402 pylint: disable=C0413
+from register_apps import cli  # noqa: E402 pylint: disable=C0413
+from register_apps import images  # noqa: E402 pylint: disable=C0413
+
+
+def get_registrations(kind, apps, directory, tools):
+    """Get `apps` registrations of `kind` for a batch manifest."""
+    registrations = []
+
+    for i in range(apps):
+        registration = {
+            "kind": kind,
+            "optdir": str(directory / "opt"),
+            "bindir": str(directory / "bin"),
+        }
+
+        if kind in ("python", "toil"):
+            registration.update(
+                pypi_name=f"app{i}", pypi_version="v1.0.0", python=tools["python"]
+            )
+
+        if kind in ("singularity", "toil"):
+            registration.update(
+                singularity=tools["singularity"], volumes=[["/tmp", "/tmp"]]
+            )
+
+        if kind == "singularity":
+            registration.update(
+                image_repository=f"app{i}",
+                image_version="v1.0.0",
+                command="true",
+                target=f"app{i}",
+            )
+
+        registrations.append(registration)
+
+    return registrations
+
+
+def bench_throughput(kind, apps, jobs, directory, tools):
+    """Register `apps` and return the seconds and failed registrations."""
+    registrations = get_registrations(kind, apps, directory, tools)
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = batch.run_batch(registrations, jobs=jobs)
+
+    seconds = time.perf_counter() - start
+    return seconds, [i for i in results if i["status"] != "ok"]
+
+
+def bench_image_hits(hits, directory, tools):
+    """Return milliseconds of optdir and store hits of `_get_or_create_image`."""
+    optdir = directory / "opt" / "app" / "v1.0.0"
+    optdir.mkdir(parents=True)
+    store = images.get_store(directory / "opt")
+    args = (store, tools["singularity"], "docker://bench/app:v1.0.0")
+    times = {"optdir": [], "store": []}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        cli._get_or_create_image(optdir, *args)  # pylint: disable=W0212
+
+        for i in range(hits):
+            start = time.perf_counter()
+            cli._get_or_create_image(optdir, *args)  # pylint: disable=W0212
+            times["optdir"].append((time.perf_counter() - start) * 1000)
+
+            # a new version of the same image is linked from the store
+            other = optdir.parent / f"v{i}"
+            other.mkdir()
+            start = time.perf_counter()
+            cli._get_or_create_image(other, *args)  # pylint: disable=W0212
+            times["store"].append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def main():
+    """Run the benchmarks and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--apps", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--kind", choices=list(batch.KINDS), default="python")
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--hits", type=int, default=100)
+    parser.add_argument("--pull_latency", type=float, default=0)
+    parser.add_argument("--pip_latency", type=float, default=0)
+    parser.add_argument("--image_mb", type=float, default=1)
+    args = parser.parse_args()
+    directory = Path(tempfile.mkdtemp())
+    environ = dict(os.environ)
+
+    try:
+        tools = standins.make_standins(
+            directory / "tools",
+            pull_latency=args.pull_latency,
+            pip_latency=args.pip_latency,
+            image_size=args.image_mb * 2**20,
+        )
+
+        os.environ.update(standins.get_env(directory / "tools"))
+        print(f"{'kind':<12} {'apps':>6} {'seconds':>8} {'apps/s':>8} {'failed':>6}")
+
+        for apps in args.apps:
+            seconds, failed = bench_throughput(
+                args.kind, apps, args.jobs, directory / f"{args.kind}_{apps}", tools
+            )
+
+            print(
+                f"{args.kind:<12} {apps:>6} {seconds:>8.2f} "
+                f"{apps / seconds:>8.1f} {len(failed):>6}"
+            )
+
+        print(f"\n{'image hit':<12} {'mean ms':>8} {'median ms':>10}")
+
+        for hit, times in bench_image_hits(
+            args.hits, directory / "hits", tools
+        ).items():
+            print(
+                f"{hit:<12} {statistics.mean(times):>8.3f} "
+                f"{statistics.median(times):>10.3f}"
+            )
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(str(directory))
+
+
+if __name__ == "__main__":
+    main()
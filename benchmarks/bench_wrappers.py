@@ -0,0 +1,83 @@
+"""
+Benchmark the launch latency of the generated wrappers.
+
+Compares the singularity wrapper templates using a stand-in `singularity`
+that execs the command directly (see `standins.py`), so only the wrapper overhead (bash
+startup, `uuidgen` fork, the extra bash process and the instance state
+checks) is measured. If `uuidgen` is not installed, a stand-in linked to `true` is
+used so the legacy fork is still accounted for.
+
+Usage:
+
+    python benchmarks/bench_wrappers.py --calls 500
+"""
+
+from os.path import abspath
+from os.path import dirname
+from pathlib import Path
+import argparse
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import standins  # noqa: E402 pylint: disable=C0413
+from register_apps import wrappers  # noqa: E402 pylint: disable=C0413
+
+
+def time_calls(executable, calls, env):
+    """Return the wall time in milliseconds of each call to `executable`."""
+    times = []
+
+    for _ in range(calls):
+        start = time.perf_counter()
+        subprocess.check_call([str(executable)], env=env)
+        times.append((time.perf_counter() - start) * 1000)
+
+    return times
+
+
+def main():
+    """Run the benchmark and print a latency table."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+    directory = Path(tempfile.mkdtemp())
+    env = standins.get_env(directory)
+
+    try:
+        singularity = standins.make_standins(directory)["singularity"]
+        print(f"{'mode':<8} {'mean ms':>8} {'median ms':>10} {'p95 ms':>8}")
+
+        for mode in wrappers.MODES:
+            executable = directory / mode
+            executable.write_text(
+                wrappers.get_singularity_script(
+                    singularity=str(singularity),
+                    image="image.simg",
+                    command="true",
+                    volumes=[("/tmp", "/tmp")],
+                    tmpvar="/tmp",
+                    prefix="bench_v1",
+                    mode=mode,
+                    timeout=3600,
+                )
+            )
+
+            executable.chmod(0o755)
+            times = sorted(time_calls(executable, args.calls, env))
+            print(
+                f"{mode:<8} {statistics.mean(times):>8.2f} "
+                f"{statistics.median(times):>10.2f} "
+                f"{times[int(len(times) * 0.95) - 1]:>8.2f}"
+            )
+    finally:
+        shutil.rmtree(str(directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Local stand-ins for singularity, python/pip and virtualenvwrapper.
+
+The stand-ins reproduce what register_apps needs from each tool with a
+configurable latency (and image size), so that registrations can be
+benchmarked without Docker Hub, PyPi or singularity.
+"""
+
+from pathlib import Path
+import os
+import shutil
+
+# pulls write an image of `size` bytes, exec runs the command in the host
+FAKE_SINGULARITY = """#!/bin/bash
+if [ "$1" == "pull" ]; then
+    sleep {latency}
+    name=`basename "$2" | tr ':' '_'`
+    head -c {size} /dev/zero > "$name.sif"
+    exit 0
+fi
+[ "$1" == "instance" ] && exit 0
+shift 1; [[ "$1" == instance://* ]] && shift 1 && exec "$@"
+while [[ "$1" == --* ]]; do shift 2; done; shift 1; exec "$@"
+"""
+
+# handles `-m venv`, `-m pip` and `-m compileall`, pip creates an entry
+# point named after the last requirement that prints its version
+FAKE_PYTHON = """#!/bin/bash
+if [ "$1" == "-m" ] && [ "$2" == "venv" ]; then
+    mkdir -p "$3/bin" && cp "$0" "$3/bin/python"
+elif [ "$1" == "-m" ] && [ "$2" == "pip" ]; then
+    sleep {latency}
+    [ "$3" == "install" ] || exit 0
+    requirement="${{@: -1}}"
+    cat > "$(dirname "$0")/${{requirement%%==*}}" << EOF
+#!/bin/bash
+echo ${{requirement//==/ }}
+EOF
+    chmod +x "$(dirname "$0")/${{requirement%%==*}}"
+elif [ "$1" == "-c" ]; then
+    echo 3.6
+fi
+"""
+
+FAKE_VIRTUALENVWRAPPER = """
+mkvirtualenv() {
+    local python=python
+    [ "$1" == "-p" ] && python="$2" && shift 2
+    "$python" -m venv "$WORKON_HOME/$1"
+}
+"""
+
+
+def make_standins(directory, pull_latency=0, pip_latency=0, image_size=2**20):
+    """
+    Create the stand-ins in `directory`.
+
+    Arguments:
+        directory (Path): directory to be prepended to PATH.
+        pull_latency (float): seconds spent by each singularity pull.
+        pip_latency (float): seconds spent by each pip call.
+        image_size (int): bytes of the pulled images.
+
+    Returns:
+        dict: paths to the `singularity`, `python` and `virtualenvwrapper.sh`
+            stand-ins.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    standins = {
+        "singularity": FAKE_SINGULARITY.format(
+            latency=pull_latency, size=int(image_size)
+        ),
+        "python": FAKE_PYTHON.format(latency=pip_latency),
+        "virtualenvwrapper.sh": FAKE_VIRTUALENVWRAPPER,
+    }
+
+    for name, content in standins.items():
+        (directory / name).write_text(content)
+        (directory / name).chmod(0o755)
+
+    # the legacy wrappers fork uuidgen
+    if not shutil.which("uuidgen") and not (directory / "uuidgen").exists():
+        os.symlink(shutil.which("true"), str(directory / "uuidgen"))
+
+    return {i: str(directory / i) for i in standins}
+
+
+def get_env(directory):
+    """Get an environment where the stand-ins in `directory` come first."""
+    env = dict(os.environ, PATH=f"{directory}:{os.environ['PATH']}")
+    env["WORKON_HOME"] = str(Path(directory) / "envs")
+    env["TMPDIR"] = str(directory)
+    env["TOIL_REGISTER_REGISTRY"] = "none"
+    return env
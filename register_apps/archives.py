@@ -0,0 +1,189 @@
+"""register_apps multi-threaded compressed tar archives."""
+
+import contextlib
+import gzip
+import os
+import shutil
+import subprocess
+import tarfile
+
+from register_apps import exceptions
+
+# compression formats of archives and their file suffixes
+COMPRESSIONS = {"zstd": ".zst", "gzip": ".gz"}
+
+
+def _get_zstandard():
+    try:
+        import zstandard  # pylint: disable=C0415
+
+        return zstandard
+    except ImportError:
+        return None
+
+
+def get_compression(compression="auto"):
+    """
+    Get an available compression format.
+
+    Arguments:
+        compression (str): `auto`, or one of `COMPRESSIONS`.
+
+    Returns:
+        str: `zstd` if requested or available (`zstandard` or `zstd`), else
+            `gzip` (compressed in parallel with `pigz` if available).
+    """
+    has_zstd = bool(_get_zstandard() or shutil.which("zstd"))
+
+    if compression == "auto":
+        return "zstd" if has_zstd else "gzip"
+
+    if compression == "zstd" and not has_zstd:
+        raise exceptions.MissingRequirementError(
+            "zstd compression requires `pip install zstandard` or `zstd`."
+        )
+
+    return compression
+
+
+@contextlib.contextmanager
+def _pipe(command, stdin=None, stdout=None):
+    process = subprocess.Popen(command, stdin=stdin, stdout=stdout)
+
+    try:
+        yield process.stdin or process.stdout
+    finally:
+        if process.stdin:
+            process.stdin.close()
+        else:
+            process.stdout.read()  # drain so the process can exit
+            process.stdout.close()
+
+        if process.wait():
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+
+@contextlib.contextmanager
+def open_compressed(path, compression):
+    """
+    Open a multi-threaded compressed stream to write `path`.
+
+    Arguments:
+        path (Path): output path.
+        compression (str): one of `COMPRESSIONS`.
+
+    Yields:
+        file: binary file object.
+    """
+    zstandard = _get_zstandard()
+
+    with open(str(path), "wb") as f:
+        if compression == "zstd" and zstandard:
+            compressor = zstandard.ZstdCompressor(threads=-1)
+
+            with compressor.stream_writer(f, closefd=False) as stream:
+                yield stream
+        elif compression == "zstd":
+            with _pipe(["zstd", "-q", "-T0"], stdin=subprocess.PIPE, stdout=f) as s:
+                yield s
+        elif shutil.which("pigz"):
+            with _pipe(["pigz"], stdin=subprocess.PIPE, stdout=f) as stream:
+                yield stream
+        else:
+            with gzip.GzipFile(fileobj=f, mode="wb") as stream:
+                yield stream
+
+
+@contextlib.contextmanager
+def open_decompressed(path, compression):
+    """
+    Open a decompressed stream to read `path`.
+
+    Arguments:
+        path (Path): compressed file path.
+        compression (str): one of `COMPRESSIONS`.
+
+    Yields:
+        file: binary file object.
+    """
+    zstandard = _get_zstandard()
+
+    with open(str(path), "rb") as f:
+        if compression == "zstd" and zstandard:
+            with zstandard.ZstdDecompressor().stream_reader(f) as stream:
+                yield stream
+        elif compression == "zstd":
+            get_compression("zstd")
+
+            with _pipe(["zstd", "-q", "-d"], stdin=f, stdout=subprocess.PIPE) as s:
+                yield s
+        elif shutil.which("pigz"):
+            with _pipe(["pigz", "-d"], stdin=f, stdout=subprocess.PIPE) as stream:
+                yield stream
+        else:
+            with gzip.GzipFile(fileobj=f, mode="rb") as stream:
+                yield stream
+
+
+def get_member_path(member, path):
+    """
+    Get the path where a tar `member` is extracted in `path`.
+
+    Arguments:
+        member (tarfile.TarInfo): archive member.
+        path (str): extraction directory.
+
+    Returns:
+        str: resolved extraction path of the member.
+
+    Raises:
+        ValidationError: if the member would be extracted outside `path`
+            (e.g. absolute names, `..` components or previously extracted
+            links to other directories).
+    """
+    root = os.path.realpath(path)
+    target = os.path.realpath(os.path.join(root, member.name))
+
+    if os.path.isabs(member.name) or not _is_within(target, root):
+        raise exceptions.ValidationError(f"Unsafe archive member: {member.name}")
+
+    return target
+
+
+def check_member(member, path):
+    """
+    Check a tar `member` is extracted in `path` and only links to its files.
+
+    Arguments:
+        member (tarfile.TarInfo): archive member.
+        path (str): extraction directory.
+
+    Raises:
+        ValidationError: if the member is extracted outside `path`, or if it
+            links to an absolute path or outside `path`.
+    """
+    root = os.path.realpath(path)
+    target = get_member_path(member, root)
+
+    if member.issym() or member.islnk():
+        # symlinks are relative to their directory, hardlinks to the archive
+        base = os.path.dirname(target) if member.issym() else root
+        linked = os.path.normpath(os.path.join(base, member.linkname))
+
+        if os.path.isabs(member.linkname) or not _is_within(linked, root):
+            raise exceptions.ValidationError(
+                f"Unsafe archive link: {member.name} -> {member.linkname}"
+            )
+
+
+def _is_within(path, root):
+    return path == root or path.startswith(root + os.sep)
+
+
+def extract_member(tar, member, path):
+    """Extract a tar `member` keeping permissions and links, see `check_member`."""
+    check_member(member, path)
+
+    # tarfile filters are only available in recent python versions
+    kwargs = {"filter": "tar"} if hasattr(tarfile, "data_filter") else {}
+    tar.extract(member, path, **kwargs)
@@ -0,0 +1,192 @@
+"""register_apps batch registration."""
+
+import json
+import time
+
+import click
+
+from register_apps import exceptions
+
+# manifest kinds mapped to the commands names in register_apps.cli
+KINDS = {
+    "toil": "register_toil",
+    "singularity": "register_singularity",
+    "python": "register_python",
+}
+
+
+def load_manifest(path):
+    """
+    Load a JSON or YAML registrations manifest.
+
+    The manifest is either a list of registrations or a mapping with a
+    `registrations` list and optional `defaults` shared by all items::
+
+        defaults:
+            optdir: /work/isabl/local
+            bindir: /work/isabl/bin
+        registrations:
+            - kind: toil
+              pypi_name: toil_disambiguate
+              pypi_version: v0.1.2
+            - kind: singularity
+              image_repository: docker-pcapcore
+              image_version: v0.1.1
+              targets:
+                bwa_mem.pl: bwa_mem.pl
+                ascat.pl: ascat.pl
+
+    Arguments:
+        path (str): path to a `.json`, `.yaml` or `.yml` manifest.
+
+    Returns:
+        list: registrations dictionaries with defaults applied.
+    """
+    with open(path, "r") as f:
+        if str(path).endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:  # pragma: no cover
+                raise exceptions.MissingRequirementError(
+                    "PyYAML is required for YAML manifests, "
+                    "install with: pip install register_apps[yaml]"
+                )
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+
+    if isinstance(manifest, list):
+        manifest = {"registrations": manifest}
+
+    defaults = manifest.get("defaults") or {}
+    registrations = []
+
+    for i, item in enumerate(manifest.get("registrations") or []):
+        item = dict(defaults, **item)
+
+        if item.get("kind") not in KINDS:
+            raise exceptions.ValidationError(
+                f"Registration {i} has invalid kind '{item.get('kind')}', "
+                f"use one of: {', '.join(KINDS)}"
+            )
+
+        registrations.append(item)
+
+    return registrations
+
+
+def get_arguments(item):
+    """
+    Convert a registration dictionary into command line arguments.
+
+    Lists of pairs (e.g. `volumes`) are passed as multiple options, mappings
+    (e.g. `targets`) as multiple `key=value` options and booleans as flags.
+
+    Arguments:
+        item (dict): registration parameters (excluding `kind`).
+
+    Returns:
+        list: arguments to be parsed by the register command.
+    """
+    args = []
+
+    for key, value in item.items():
+        if key == "kind" or value is None:
+            continue
+
+        if isinstance(value, bool):
+            if value:
+                args.append(f"--{key}")
+            continue
+
+        if isinstance(value, dict):
+            value = [f"{k}={v}" for k, v in value.items()]
+
+        values = value if isinstance(value, (list, tuple)) else [value]
+
+        for i in values:
+            args.append(f"--{key}")
+            args.extend(map(str, i) if isinstance(i, (list, tuple)) else [str(i)])
+
+    return args
+
+
+def get_label(item):
+    """Get a human readable label for a registration."""
+    name = item.get("target") or item.get("pypi_name") or item.get("image_repository")
+    version = item.get("pypi_version") or item.get("image_version") or ""
+    return f"{item['kind']}:{name}:{version}".rstrip(":")
+
+
+def register(item):
+    """
+    Run a single registration using the existing command line apps.
+
+    Arguments:
+        item (dict): registration parameters including `kind`.
+
+    Returns:
+        dict: result with `label`, `kind`, `status`, `error` and `seconds`.
+    """
+    from register_apps import cli
+
+    command = getattr(cli, KINDS[item["kind"]])
+    result = {"label": get_label(item), "kind": item["kind"], "error": None}
+    start = time.time()
+
+    try:
+        command.main(
+            args=get_arguments(item),
+            prog_name=KINDS[item["kind"]],
+            standalone_mode=False,
+        )
+        result["status"] = "ok"
+    except Exception as error:  # pylint: disable=broad-except
+        result["status"] = "failed"
+        result["error"] = f"{type(error).__name__}: {error}"
+
+    result["seconds"] = round(time.time() - start, 3)
+    return result
+
+
+def run_batch(registrations, jobs=4, executor="thread"):
+    """
+    Run registrations through a bounded pool.
+
+    Arguments:
+        registrations (list): registrations dictionaries.
+        jobs (int): maximum number of concurrent registrations.
+        executor (str): either `thread` or `process`.
+
+    Returns:
+        list: results in the same order as `registrations`.
+    """
+    from concurrent import futures  # pylint: disable=C0415
+
+    pool_class = {
+        "thread": futures.ThreadPoolExecutor,
+        "process": futures.ProcessPoolExecutor,
+    }[executor]
+
+    with pool_class(max_workers=max(1, jobs)) as pool:
+        results = list(pool.map(register, registrations))
+
+    return results
+
+
+def echo_summary(results):
+    """Print per registration results and a summary."""
+    click.echo("\nRegistration results:\n")
+
+    for i in results:
+        line = f"\t{i['status']:<6} {i['label']} ({i['seconds']}s)"
+        click.secho(line, fg="green" if i["status"] == "ok" else "red")
+
+        if i["error"]:
+            click.echo(f"\t\t{i['error']}")
+
+    failed = sum(i["status"] != "ok" for i in results)
+    click.secho(
+        f"\n{len(results) - failed} succeeded, {failed} failed.\n",
+        fg="red" if failed else "green",
+    )
@@ -0,0 +1,299 @@
+"""register_apps portable bundles of registered apps."""
+
+from pathlib import Path
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+
+import click
+
+from register_apps import archives
+from register_apps import environments
+from register_apps import exceptions
+from register_apps import images
+from register_apps import index
+from register_apps import utils
+
+# name of the json file that describes the bundle contents
+MANIFEST_NAME = "manifest.json"
+
+# files that are specific to the site where the app was registered
+SKIPPED_FILES = {".lock", ".last_used"}
+
+
+def get_bundle_manifest(optroot, name, version):
+    """
+    Describe the files of a registered `name` and `version` to be bundled.
+
+    Arguments:
+        optroot (Path): optdir root.
+        name (str): package or image repository name.
+        version (str): registered version.
+
+    Returns:
+        dict: with `name`, `version`, `optdir`, `images`, `files`, `venvs`
+            and `entries` keys.
+    """
+    optdir = Path(optroot) / name / version
+
+    if not optdir.is_dir():
+        raise exceptions.MissingDataError(f"Nothing registered at {optdir}")
+
+    entries = index.query(index.read_entries(optroot), name=name, version=version)
+    image_names = {i.name for i in images.get_images(optdir)}
+    files = [
+        i.name
+        for i in optdir.iterdir()
+        if i.name not in SKIPPED_FILES and i.name not in image_names
+    ]
+
+    return {
+        "name": name,
+        "version": version,
+        "optdir": str(optdir),
+        "images": sorted(image_names),
+        "files": sorted(files),
+        "venvs": sorted({i["venv"] for i in entries if i.get("venv")}),
+        "entries": entries,
+    }
+
+
+def export_bundle(optroot, name, version, output, compression="auto"):
+    """
+    Export a registered version (wrappers, images and venvs) as a bundle.
+
+    The bundle is an uncompressed tar with a manifest, the images (already
+    compressed squashfs files) and a payload with wrappers and virtual
+    environments compressed with multiple threads.
+
+    Arguments:
+        optroot (Path): optdir root.
+        name (str): package or image repository name.
+        version (str): registered version.
+        output (Path): bundle path.
+        compression (str): `auto`, or one of `archives.COMPRESSIONS`.
+
+    Returns:
+        dict: the bundle manifest.
+    """
+    manifest = get_bundle_manifest(optroot, name, version)
+    manifest["compression"] = archives.get_compression(compression)
+    payload_name = _get_payload_name(manifest)
+    optdir = Path(manifest["optdir"])
+    tmpdir = tempfile.mkdtemp(dir=str(Path(output).parent))
+
+    try:
+        payload = Path(tmpdir) / payload_name
+        click.echo(f"Compressing payload with {manifest['compression']}...")
+
+        with archives.open_compressed(payload, manifest["compression"]) as stream:
+            with tarfile.open(fileobj=stream, mode="w|") as tar:
+                for i in manifest["files"]:
+                    tar.add(str(optdir / i), arcname=f"files/{i}")
+
+                for i in manifest["venvs"]:
+                    tar.add(i, arcname=f"venvs/{Path(i).name}")
+
+        manifest_path = Path(tmpdir) / MANIFEST_NAME
+        manifest_path.write_text(json.dumps(manifest, indent=4, sort_keys=True))
+
+        with tarfile.open(str(output), "w") as tar:
+            tar.add(str(manifest_path), arcname=MANIFEST_NAME)
+            tar.add(str(payload), arcname=payload_name)
+
+            for i in manifest["images"]:
+                click.echo(f"Adding image {i}...")
+                tar.add(os.path.realpath(str(optdir / i)), arcname=f"images/{i}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return manifest
+
+
+def import_bundle(bundle, optroot, bindir, workon_home, python):
+    """
+    Import a bundle and rewrite its paths for the new location.
+
+    Images are added to the image store of `optroot`, virtual environments
+    are unpacked in `workon_home` and relocated to use `python`, wrapper
+    paths are rewritten, and wrappers are linked in `bindir` and indexed.
+
+    Arguments:
+        bundle (Path): bundle created with `export_bundle`.
+        optroot (Path): optdir root.
+        bindir (Path): directory with links to the wrappers.
+        workon_home (Path): directory of the virtual environments.
+        python (str): path to the python interpreter of this site.
+
+    Returns:
+        list: index entries of the imported apps.
+    """
+    optroot, bindir, workon_home = Path(optroot), Path(bindir), Path(workon_home)
+    imported = []
+
+    with tarfile.open(str(bundle), "r") as tar:
+        manifest = get_imported_manifest(tar)
+        payload_name = _get_payload_name(manifest)
+        optdir = optroot / manifest["name"] / manifest["version"]
+        optdir.mkdir(parents=True, exist_ok=True)
+        replacements = {manifest["optdir"]: str(optdir)}
+
+        for i in manifest["venvs"]:
+            replacements[i] = str(workon_home / Path(i).name)
+
+        with utils.lock(optdir / ".lock"):
+            if any((optdir / i).exists() for i in manifest["files"]):
+                raise exceptions.ValidationError(f"Targets exist at {optdir}")
+
+            tmpdir = Path(tempfile.mkdtemp(dir=str(optroot)))
+
+            try:
+                payload = tmpdir / payload_name
+                image_names = {f"images/{i}" for i in manifest["images"]}
+
+                for member in tar:
+                    if member.name == payload_name:
+                        archives.extract_member(tar, member, str(tmpdir))
+                    elif member.name in image_names:
+                        click.echo(f"Adding image {Path(member.name).name}...")
+                        archives.extract_member(tar, member, str(tmpdir))
+                        image = tmpdir / member.name
+                        record = images.add_image(
+                            images.get_store(optroot),
+                            image,
+                            _get_image_url(manifest, image.name),
+                            _get_image_digest(manifest, image.name),
+                        )
+
+                        images.link_image(record["path"], optdir / image.name)
+
+                click.echo("Extracting wrappers and virtual environments...")
+
+                with archives.open_decompressed(
+                    payload, manifest["compression"]
+                ) as stream:
+                    with tarfile.open(fileobj=stream, mode="r|") as payload_tar:
+                        for member in payload_tar:
+                            environments.extract_environment_member(
+                                payload_tar, member, str(tmpdir), python
+                            )
+
+                workon_home.mkdir(parents=True, exist_ok=True)
+
+                for i in manifest["venvs"]:
+                    venv = workon_home / Path(i).name
+                    shutil.rmtree(str(venv), ignore_errors=True)
+                    os.replace(str(tmpdir / "venvs" / venv.name), str(venv))
+                    environments.relocate_environment(venv, i, venv, python)
+
+                for i in manifest["files"]:
+                    os.replace(str(tmpdir / "files" / i), str(optdir / i))
+                    utils.rewrite_paths([optdir / i], replacements)
+            finally:
+                shutil.rmtree(str(tmpdir), ignore_errors=True)
+
+            for entry in manifest["entries"]:
+                imported.append(
+                    _import_entry(optroot, optdir, bindir, entry, replacements)
+                )
+
+    return imported
+
+
+def get_imported_manifest(tar):
+    """
+    Read the manifest of a bundle and check the bundle has the listed members.
+
+    Arguments:
+        tar (tarfile.TarFile): bundle opened for reading.
+
+    Returns:
+        dict: the bundle manifest.
+
+    Raises:
+        ValidationError: if the manifest or its members are missing or invalid.
+    """
+    names = set(tar.getnames())
+
+    if MANIFEST_NAME not in names:
+        raise exceptions.ValidationError(f"Bundle has no {MANIFEST_NAME}")
+
+    try:
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+    except ValueError as error:
+        raise exceptions.ValidationError(f"Invalid bundle manifest: {error}")
+
+    keys = {"name", "version", "optdir", "compression", "images", "files", "venvs"}
+    missing = sorted(keys.union(["entries"]) - set(manifest))
+
+    if missing:
+        raise exceptions.ValidationError(f"Bundle manifest misses: {missing}")
+
+    if manifest["compression"] not in archives.COMPRESSIONS:
+        raise exceptions.ValidationError(
+            f"Unknown bundle compression: {manifest['compression']}"
+        )
+
+    # names are joined to the optdir and environments directories
+    for i in (
+        [manifest["name"], manifest["version"]]
+        + manifest["images"]
+        + [Path(j).name for j in manifest["venvs"]]
+        + manifest["files"]
+    ):
+        if i in {"", ".", ".."} or Path(i).name != i:
+            raise exceptions.ValidationError(f"Invalid name in bundle manifest: {i}")
+
+    members = {_get_payload_name(manifest)} | {
+        f"images/{i}" for i in manifest["images"]
+    }
+    missing = sorted(members - names)
+
+    if missing:
+        raise exceptions.ValidationError(f"Bundle misses members: {missing}")
+
+    return manifest
+
+
+def _get_payload_name(manifest):
+    return f"payload.tar{archives.COMPRESSIONS[manifest['compression']]}"
+
+
+def _get_image_url(manifest, filename):
+    for i in manifest["entries"]:
+        if i.get("image") and Path(i["image"]).name == filename:
+            return i["image_url"]
+
+    return f"bundle://{manifest['name']}/{manifest['version']}/{filename}"
+
+
+def _get_image_digest(manifest, filename):
+    for i in manifest["entries"]:
+        if i.get("image") and Path(i["image"]).name == filename:
+            return i.get("digest")
+
+    return None
+
+
+def _import_entry(optroot, optdir, bindir, entry, replacements):
+    """Link the wrapper of an imported `entry` and add it to the index."""
+    entry = dict(entry)
+    entry.pop("registered", None)
+
+    for key, value in entry.items():
+        for old, new in replacements.items():
+            if isinstance(value, str) and value.startswith(old):
+                entry[key] = new + value[len(old) :]
+
+    if entry.get("wrapper") and entry.get("link"):
+        entry["link"] = str(bindir / Path(entry["link"]).name)
+        bindir.mkdir(parents=True, exist_ok=True)
+        utils.force_symlink(entry["wrapper"], entry["link"])
+        click.echo(f"Linked {entry['link']}")
+
+    if entry.get("image"):
+        entry["image"] = str(optdir / Path(entry["image"]).name)
+
+    return index.add_entry(optroot, **entry)
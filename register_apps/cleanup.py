@@ -0,0 +1,361 @@
+"""register_apps garbage collection of registered versions."""
+
+from pathlib import Path
+import os
+import shutil
+import time
+
+import click
+
+from register_apps import environments
+from register_apps import images
+from register_apps import index
+from register_apps import utils
+from register_apps import wrappers
+
+
+def get_versions(optdir):
+    """
+    Find registered versions in `optdir` (i.e. `optdir/<name>/<version>`).
+
+    Index entries are used to find virtual environments and wrappers, while
+    versions registered before the index existed are found in the optdir.
+
+    Arguments:
+        optdir (str): optdir root.
+
+    Returns:
+        list: dictionaries with `name`, `version`, `path`, `venvs`, `entries`
+            and `last_used` (epoch seconds) keys.
+    """
+    versions = {}
+
+    for path in Path(optdir).glob("*/*"):
+        if path.is_dir() and not path.parent.name.startswith("."):
+            versions[str(path)] = {
+                "name": path.parent.name,
+                "version": path.name,
+                "path": path,
+                "venvs": set(),
+                "entries": [],
+            }
+
+    for entry in index.read_entries(optdir):
+        if entry.get("wrapper"):
+            version = versions.get(str(Path(entry["wrapper"]).parent))
+
+            if version:
+                version["entries"].append(entry)
+                version["venvs"].update([entry["venv"]] if entry.get("venv") else [])
+
+    for version in versions.values():
+        default_venv = environments.get_workon_home() / environments.get_env_name(
+            version["name"], version["version"]
+        )
+
+        if not version["entries"] and default_venv.is_dir():
+            version["venvs"].add(str(default_venv))
+
+        version["last_used"] = get_last_used(version["path"])
+
+    return sorted(versions.values(), key=lambda i: i["last_used"])
+
+
+def get_last_used(path):
+    """
+    Get the last time a registered version was used.
+
+    The usage stamp written by the wrappers is compared with the access
+    times of the wrappers in `path`, images are ignored because hardlinks to
+    the same stored blob share their access times across versions.
+
+    Arguments:
+        path (Path): registered version directory.
+
+    Returns:
+        float: epoch seconds.
+    """
+    stamp = Path(path) / wrappers.STAMP_FILENAME
+    last_used = stamp.stat().st_mtime if stamp.is_file() else 0
+
+    skipped = {i.name for i in images.get_images(path)}
+
+    for i in os.scandir(str(path)):
+        if i.is_file() and not i.name.startswith(".") and i.name not in skipped:
+            stat = i.stat()
+            last_used = max(last_used, stat.st_atime, stat.st_mtime)
+
+    return last_used
+
+
+def get_files(paths):
+    """Get the stat results of files in `paths`, keyed by (device, inode)."""
+    files = {}
+
+    for root in paths:
+        root = Path(root)
+
+        if root.is_file() or root.is_symlink():
+            stat = os.lstat(str(root))
+            files.setdefault((stat.st_dev, stat.st_ino), [stat, 0])[1] += 1
+            continue
+
+        for directory, _, filenames in os.walk(str(root)):
+            for i in filenames:
+                stat = os.lstat(os.path.join(directory, i))
+                files.setdefault((stat.st_dev, stat.st_ino), [stat, 0])[1] += 1
+
+    return files
+
+
+def get_removed_paths(version):
+    """Get the paths removed when collecting a registered version."""
+    return [version["path"]] + sorted(version["venvs"])
+
+
+def get_version_files(version):
+    """Get the stat results of the removed paths of `version`, stat'ed once."""
+    if "files" not in version:
+        version["files"] = {str(i): get_files([i]) for i in get_removed_paths(version)}
+
+    return version["files"]
+
+
+def get_reclaimer(store):
+    """
+    Get a function that adds versions to remove and returns the bytes freed.
+
+    The freed bytes are updated incrementally as versions are added, each
+    version's files are stat'ed once and the store only when this is called.
+    Files hardlinked outside the removed paths are not counted.
+
+    Arguments:
+        store (Path): image store directory.
+
+    Returns:
+        callable: takes a list of versions and returns the bytes freed by
+            removing them and all the versions added before.
+    """
+    links = {k: n for k, (_, n) in get_files([store / "sha256"]).items()}
+    seen, freed = set(), set()
+    reclaimed = 0
+
+    def reclaim(versions):
+        nonlocal reclaimed
+
+        for version in versions:
+            for path, files in get_version_files(version).items():
+                # environments can be shared by several versions
+                if path in seen:
+                    continue
+
+                seen.add(path)
+
+                for key, (stat, count) in files.items():
+                    links[key] = links.get(key, 0) + count
+
+                    if key not in freed and stat.st_nlink <= links[key]:
+                        freed.add(key)
+                        reclaimed += stat.st_size
+
+        return reclaimed
+
+    return reclaim
+
+
+def get_reclaimed_bytes(versions, store):
+    """
+    Get the bytes freed by removing `versions` and their orphan store images.
+
+    Files hardlinked outside the removed paths are not counted.
+
+    Arguments:
+        versions (list): versions as returned by `get_versions`.
+        store (Path): image store directory.
+
+    Returns:
+        int: bytes that would be freed.
+    """
+    return get_reclaimer(store)(versions)
+
+
+def select_versions(  # pylint: disable=R0913
+    versions, store, max_age=None, max_size=None, keep=1
+):
+    """
+    Select least recently used versions to remove.
+
+    Arguments:
+        versions (list): versions sorted by `last_used`.
+        store (Path): image store directory.
+        max_age (float): remove versions not used in `max_age` days.
+        max_size (float): remove versions until the rest use `max_size` bytes.
+        keep (int): number of most recently used versions kept per name.
+
+    Returns:
+        list: versions to remove.
+    """
+    kept = {}
+    candidates = []
+
+    for version in reversed(versions):
+        kept[version["name"]] = kept.get(version["name"], 0) + 1
+
+        if kept[version["name"]] > keep:
+            candidates.insert(0, version)
+
+    selected = []
+
+    if max_age is not None:
+        cutoff = time.time() - max_age * 86400
+        selected = [i for i in candidates if i["last_used"] < cutoff]
+
+    if max_size is not None:
+        # images shared by several versions are only freed with the last one
+        total = get_reclaimed_bytes(versions, store)
+        reclaim = get_reclaimer(store)
+        reclaimed = reclaim(selected)
+
+        for version in candidates:
+            if total - reclaimed <= max_size:
+                break
+
+            if version not in selected:
+                selected.append(version)
+                reclaimed = reclaim([version])
+
+    return selected
+
+
+def get_shared_venvs(optdir, versions):
+    """Get the environments of `versions` used by other versions in the index."""
+    paths = {str(i["path"]) for i in versions}
+
+    return {
+        entry["venv"]
+        for entry in index.read_entries(optdir)
+        if entry.get("venv")
+        and not (entry.get("wrapper") and str(Path(entry["wrapper"]).parent) in paths)
+    }
+
+
+def get_links(version, bindir):
+    """
+    Get the links to the wrappers of `version`.
+
+    Links are taken from the index entries, and from `bindir` for versions
+    registered before the index existed. Only links that resolve into the
+    version directory are returned.
+
+    Arguments:
+        version (dict): version as returned by `get_versions`.
+        bindir (str): directory with links to the wrappers.
+
+    Returns:
+        list: paths of the links.
+    """
+    links = [i["link"] for i in version["entries"] if i.get("link")]
+
+    if not version["entries"] and Path(bindir).is_dir():
+        links = [i.path for i in os.scandir(str(bindir))]
+
+    path = os.path.realpath(str(version["path"]))
+
+    return [
+        i
+        for i in links
+        if os.path.islink(i) and os.path.realpath(i).startswith(path + os.sep)
+    ]
+
+
+def remove_version(version, bindir, shared=()):
+    """
+    Remove a version, its links and the environments not in `shared`.
+
+    The version lock is held so that concurrent registrations of the same
+    version wait, and versions used since they were selected are kept.
+
+    Arguments:
+        version (dict): version as returned by `get_versions`.
+        bindir (str): directory with links to the wrappers.
+        shared (set): environments used by other versions.
+
+    Returns:
+        bool: True if the version was removed.
+    """
+    path = version["path"]
+
+    with utils.lock(path / ".lock"):
+        if get_last_used(path) > version["last_used"]:
+            click.secho(f"Keeping {path}, it was used recently.", fg="yellow")
+            return False
+
+        for i in get_links(version, bindir):
+            click.echo(f"Removing link {i}...")
+            os.unlink(i)
+
+        click.echo(f"Removing {path}...")
+
+        for i in os.scandir(str(path)):
+            if i.name.startswith(".lock"):
+                continue
+
+            if i.is_dir(follow_symlinks=False):
+                shutil.rmtree(i.path, ignore_errors=True)
+            else:
+                os.unlink(i.path)
+
+        for i in sorted(version["venvs"] - set(shared)):
+            click.echo(f"Removing {i}...")
+            shutil.rmtree(i, ignore_errors=True)
+
+    # a concurrent registration may have recreated the version
+    try:
+        path.rmdir()
+    except OSError:
+        pass
+
+    return True
+
+
+def remove_versions(optdir, bindir, versions):
+    """
+    Remove `versions`, their environments, links and orphan store images.
+
+    Environments used by other versions are kept.
+
+    Arguments:
+        optdir (str): optdir root.
+        bindir (str): directory with links to the wrappers.
+        versions (list): versions to remove.
+    """
+    shared = get_shared_venvs(optdir, versions)
+
+    for version in versions:
+        if remove_version(version, bindir, shared):
+            index.remove_entries(optdir, version["entries"])
+
+    # remove store images that are no longer hardlinked nor symlinked
+    store = images.get_store(optdir)
+
+    if not (store / "sha256").is_dir():
+        return
+
+    with utils.lock(store / ".lock"):
+        symlinked = {
+            os.path.realpath(str(j))
+            for i in get_versions(optdir)
+            for j in images.get_images(i["path"])
+            if j.is_symlink()
+        }
+
+        for blob in (store / "sha256").glob("*"):
+            stat = blob.stat()
+
+            # recently pulled images may not be linked to their versions yet
+            if stat.st_nlink > 1 or time.time() - stat.st_mtime < images.STALE_PULL:
+                continue
+
+            if str(blob.resolve()) not in symlinked:
+                click.echo(f"Removing unused image {blob}...")
+                blob.unlink()
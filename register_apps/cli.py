@@ -16,14 +16,26 @@ Also see (1) from http://click.pocoo.org/5/setuptools/#setuptools-integration
 """
 
 from pathlib import Path
+import json
 import os
 import shutil
-import subprocess
+import threading
 
 import click
 
+from register_apps import batch
+from register_apps import environments
+from register_apps import exceptions
+from register_apps import fingerprints
+from register_apps import images
+from register_apps import index
 from register_apps import options
+from register_apps import processes
+from register_apps import profiling
+from register_apps import registries
+from register_apps import telemetry
 from register_apps import utils
+from register_apps import wrappers
 
 
 @click.command()
@@ -35,10 +47,16 @@ from register_apps import utils
 @options.BINDIR
 @options.OPTDIR
 @options.PYTHON2
+@options.ENVIRONMENT
 @options.TMPVAR
 @options.VOLUMES
 @options.SINGULARITY
+@options.REGISTRY_CLIENT
+@options.EXECUTABLE
+@options.PROFILE
+@options.PROFILE_TRACE
 @options.VERSION
+@profiling.profiled
 def register_toil(
     pypi_name,
     pypi_version,
@@ -51,11 +69,15 @@ def register_toil(
     image_user,
     github_user,
     singularity,
+    registry_client,
+    environment,
+    executable,
 ):
     """Register versioned toil container pipelines in a bin directory."""
-    virtualenvwrapper = shutil.which("virtualenvwrapper.sh")
     python = shutil.which(python)
-    optdir = Path(optdir) / pypi_name / pypi_version
+    optroot = Path(optdir)
+    imagestore = images.get_store(optroot)
+    optdir = optroot / pypi_name / pypi_version
     bindir = Path(bindir)
     optexe = optdir / pypi_name
     binexe = bindir / f"{pypi_name}_{pypi_version}"
@@ -63,65 +85,84 @@ def register_toil(
 
     # check paths
     assert python, "Could not determine the python path."
-    assert virtualenvwrapper, "Could not determine the virtualenvwrapper.sh path."
 
     # make sure dirs exist
     optdir.mkdir(exist_ok=True, parents=True)
     bindir.mkdir(exist_ok=True, parents=True)
 
-    # create virtual environment and install package
-    env = f"production__{pypi_name}__{pypi_version}"
-    click.echo(f"Creating virtual environment '{env}'...")
-    subprocess.check_output(
-        [
-            "/bin/bash",
-            "-c",
-            f"source {virtualenvwrapper} && mkvirtualenv -p {python} {env}",
-        ]
-    )
+    # wait for concurrent registrations of the same version
+    with utils.lock(optdir / ".lock"):
+        fingerprint = dict(
+            environment=_get_environment_fingerprint(
+                python, pypi_name, pypi_version, github_user, environment["optimize"]
+            ),
+            image=fingerprints.get_fingerprint(image_url=image_url),
+        )
 
-    if github_user:
-        install_cmd = (
-            f"source {virtualenvwrapper} && workon {env} && "
-            f"pip install git+https://github.com/{github_user}/"
-            f"{pypi_name}@{pypi_version}#egg={pypi_name} && which {pypi_name}"
+        # only install and pull what changed since the last registration
+        changed = _remove_stale_parts(optdir, pypi_name, pypi_version, fingerprint)
+        reuse = fingerprints.is_current(
+            optdir, "environment", fingerprint["environment"]
         )
-    else:
-        install_cmd = (
-            f"source {virtualenvwrapper} && workon {env} && "
-            f"pip install {pypi_name}=={pypi_version} && which {pypi_name}"
+
+        # install package while the image is pulled
+        toolpath, singularity_image = _install_package_and_get_image(
+            install_kwargs=_get_install_kwargs(
+                environment, python, pypi_name, pypi_version, github_user, reuse
+            ),
+            image_args=(
+                optdir,
+                imagestore,
+                singularity,
+                image_url,
+                _get_registry_client(registry_client, environment["offline"]),
+            ),
         )
 
-    click.echo(f"Installing package with '{install_cmd}'...")
-    toolpath = subprocess.check_output(["/bin/bash", "-c", install_cmd])
-    toolpath = toolpath.decode("utf-8").strip().split("\n")[-1]
-
-    # build command
-    command = [
-        toolpath,
-        '"$@"',
-        "--singularity",
-        _get_or_create_image(optdir, singularity, image_url),
-        " ".join(f"--volumes {i} {j}" for i, j in volumes),
-        "--workDir",
-        tmpvar,
-        "\n",
-    ]
+        if not reuse:
+            _optimize_environment(optroot, toolpath, environment)
+
+        # build command and link executables
+        script = wrappers.get_toil_script(
+            toolpath,
+            singularity_image,
+            volumes,
+            tmpvar,
+            executable["wrapper"],
+            _get_telemetry(
+                executable["telemetry_dir"], pypi_name, pypi_version, optexe.name
+            ),
+        )
 
-    # link executables
-    click.echo("Creating and linking executable...")
-    optexe.write_text(f"#!/bin/bash\n{' '.join(command)}")
-    optexe.chmod(mode=0o755)
-    utils.force_symlink(optexe, binexe)
-    click.secho(
-        f"\nExecutables available at:\n" f"\n\t{str(optexe)}" f"\n\t{str(binexe)}\n",
-        fg="green",
-    )
+        if executable["usage_stamp"]:
+            script = wrappers.add_preamble(script, wrappers.get_usage_stamp(optdir))
+
+        _write_executable_and_index(
+            optroot,
+            optexe,
+            binexe,
+            script,
+            fingerprint,
+            changed=changed or not reuse,
+            kind="toil",
+            name=pypi_name,
+            version=pypi_version,
+            target=optexe.name,
+            image=singularity_image,
+            image_url=image_url,
+            digest=images.get_image_digest(
+                singularity_image, imagestore, image_url, compute=False
+            ),
+            venv=Path(toolpath).parent.parent,
+            startup=_get_startup(toolpath),
+        )
 
 
 @click.command()
 @options.TARGET
 @options.COMMAND
+@options.TARGETS
+@options.TARGETS_GLOB
 @options.IMAGE_REPOSITORY
 @options.IMAGE_USER
 @options.IMAGE_VERSION
@@ -131,56 +172,102 @@ def register_toil(
 @options.TMPVAR
 @options.VOLUMES
 @options.SINGULARITY
+@options.REGISTRY_CLIENT
+@options.SINGULARITY_EXECUTABLE
+@options.INSTANCE_TIMEOUT
+@options.STAGING
+@options.PROFILE
+@options.PROFILE_TRACE
 @options.VERSION
+@profiling.profiled
 def register_singularity(  # pylint: disable=R0913
     bindir,
     command,
+    targets,
+    targets_glob,
     image_repository,
     image_url,
     image_user,
     image_version,
     optdir,
     singularity,
+    registry_client,
     target,
     tmpvar,
     volumes,
+    executable,
+    instance_timeout,
+    staging,
 ):
-    """Register versioned singularity command in a bin directory."""
-    optdir = Path(optdir) / image_repository / image_version
+    """
+    Register versioned singularity commands in a bin directory.
+
+    Many commands of the same image can be registered at once with
+    `--targets` or `--targets_glob`, the image is resolved once and all
+    wrappers and links are written in one batch.
+    """
+    optroot = Path(optdir)
+    imagestore = images.get_store(optroot)
+    optdir = optroot / image_repository / image_version
     bindir = Path(bindir)
-    optexe = optdir / target
-    binexe = bindir / target
     image_url = image_url or f"docker://{image_user}/{image_repository}:{image_version}"
-
-    # do not overwrite targets
-    if os.path.isfile(optexe) or os.path.isfile(binexe):  # pragma: no cover
-        raise click.UsageError(f"Targets exist, exiting...\n\t{optexe}\n\t{binexe}")
+    commands = _get_singularity_commands(target, command, targets, targets_glob)
 
     # make sure dirs exist
     optdir.mkdir(exist_ok=True, parents=True)
     bindir.mkdir(exist_ok=True, parents=True)
 
-    # build command
-    command = [
-        singularity,
-        "exec",
-        "--workdir",
-        f"{tmpvar}/${{USER}}_{image_repository}_{image_version}_`uuidgen`",
-        " ".join(f"--bind {i}:{j}" for i, j in volumes),
-        _get_or_create_image(optdir, singularity, image_url),
-        command,
-        '"$@"\n',
-    ]
+    # wait for concurrent registrations of the same version
+    with utils.lock(optdir / ".lock"):
+        _check_targets(optroot, optdir, bindir, commands)
+
+        # only pull the image if the url changed since the last registration
+        fingerprint = dict(image=fingerprints.get_fingerprint(image_url=image_url))
+        changed = _remove_stale_parts(optdir, None, None, fingerprint)
+        singularity_image = _get_or_create_image(
+            optdir,
+            imagestore,
+            singularity,
+            image_url,
+            _get_registry_client(registry_client),
+        )
 
-    # link executables
-    click.echo("Creating and linking executable...")
-    optexe.write_text(f"#!/bin/bash\n{' '.join(command)}")
-    optexe.chmod(mode=0o755)
-    utils.force_symlink(optexe, binexe)
-    click.secho(
-        f"\nExecutables available at:\n" f"\n\t{str(optexe)}" f"\n\t{str(binexe)}\n",
-        fg="green",
-    )
+        # explicit targets take precedence over executables found in the image
+        if targets_glob:
+            found = _find_targets(singularity, singularity_image, targets_glob)
+            found = {i: j for i, j in found.items() if i not in commands}
+            _check_targets(optroot, optdir, bindir, found)
+            commands.update(found)
+
+        # build commands and link executables
+        executables = _get_singularity_executables(
+            optdir,
+            bindir,
+            commands,
+            executable,
+            singularity=singularity,
+            image=singularity_image,
+            volumes=volumes,
+            tmpvar=tmpvar,
+            prefix=f"{image_repository}_{image_version}",
+            timeout=instance_timeout,
+            staging=_get_staging(staging, singularity_image, imagestore, image_url),
+        )
+
+        _write_executables_and_index(
+            optroot,
+            executables,
+            fingerprint,
+            changed=changed,
+            kind="singularity",
+            name=image_repository,
+            version=image_version,
+            image=singularity_image,
+            image_url=image_url,
+            digest=images.get_image_digest(
+                singularity_image, imagestore, image_url, compute=False
+            ),
+        )
 
 
 @click.command()
@@ -190,84 +277,500 @@ def register_singularity(  # pylint: disable=R0913
 @options.BINDIR
 @options.OPTDIR
 @options.PYTHON3
+@options.ENVIRONMENT
+@options.EXECUTABLE
+@options.PROFILE
+@options.PROFILE_TRACE
 @options.VERSION
-def register_python(pypi_name, pypi_version, github_user, bindir, optdir, python):
+@profiling.profiled
+def register_python(
+    pypi_name,
+    pypi_version,
+    github_user,
+    bindir,
+    optdir,
+    python,
+    environment,
+    executable,
+):
     """Register versioned python pipelines in a bin directory."""
-    virtualenvwrapper = shutil.which("virtualenvwrapper.sh")
     python = shutil.which(python)
-    optdir = Path(optdir) / pypi_name / pypi_version
+    optroot = Path(optdir)
+    optdir = optroot / pypi_name / pypi_version
     bindir = Path(bindir)
     optexe = optdir / pypi_name
     binexe = bindir / f"{pypi_name}_{pypi_version}"
 
     # check paths
     assert python, "Could not determine the python path."
-    assert virtualenvwrapper, "Could not determine the virtualenvwrapper.sh path."
 
     # make sure dirs exist
     optdir.mkdir(exist_ok=True, parents=True)
     bindir.mkdir(exist_ok=True, parents=True)
 
-    # create virtual environment and install package
-    env = f"production__{pypi_name}__{pypi_version}"
-    click.echo(f"Creating virtual environment '{env}'...")
-    subprocess.check_output(
-        [
-            "/bin/bash",
-            "-c",
-            f"source {virtualenvwrapper} && mkvirtualenv -p {python} {env}",
-        ]
+    # wait for concurrent registrations of the same version
+    with utils.lock(optdir / ".lock"):
+        fingerprint = dict(
+            environment=_get_environment_fingerprint(
+                python, pypi_name, pypi_version, github_user, environment["optimize"]
+            )
+        )
+
+        # only install the package if the inputs changed since the last run
+        changed = _remove_stale_parts(optdir, pypi_name, pypi_version, fingerprint)
+        reuse = fingerprints.is_current(
+            optdir, "environment", fingerprint["environment"]
+        )
+
+        # create virtual environment and install package
+        toolpath = _install_package(
+            **_get_install_kwargs(
+                environment, python, pypi_name, pypi_version, github_user, reuse
+            )
+        )
+
+        if not reuse:
+            _optimize_environment(optroot, toolpath, environment)
+
+        # build command and link executables
+        script = wrappers.get_python_script(
+            toolpath,
+            executable["wrapper"],
+            _get_telemetry(
+                executable["telemetry_dir"], pypi_name, pypi_version, optexe.name
+            ),
+        )
+
+        if executable["usage_stamp"]:
+            script = wrappers.add_preamble(script, wrappers.get_usage_stamp(optdir))
+
+        _write_executable_and_index(
+            optroot,
+            optexe,
+            binexe,
+            script,
+            fingerprint,
+            changed=changed or not reuse,
+            kind="python",
+            name=pypi_name,
+            version=pypi_version,
+            target=optexe.name,
+            venv=Path(toolpath).parent.parent,
+            startup=_get_startup(toolpath),
+        )
+
+
+@click.command()
+@options.MANIFEST
+@options.JOBS
+@options.EXECUTOR
+@options.REPORT
+@options.PROFILE
+@options.PROFILE_TRACE
+@options.VERSION
+@profiling.profiled
+def register_batch(manifest, jobs, executor, report):
+    """Register multiple apps from a manifest using a bounded pool."""
+    registrations = batch.load_manifest(manifest)
+    click.echo(f"Registering {len(registrations)} apps using {jobs} {executor}s...")
+    results = batch.run_batch(registrations, jobs=jobs, executor=executor)
+    batch.echo_summary(results)
+
+    if report:
+        with open(report, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if any(i["status"] != "ok" for i in results):
+        raise click.ClickException("Some registrations failed.")
+
+
+def _get_install_kwargs(
+    environment, python, pypi_name, pypi_version, github_user, reuse
+):
+    """Get the `_install_package` arguments of the `--wheelhouse` and other options."""
+    return dict(
+        env_backend=environment["env_backend"],
+        python=python,
+        pypi_name=pypi_name,
+        pypi_version=pypi_version,
+        github_user=github_user,
+        wheelhouse=_get_wheelhouse(environment["wheelhouse"], environment["offline"]),
+        offline=environment["offline"],
+        artifacts=environment["artifacts"],
+        reuse=reuse,
     )
 
-    if github_user:
-        install_cmd = (
-            f"source {virtualenvwrapper} && workon {env} && "
-            f"pip install git+https://github.com/{github_user}/"
-            f"{pypi_name}@{pypi_version}#egg={pypi_name} && which {pypi_name}"
+
+def _optimize_environment(optroot, toolpath, environment):
+    """Optimize and deduplicate a new environment if requested."""
+    if environment["optimize"] != "none":
+        environments.optimize_environment(
+            Path(toolpath).parent.parent, toolpath, environment["optimize"]
         )
-    else:
-        install_cmd = (
-            f"source {virtualenvwrapper} && workon {env} && "
-            f"pip install {pypi_name}=={pypi_version} && which {pypi_name}"
+
+    if environment["dedup_venv"]:
+        from register_apps import dedup  # pylint: disable=C0415
+
+        result = dedup.deduplicate(optroot, venvs=[Path(toolpath).parent.parent])
+        click.echo(
+            f"Linked {result['linked']} files to other environments, "
+            f"freed {utils.format_bytes(result['freed'])}."
         )
 
-    click.echo(f"Installing package with '{install_cmd}'...")
-    toolpath = subprocess.check_output(["/bin/bash", "-c", install_cmd])
-    toolpath = toolpath.decode("utf-8").strip().split("\n")[-1]
-
-    # build command
-    command = [toolpath, '"$@"', "\n"]
-
-    # link executables
-    click.echo("Creating and linking executable...")
-    optexe.write_text(f"#!/bin/bash\n{' '.join(command)}")
-    optexe.chmod(mode=0o755)
-    utils.force_symlink(optexe, binexe)
-    click.secho(
-        f"\nExecutables available at:\n" f"\n\t{str(optexe)}" f"\n\t{str(binexe)}\n",
-        fg="green",
+
+def _get_registry_client(spec, offline=False):
+    """Get the client that records registry digests, None if offline."""
+    return None if offline else registries.get_client(spec)
+
+
+def _get_telemetry(directory, name, version, target):
+    """Get the telemetry preamble of a wrapper if a `directory` was provided."""
+    if not directory:
+        return None
+
+    log = telemetry.get_log(directory, name)
+    return wrappers.get_telemetry(log, version, target)
+
+
+def _get_wheelhouse(wheelhouse, offline):
+    if offline and not wheelhouse:
+        raise click.UsageError("--offline requires a --wheelhouse directory.")
+
+    if wheelhouse:
+        wheelhouse = Path(wheelhouse)
+        wheelhouse.mkdir(exist_ok=True, parents=True)
+
+    return wheelhouse
+
+
+def _get_environment_fingerprint(  # pylint: disable=R0913
+    python, pypi_name, pypi_version, github_user, optimize="none"
+):
+    # only optimized environments record it, so existing ones are kept
+    optimization = {"optimize": optimize} if optimize != "none" else {}
+    return fingerprints.get_fingerprint(
+        python=os.path.realpath(python),
+        pypi_name=pypi_name,
+        pypi_version=pypi_version,
+        github_user=github_user,
+        **optimization,
     )
 
 
-def _get_or_create_image(optdir, singularity, image_url):
-    # pull image
-    singularity_images = []
-    for i in ["*.simg", "*.sif"]:
-        singularity_images += list(optdir.glob(i))
+def _get_startup(toolpath):
+    """Get the entry point startup seconds measured after optimizing its environment."""
+    startup = environments.read_startup(Path(toolpath).parent.parent)
+    return (startup or {}).get("after")
+
+
+def _remove_stale_parts(optdir, pypi_name, pypi_version, fingerprint):
+    """Remove the image and rebuild the environment if inputs changed."""
+    changed = False
+
+    if "environment" in fingerprint and fingerprints.has_changed(
+        optdir, "environment", fingerprint["environment"]
+    ):
+        # the environment is replaced once the new one is installed
+        env = environments.get_env_name(pypi_name, pypi_version)
+        click.echo(f"Inputs changed, rebuilding virtual environment '{env}'...")
+        changed = True
+
+    if "image" in fingerprint and fingerprints.has_changed(
+        optdir, "image", fingerprint["image"]
+    ):
+        click.echo("Image url changed, removing previous image...")
+        changed = True
+
+        for i in images.get_images(optdir):
+            i.unlink()
+
+    return changed
 
-    assert (
-        not singularity_images or len(singularity_images) == 1
-    ), f"Found multiple images at {optdir}"
 
-    if singularity_images:
-        click.echo(f"Image exists at: {singularity_images[0]}")
-    else:
-        subprocess.check_call(
-            ["/bin/bash", "-c", f"umask 22 && {singularity} pull {image_url}"],
-            cwd=optdir,
+def _get_singularity_commands(target, command, targets, targets_glob):
+    """Get the commands of `--target/--command` and `--targets` by target."""
+    if bool(target) != bool(command):
+        raise click.UsageError("--target and --command must be used together.")
+
+    commands = {target: command} if target else {}
+
+    for i in targets:
+        name, _, cmd = i.partition("=")
+
+        if not name or not cmd.strip():
+            raise click.UsageError(f"Invalid target '{i}', use TARGET=COMMAND.")
+
+        if name in commands:
+            raise click.UsageError(f"Target '{name}' is used more than once.")
+
+        commands[name] = cmd
+
+    if not commands and not targets_glob:
+        raise click.UsageError(
+            "Use --target and --command, --targets or --targets_glob."
         )
 
+    for i in commands:
+        if "/" in i or i.startswith("."):
+            raise click.UsageError(f"Invalid target name '{i}'.")
+
+    return commands
+
+
+def _find_targets(singularity, image, pattern):
+    """Get the executables of an image that match a glob pattern by name."""
+    return {
+        os.path.basename(i): i
+        for i in images.find_executables(singularity, image, pattern)
+    }
+
+
+def _get_staging(staging, image, imagestore, image_url):
+    """Get the staging settings of the `--stage_dir` options, None if disabled."""
+    if not staging["stage_dir"]:
+        return None
+
+    return wrappers.get_staging(
+        image=image,
+        stage_dir=staging["stage_dir"],
+        limit=staging["stage_limit"] * 1024**3,
+        digest=images.get_image_digest(image, imagestore, image_url),
+        size=os.path.getsize(image),
+        verify=staging["stage_verify"],
+    )
+
+
+def _get_singularity_executables(optdir, bindir, commands, executable, **kwargs):
+    """Get the `(optexe, binexe, script)` of each singularity command."""
+    executables = []
+    name, version = optdir.parent.name, optdir.name
+
+    for target, cmd in sorted(commands.items()):
+        script = wrappers.get_singularity_script(
+            command=cmd,
+            mode=executable["wrapper"],
+            telemetry=_get_telemetry(
+                executable["telemetry_dir"], name, version, target
+            ),
+            **kwargs,
+        )
+
+        if executable["usage_stamp"]:
+            script = wrappers.add_preamble(script, wrappers.get_usage_stamp(optdir))
+
+        executables.append((optdir / target, bindir / target, script))
+
+    return executables
+
+
+def _check_targets(optroot, optdir, bindir, targets):
+    """Refuse to overwrite targets that were not registered by register_apps."""
+    recorded = fingerprints.read_fingerprints(optdir)
+    existing = [
+        i
+        for i in targets
+        if f"wrapper:{i}" not in recorded
+        and ((optdir / i).is_file() or (bindir / i).is_file())
+    ]
+
+    # wrappers registered before fingerprints were recorded are in the index
+    if existing:
+        indexed = {i.get("wrapper") for i in index.read_entries(optroot)}
+        existing = [i for i in existing if str(optdir / i) not in indexed]
+
+    if existing:  # pragma: no cover
+        raise click.UsageError(
+            "Targets exist, exiting..."
+            + "".join(f"\n\t{optdir / i}\n\t{bindir / i}" for i in existing)
+        )
+
+
+def _write_executable_and_index(  # pylint: disable=R0913
+    optroot, optexe, binexe, script, fingerprint, changed, **entry
+):
+    """Write and index the executable unless registered with the same inputs."""
+    _write_executables_and_index(
+        optroot, [(optexe, binexe, script)], fingerprint, changed, **entry
+    )
+
+
+def _write_executables_and_index(optroot, executables, fingerprint, changed, **entry):
+    """Write and index `(optexe, binexe, script)` executables in one batch."""
+    optdir = executables[0][0].parent
+    fingerprint = dict(fingerprint)
+    current, outdated = [], []
+
+    for optexe, binexe, script in executables:
+        part = f"wrapper:{optexe.name}"
+        fingerprint[part] = fingerprints.get_fingerprint(script=script, link=binexe)
+
+        if not changed and fingerprints.is_current(
+            optdir, part, fingerprint[part], outputs=[optexe, binexe]
+        ):
+            current.append(binexe)
+        else:
+            outdated.append((optexe, binexe, script))
+
+    if current:
+        click.secho(
+            "Already registered, nothing changed:"
+            + "".join(f"\n\t{i}" for i in current),
+            fg="green",
+        )
+
+    if outdated:
+        with profiling.span("write_executable", wrappers=len(outdated)):
+            wrappers.write_executables(outdated)
+
+        with profiling.span("index"):
+            index.add_entries(
+                optroot,
+                [
+                    dict(entry, target=optexe.name, wrapper=optexe, link=binexe)
+                    for optexe, binexe, _ in outdated
+                ],
+            )
+
+    fingerprints.write_fingerprints(optdir, **fingerprint)
+
+
+def _install_package(  # pylint: disable=R0913
+    env_backend,
+    python,
+    pypi_name,
+    pypi_version,
+    github_user,
+    wheelhouse,
+    offline,
+    artifacts=None,
+    reuse=False,
+):
+    env = environments.get_env_name(pypi_name, pypi_version)
+    env_dir = environments.get_workon_home() / env
+
+    # reuse environments installed by a concurrent registration
+    if reuse:
+        try:
+            toolpath = environments.get_entry_point(env_dir, pypi_name)
+            click.echo(f"Reusing virtual environment '{env}'...")
+            return toolpath
+        except exceptions.MissingOutputError:
+            pass
+
+    # other optdirs may use the environment, it's replaced once the new one works
+    build = f"{env}.{os.getpid()}.new" if env_dir.exists() else env
+    build_dir = environments.get_workon_home() / build
+
+    try:
+        toolpath = _build_environment(
+            build,
+            env_backend,
+            python,
+            pypi_name,
+            environments.get_pip_commands(
+                pypi_name, pypi_version, github_user, wheelhouse, offline
+            ),
+            artifacts,
+            artifacts and environments.get_artifact_name(env, python),
+        )
+    except BaseException:
+        if build != env:
+            shutil.rmtree(str(build_dir), ignore_errors=True)
+
+        raise
+
+    if build != env:
+        environments.replace_environment(build_dir, env_dir, python)
+        toolpath = environments.get_entry_point(env_dir, pypi_name)
+
+    return toolpath
+
+
+def _build_environment(
+    env, env_backend, python, pypi_name, pip_commands, artifacts, artifact_name
+):
+    """Create `env` from a prebuilt archive or installing the package in it."""
+    env_dir = environments.get_workon_home() / env
+
+    # unpack a prebuilt environment instead of installing the package
+    artifact = artifacts and environments.get_artifact(artifacts, artifact_name)
+
+    if artifact:
+        try:
+            environments.unpack_environment(artifact, env_dir, python)
+            toolpath = environments.get_entry_point(env_dir, pypi_name)
+            environments.verify_entry_point(toolpath)
+            return toolpath
+        except exceptions.PackageBaseException as error:
+            click.secho(f"Prebuilt environment failed: {error}", fg="yellow")
+            shutil.rmtree(str(env_dir), ignore_errors=True)
+
+    env_dir = environments.create_environment(
+        backend=env_backend, python=python, env=env
+    )
+
+    environments.install_package(env_dir, pip_commands)
+    toolpath = environments.get_entry_point(env_dir, pypi_name)
+
+    if artifacts:
+        environments.archive_environment(env_dir, artifacts, artifact_name)
+
+    return toolpath
+
+
+def _install_package_and_get_image(install_kwargs, image_args):
+    optdir = image_args[0]
+    env_dir = environments.get_workon_home() / environments.get_env_name(
+        install_kwargs["pypi_name"], install_kwargs["pypi_version"]
+    )
+
+    env_existed = env_dir.exists()
+    image_existed = bool(images.get_images(optdir))
+
+    # imported here since only register_toil overlaps phases
+    from concurrent import futures  # pylint: disable=C0415
+
+    # pip is cpu and pypi bound while the pull is registry and squashfs bound
+    cancelled = threading.Event()
+
+    with futures.ThreadPoolExecutor(max_workers=2) as pool:
+        install = pool.submit(
+            processes.cancellable(_install_package, cancelled), **install_kwargs
+        )
+        image = pool.submit(
+            processes.cancellable(_get_or_create_image, cancelled), *image_args
+        )
+
+        # a failure kills the other phase instead of waiting for it
+        done, _ = futures.wait([install, image], return_when=futures.FIRST_EXCEPTION)
+        error = next((i.exception() for i in done if i.exception()), None)
+
+        if error:
+            processes.cancel(cancelled)
+
+    if error:
+        # remove what this registration created, the image store is kept
+        if not env_existed:
+            shutil.rmtree(str(env_dir), ignore_errors=True)
+
+        if not image_existed:
+            for i in images.get_images(optdir):
+                i.unlink()
+
+        raise error
+
+    return install.result(), image.result()
+
+
+def _get_or_create_image(
+    optdir, imagestore, singularity, image_url, registry_client=None
+):
+    singularity_image = images.get_or_create_image(
+        optdir, imagestore, singularity, image_url, registry_client
+    )
+
     # fix singularity permissions
-    singularity_image = next(optdir.glob("*.simg"), next(optdir.glob("*.sif")))
-    singularity_image.chmod(mode=0o755)
+    with profiling.span("chmod"):
+        singularity_image.chmod(mode=0o755)
+
     return str(singularity_image)
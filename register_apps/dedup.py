@@ -0,0 +1,235 @@
+"""register_apps deduplication of identical files across virtual environments."""
+
+from concurrent import futures
+from pathlib import Path
+import json
+import os
+import stat
+
+import click
+
+from register_apps import cleanup
+from register_apps import images
+from register_apps import utils
+
+# json file inside the optdir with the digests of previously hashed files
+INDEX_FILENAME = ".dedup.json"
+
+# directories of the virtual environments that are deduplicated, scripts and
+# configuration files are skipped because they are rewritten for each venv
+PATTERNS = ["lib/python*/site-packages", "lib64/python*/site-packages"]
+
+# stat fields that must match for a recorded digest to be reused
+STAT_FIELDS = ("st_dev", "st_ino", "st_size", "st_mtime_ns")
+
+
+def get_index_path(optdir):
+    """Get the dedup index path for an `optdir` root."""
+    return Path(optdir) / INDEX_FILENAME
+
+
+def read_index(optdir):
+    """Read the recorded digests, keyed by path."""
+    path = get_index_path(optdir)
+    return json.loads(path.read_text()) if path.is_file() else {}
+
+
+def write_index(optdir, recorded):
+    """Atomically write the recorded digests."""
+    path = get_index_path(optdir)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(recorded, sort_keys=True))
+    os.replace(str(tmp_path), str(path))
+
+
+def get_registered_venvs(optdir):
+    """Get the virtual environments of the versions registered in `optdir`."""
+    return sorted({j for i in cleanup.get_versions(optdir) for j in i["venvs"]})
+
+
+def scan_venvs(venvs, min_size=1):
+    """
+    Find the regular files of the `PATTERNS` directories of `venvs`.
+
+    Arguments:
+        venvs (list): virtual environment directories.
+        min_size (int): ignore smaller files.
+
+    Returns:
+        dict: stat results keyed by path.
+    """
+    files = {}
+
+    for venv in venvs:
+        for root in (j for i in PATTERNS for j in Path(venv).glob(i)):
+            for directory, _, filenames in os.walk(str(root)):
+                for i in filenames:
+                    path = os.path.join(directory, i)
+                    result = os.lstat(path)
+
+                    if stat.S_ISREG(result.st_mode) and result.st_size >= min_size:
+                        files[path] = result
+
+    return files
+
+
+def _get_record(result, digest):
+    record = {i: getattr(result, i) for i in STAT_FIELDS}
+    record.update(mode=result.st_mode, uid=result.st_uid, digest=digest)
+    return record
+
+
+def _is_current(record, result):
+    return all(record.get(i) == getattr(result, i) for i in STAT_FIELDS)
+
+
+def hash_files(files, recorded, jobs=4):
+    """
+    Get the records of `files`, only files not recorded before are hashed.
+
+    Arguments:
+        files (dict): stat results keyed by path.
+        recorded (dict): records of previously hashed files.
+        jobs (int): number of files hashed in parallel.
+
+    Returns:
+        dict: records with stat fields and `digest`, keyed by path.
+    """
+    records, pending = {}, {}
+
+    for path, result in files.items():
+        if _is_current(recorded.get(path, {}), result):
+            records[path] = recorded[path]
+        else:
+            # hardlinked paths are hashed only once
+            pending.setdefault((result.st_dev, result.st_ino), []).append(path)
+
+    with futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        digests = pool.map(images.get_file_digest, [i[0] for i in pending.values()])
+
+        for paths, digest in zip(pending.values(), digests):
+            for i in paths:
+                records[i] = _get_record(files[i], digest)
+
+    return records
+
+
+def get_duplicates(records):
+    """
+    Group records of different inodes that can be linked together.
+
+    Files are grouped by digest, size, device, mode and owner, since all the
+    links of an inode share its permissions and ownership.
+
+    Arguments:
+        records (dict): records returned by `hash_files`, keyed by path.
+
+    Returns:
+        list: lists of paths, the first path of each list is the one that
+            will be kept (the inode with more paths).
+    """
+    groups = {}
+
+    for path, i in records.items():
+        key = (i["digest"], i["st_size"], i["st_dev"], i["mode"], i["uid"])
+        groups.setdefault(key, {}).setdefault(i["st_ino"], []).append(path)
+
+    duplicates = []
+
+    for inodes in groups.values():
+        if len(inodes) > 1:
+            inodes = sorted(inodes.values(), key=lambda i: (-len(i), sorted(i)))
+            duplicates.append([j for i in inodes for j in sorted(i)])
+
+    return sorted(duplicates)
+
+
+def link_duplicates(duplicates, records, dry_run=False):
+    """
+    Replace duplicated files with hardlinks to the first path of each group.
+
+    Files that were removed or changed since they were hashed are skipped.
+
+    Arguments:
+        duplicates (list): groups returned by `get_duplicates`.
+        records (dict): records returned by `hash_files`, keyed by path, the
+            records of linked paths are updated.
+        dry_run (bool): only count the bytes that would be freed.
+
+    Returns:
+        dict: with `linked` (number of paths) and `freed` (bytes) keys.
+    """
+    linked, freed, unlinked = 0, 0, {}
+
+    for paths in duplicates:
+        source = None
+
+        for path in paths:
+            try:
+                result = os.lstat(path)
+            except OSError:
+                continue
+
+            if not _is_current(records[path], result):
+                continue
+
+            if source is None or result.st_ino == records[source]["st_ino"]:
+                source = source or path
+                continue
+
+            if not dry_run:
+                try:
+                    utils.force_link(source, path)
+                except OSError as error:
+                    click.secho(f"Skipped {path}: {error}", fg="yellow", err=True)
+                    continue
+
+                records[path] = records[source]
+
+            # an inode is freed once all of its links are replaced
+            inode = (result.st_dev, result.st_ino)
+            unlinked[inode] = unlinked.get(inode, 0) + 1
+            freed += result.st_size if unlinked[inode] == result.st_nlink else 0
+            linked += 1
+
+    return {"linked": linked, "freed": freed}
+
+
+def deduplicate(optdir, venvs=None, min_size=1, jobs=4, dry_run=False):
+    """
+    Hardlink identical files across the virtual environments of `optdir`.
+
+    Digests are recorded in the optdir so that later runs only hash new or
+    modified files. When `venvs` are provided (e.g. after an installation),
+    only their files are scanned and linked to previously recorded files.
+
+    Arguments:
+        optdir (str): optdir root.
+        venvs (list): virtual environments to scan, defaults to all the
+            registered environments.
+        min_size (int): ignore smaller files.
+        jobs (int): number of files hashed in parallel.
+        dry_run (bool): only report what would be linked.
+
+    Returns:
+        dict: with `scanned`, `hashed`, `linked` and `freed` (bytes) keys.
+    """
+    with utils.lock(get_index_path(optdir).with_suffix(".lock")):
+        recorded = read_index(optdir)
+        files = scan_venvs(venvs or get_registered_venvs(optdir), min_size)
+        records = hash_files(files, recorded, jobs)
+        hashed = sum(1 for i in records if records[i] is not recorded.get(i))
+
+        # previously recorded files are still linking candidates
+        candidates = dict(records)
+
+        if venvs:
+            for path, record in recorded.items():
+                candidates.setdefault(path, record)
+
+        result = link_duplicates(get_duplicates(candidates), candidates, dry_run)
+
+        if not dry_run:
+            write_index(optdir, candidates)
+
+    return dict(result, scanned=len(files), hashed=hashed)
@@ -0,0 +1,656 @@
+"""register_apps virtual environments backends."""
+
+from pathlib import Path
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+import click
+
+from register_apps import archives
+from register_apps import exceptions
+from register_apps import processes
+from register_apps import profiling
+from register_apps import utils
+
+# backends used to create the production virtual environments
+BACKENDS = ["venv", "virtualenvwrapper"]
+
+# post-install optimizations, each one includes the previous ones
+OPTIMIZATIONS = ["none", "bytecode", "zip"]
+
+# importable archive of the pure python packages, added to sys.path by a .pth
+ZIP_FILENAME = "register_apps.zip"
+ZIP_PTH_FILENAME = "register_apps_zip.pth"
+
+# packages that are not packed (pip and setuptools must stay patchable)
+ZIP_EXCLUDE = {"pip", "setuptools", "pkg_resources", "_distutils_hack", "wheel"}
+
+# measured startup times of the entry point, kept inside the environment
+STARTUP_FILENAME = ".register_apps_startup.json"
+
+# entry point runs used to measure the startup time, the first one is cold
+STARTUP_RUNS = 3
+
+# run by the environment interpreter (python 2 compatible), registered
+# environments are never modified so pycs don't need to check their sources
+COMPILE_SCRIPT = """
+import compileall, py_compile, sys
+kwargs = {}
+if sys.version_info >= (3, 5):
+    kwargs["workers"] = 0
+if sys.version_info >= (3, 7):
+    kwargs["invalidation_mode"] = py_compile.PycInvalidationMode.UNCHECKED_HASH
+compileall.compile_dir(sys.argv[1], quiet=1, **kwargs)
+"""
+
+# run by the environment interpreter, packs pycs and sources of `names`
+ZIP_SCRIPT = """
+import os, sys, zipfile
+path, site, names = sys.argv[1], sys.argv[2], sys.argv[3:]
+with zipfile.PyZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+    for name in names:
+        archive.writepy(os.path.join(site, name))
+        for root, dirs, files in os.walk(os.path.join(site, name)):
+            dirs[:] = [i for i in dirs if i != "__pycache__"]
+            for i in files:
+                if i.endswith(".py"):
+                    i = os.path.join(root, i)
+                    archive.write(i, os.path.relpath(i, site))
+"""
+
+
+def get_env_name(pypi_name, pypi_version):
+    """Get the name of the virtual environment of a registered package."""
+    return f"production__{pypi_name}__{pypi_version}"
+
+
+def get_workon_home():
+    """Get the directory where virtual environments are created."""
+    return Path(os.getenv("WORKON_HOME", "~/.virtualenvs")).expanduser()
+
+
+def create_environment(backend, python, env):
+    """
+    Create the virtual environment `env` inside the workon home.
+
+    The `venv` backend calls the interpreter directly (using the stdlib
+    `venv` module or `virtualenv` for interpreters without it), while the
+    `virtualenvwrapper` backend sources `virtualenvwrapper.sh` once.
+
+    Arguments:
+        backend (str): one of `BACKENDS`.
+        python (str): path to the python interpreter.
+        env (str): name of the virtual environment.
+
+    Returns:
+        Path: path to the virtual environment.
+    """
+    env_dir = get_workon_home() / env
+    click.echo(f"Creating virtual environment '{env}' with {backend}...")
+
+    with profiling.span("create_environment", backend=backend, env=env) as span:
+        if backend == "virtualenvwrapper":
+            virtualenvwrapper = shutil.which("virtualenvwrapper.sh")
+            assert (
+                virtualenvwrapper
+            ), "Could not determine the virtualenvwrapper.sh path."
+            processes.run(
+                [
+                    "/bin/bash",
+                    "-c",
+                    f"source {virtualenvwrapper} && mkvirtualenv -p {python} {env}",
+                ],
+                phase="venv",
+                echo=False,
+            )
+        else:
+            env_dir.parent.mkdir(exist_ok=True, parents=True)
+
+            try:
+                processes.run(
+                    [python, "-m", "venv", str(env_dir)], phase="venv", echo=False
+                )
+            except subprocess.CalledProcessError:
+                # python2 and interpreters without ensurepip lack a working venv,
+                # use the virtualenv installed with register_apps to create it
+                shutil.rmtree(str(env_dir), ignore_errors=True)
+                processes.run(
+                    [sys.executable, "-m", "virtualenv", "-p", python, str(env_dir)],
+                    phase="venv",
+                    echo=False,
+                )
+
+        span["exit_code"] = 0
+
+    return env_dir
+
+
+def get_pip_commands(  # pylint: disable=R0913
+    pypi_name, pypi_version, github_user=None, wheelhouse=None, offline=False
+):
+    """
+    Get the pip arguments needed to install a package.
+
+    Arguments:
+        pypi_name (str): package name.
+        pypi_version (str): package version or git tag.
+        github_user (str): install from github instead of PyPi.
+        wheelhouse (Path): directory of cached wheels.
+        offline (bool): install only from `wheelhouse`.
+
+    Returns:
+        list: list of pip arguments lists to be run in order.
+    """
+    # git tags such as v0.1.1 are normalized by pip to the wheel version
+    pinned = f"{pypi_name}=={pypi_version}"
+    local = ["install", "--no-index", "--find-links", str(wheelhouse), pinned]
+
+    if offline:
+        return [local]
+
+    if github_user:
+        requirement = (
+            f"git+https://github.com/{github_user}/"
+            f"{pypi_name}@{pypi_version}#egg={pypi_name}"
+        )
+    else:
+        requirement = pinned
+
+    if not wheelhouse:
+        return [["install", requirement]]
+
+    # build missing wheels into the wheelhouse, then install only from it
+    wheel = ["wheel", "--wheel-dir", str(wheelhouse), "--find-links", str(wheelhouse)]
+    return [wheel + [requirement], local]
+
+
+def install_package(env_dir, pip_commands):
+    """Run `pip_commands` with the pip of `env_dir`, without activating it."""
+    pip = [str(Path(env_dir) / "bin" / "python"), "-m", "pip"]
+
+    for i in pip_commands:
+        click.echo(f"Installing package with 'pip {' '.join(i)}'...")
+
+        # wheels built in a wheelhouse are downloaded or built by this call
+        wheelhouse = i[i.index("--wheel-dir") + 1] if "--wheel-dir" in i else None
+        size = _get_dir_size(wheelhouse) if wheelhouse else 0
+
+        with profiling.span("pip", command=i[0], args=i) as span:
+            processes.run(pip + i, phase="pip", retry=True)
+            span["exit_code"] = 0
+
+            if wheelhouse:
+                span["bytes"] = _get_dir_size(wheelhouse) - size
+
+
+def _get_dir_size(directory):
+    """Get the bytes of the files in `directory` (not recursive)."""
+    try:
+        with os.scandir(str(directory)) as entries:
+            return sum(i.stat().st_size for i in entries if i.is_file())
+    except OSError:
+        return 0
+
+
+def get_entry_point(env_dir, name):
+    """
+    Get the path to the `name` executable of a virtual environment.
+
+    Arguments:
+        env_dir (Path): path to the virtual environment.
+        name (str): executable name.
+
+    Returns:
+        str: path to the executable.
+    """
+    toolpath = Path(env_dir) / "bin" / name
+
+    if not os.access(str(toolpath), os.X_OK):
+        raise exceptions.MissingOutputError(f"Entry point not found: {toolpath}")
+
+    return str(toolpath)
+
+
+def get_artifact_name(env, python):
+    """
+    Get the name of the prebuilt archive of `env` for a python interpreter.
+
+    Archives are specific to the interpreter version and the machine
+    architecture, e.g. `production__a__v1__py3.6__x86_64`.
+
+    Arguments:
+        env (str): name of the virtual environment.
+        python (str): path to the python interpreter.
+
+    Returns:
+        str: artifact name without the archive suffix.
+    """
+    version = processes.run(
+        [python, "-c", "import sys; print('%d.%d' % sys.version_info[:2])"],
+        phase="python",
+        echo=False,
+        capture=True,
+    )
+
+    return f"{env}__py{version.strip()}__{os.uname().machine}"
+
+
+def get_artifact(artifacts, name):
+    """Get the path of an existing prebuilt archive `name`, None if missing."""
+    for i in archives.COMPRESSIONS.values():
+        artifact = Path(artifacts) / f"{name}.tar{i}"
+
+        if artifact.is_file():
+            return artifact
+
+    return None
+
+
+def archive_environment(env_dir, artifacts, name, compression="auto"):
+    """
+    Byte-compile `env_dir` and archive it as a relocatable prebuilt artifact.
+
+    Arguments:
+        env_dir (Path): path to the virtual environment.
+        artifacts (Path): directory of prebuilt archives.
+        name (str): artifact name (see `get_artifact_name`).
+        compression (str): `auto`, or one of `archives.COMPRESSIONS`.
+
+    Returns:
+        Path: path to the archive.
+    """
+    env_dir = Path(env_dir)
+    compression = archives.get_compression(compression)
+    artifact = Path(artifacts) / f"{name}.tar{archives.COMPRESSIONS[compression]}"
+    artifact.parent.mkdir(exist_ok=True, parents=True)
+    click.echo(f"Archiving virtual environment in {artifact}...")
+
+    # byte-compile once so that unpacked environments don't write pyc files
+    precompile_environment(env_dir)
+
+    metadata = Path(tempfile.mkdtemp(dir=str(artifact.parent))) / "artifact.json"
+    metadata.write_text(json.dumps({"env_dir": str(env_dir)}))
+    tmp_artifact = artifact.with_suffix(f".{os.getpid()}.tmp")
+
+    try:
+        with profiling.span("archive_environment", compression=compression) as span:
+            with archives.open_compressed(tmp_artifact, compression) as stream:
+                with tarfile.open(fileobj=stream, mode="w|") as tar:
+                    tar.add(str(metadata), arcname=metadata.name)
+                    tar.add(str(env_dir), arcname="env")
+
+            span["bytes"] = tmp_artifact.stat().st_size
+            os.replace(str(tmp_artifact), str(artifact))
+    finally:
+        shutil.rmtree(str(metadata.parent), ignore_errors=True)
+
+        if tmp_artifact.exists():
+            tmp_artifact.unlink()
+
+    return artifact
+
+
+def extract_environment_member(tar, member, path, python):
+    """
+    Extract a tar `member` of an archived environment in `path`.
+
+    Interpreter links to absolute paths are linked to `python` instead, other
+    links must stay in `path` (see `archives.check_member`).
+
+    Arguments:
+        tar (tarfile.TarFile): archive opened for reading.
+        member (tarfile.TarInfo): archive member.
+        path (str): extraction directory.
+        python (str): path to the python interpreter of this site.
+    """
+    name = Path(member.name)
+
+    if (
+        member.issym()
+        and os.path.isabs(member.linkname)
+        and name.parent.name == "bin"
+        and name.name.startswith("python")
+    ):
+        utils.force_symlink(python, archives.get_member_path(member, path))
+    else:
+        archives.extract_member(tar, member, path)
+
+
+def unpack_environment(artifact, env_dir, python):
+    """
+    Unpack a prebuilt artifact in `env_dir` and relocate it.
+
+    Script shebangs and paths are rewritten for `env_dir`, and the
+    interpreter links and `pyvenv.cfg` are pointed to `python`.
+
+    Arguments:
+        artifact (Path): archive created with `archive_environment`.
+        env_dir (Path): path to the virtual environment.
+        python (str): path to the python interpreter of this site.
+
+    Returns:
+        Path: path to the virtual environment.
+    """
+    env_dir = Path(env_dir)
+    compression = "zstd" if str(artifact).endswith(".zst") else "gzip"
+    env_dir.parent.mkdir(exist_ok=True, parents=True)
+    tmpdir = Path(tempfile.mkdtemp(dir=str(env_dir.parent)))
+    click.echo(f"Unpacking prebuilt virtual environment {artifact}...")
+
+    try:
+        with profiling.span("unpack_environment", bytes=os.path.getsize(artifact)):
+            with archives.open_decompressed(artifact, compression) as stream:
+                with tarfile.open(fileobj=stream, mode="r|") as tar:
+                    for member in tar:
+                        extract_environment_member(tar, member, str(tmpdir), python)
+
+        metadata = json.loads((tmpdir / "artifact.json").read_text())
+        relocate_environment(tmpdir / "env", metadata["env_dir"], env_dir, python)
+        shutil.rmtree(str(env_dir), ignore_errors=True)
+        os.replace(str(tmpdir / "env"), str(env_dir))
+    finally:
+        shutil.rmtree(str(tmpdir), ignore_errors=True)
+
+    return env_dir
+
+
+def relocate_environment(env_dir, old_env_dir, new_env_dir, python):
+    """
+    Rewrite the paths of a virtual environment moved from `old_env_dir`.
+
+    Arguments:
+        env_dir (Path): current location of the environment files.
+        old_env_dir (str): path where the environment was created.
+        new_env_dir (Path): path where the environment will be used.
+        python (str): path to the python interpreter of this site.
+    """
+    env_dir, python = Path(env_dir), os.path.realpath(python)
+    utils.rewrite_paths((env_dir / "bin").iterdir(), {old_env_dir: str(new_env_dir)})
+
+    for i in (env_dir / "bin").glob("python*"):
+        if i.is_symlink() and os.path.isabs(os.readlink(str(i))):
+            utils.force_symlink(python, i)
+
+    config = env_dir / "pyvenv.cfg"
+
+    if config.is_file():
+        lines = config.read_text().splitlines()
+        lines = [
+            f"home = {os.path.dirname(python)}" if i.startswith("home =") else i
+            for i in lines
+        ]
+
+        config.write_text("\n".join(lines) + "\n")
+
+
+def replace_environment(new_env_dir, env_dir, python):
+    """
+    Replace `env_dir` with the environment built in `new_env_dir`.
+
+    Environments are shared by every optdir that registers the same version,
+    so they're rebuilt apart and only swapped in once complete.
+
+    Arguments:
+        new_env_dir (Path): path to the new virtual environment.
+        env_dir (Path): path to the replaced virtual environment.
+        python (str): path to the python interpreter of the environment.
+    """
+    new_env_dir, env_dir = Path(new_env_dir), Path(env_dir)
+    old_env_dir = new_env_dir.with_name(f"{new_env_dir.name}.old")
+    relocate_environment(new_env_dir, str(new_env_dir), env_dir, python)
+    click.echo(f"Replacing virtual environment '{env_dir.name}'...")
+
+    try:
+        os.rename(str(env_dir), str(old_env_dir))
+    except FileNotFoundError:
+        pass
+
+    os.rename(str(new_env_dir), str(env_dir))
+    shutil.rmtree(str(old_env_dir), ignore_errors=True)
+
+
+def verify_entry_point(toolpath, timeout=300):
+    """
+    Check that an entry point runs (i.e. `toolpath --help` succeeds).
+
+    Arguments:
+        toolpath (str): path to the executable.
+        timeout (int): maximum seconds to wait.
+
+    Raises:
+        ValidationError: if the entry point fails.
+    """
+    try:
+        with profiling.span("verify_entry_point") as span:
+            processes.run(
+                [toolpath, "--help"], phase="verify", echo=False, timeout=timeout
+            )
+
+            span["exit_code"] = 0
+    except (OSError, subprocess.SubprocessError) as error:
+        raise exceptions.ValidationError(f"Entry point doesn't run: {error}")
+
+
+def precompile_environment(env_dir):
+    """
+    Byte-compile all the python files of `env_dir` in parallel.
+
+    Python 3.7+ interpreters write unchecked hash-based pycs, so imports
+    don't stat the sources of the (never modified) registered environments.
+
+    Arguments:
+        env_dir (Path): path to the virtual environment.
+    """
+    env_dir = Path(env_dir)
+
+    with profiling.span("compileall") as span:
+        processes.run(
+            [str(env_dir / "bin" / "python"), "-c", COMPILE_SCRIPT, str(env_dir)],
+            phase="compileall",
+            echo=False,
+        )
+
+        span["exit_code"] = 0
+
+
+def get_site_packages(env_dir):
+    """Get the site-packages directory of a virtual environment."""
+    for i in sorted(Path(env_dir).glob("lib/python*/site-packages")):
+        return i
+
+    raise exceptions.MissingOutputError(f"No site-packages found in {env_dir}")
+
+
+def get_zippable(site_packages):
+    """
+    Get the top level modules and packages of `site_packages` that are pure python.
+
+    Packages with extension modules, data files or subdirectories that are
+    not packages are left out, since they can't be imported from a zip or
+    expect to read files next to their modules.
+
+    Arguments:
+        site_packages (Path): site-packages directory.
+
+    Returns:
+        list: sorted file and directory names.
+    """
+    names = []
+
+    for i in sorted(os.listdir(str(site_packages))):
+        path = Path(site_packages) / i
+
+        if i.split(".")[0] in ZIP_EXCLUDE or i.startswith(("_", ".")):
+            continue
+
+        if path.is_file() and i.endswith(".py"):
+            names.append(i)
+        elif path.is_dir() and _is_pure_package(path):
+            names.append(i)
+
+    return names
+
+
+def _is_pure_package(path):
+    """Check if all the files of a package directory are python sources."""
+    if not (path / "__init__.py").is_file():
+        return False
+
+    for root, dirs, files in os.walk(str(path)):
+        dirs[:] = [i for i in dirs if i != "__pycache__"]
+
+        if not os.path.isfile(os.path.join(root, "__init__.py")):
+            return False
+
+        if any(not i.endswith(".py") and i != "py.typed" for i in files):
+            return False
+
+    return True
+
+
+def pack_environment(env_dir, toolpath):
+    """
+    Move the pure python packages of `env_dir` to a single importable zip.
+
+    Importing from one zip replaces the directory listings and stats of
+    many files in NFS-backed environments by a single file read. Package
+    metadata (e.g. dist-info) is kept in site-packages. The entry point is
+    verified and the packages are restored if it doesn't run from the zip.
+
+    Arguments:
+        env_dir (Path): path to the virtual environment.
+        toolpath (str): entry point used to verify the packed environment.
+
+    Returns:
+        list: names of the packed modules and packages.
+    """
+    site_packages = get_site_packages(env_dir)
+    names = get_zippable(site_packages)
+    archive, pth = site_packages / ZIP_FILENAME, site_packages / ZIP_PTH_FILENAME
+
+    # environments are packed once, the archive is never modified
+    if not names or archive.exists():
+        return []
+
+    # packed files are kept until the entry point runs from the zip
+    backup = Path(tempfile.mkdtemp(dir=str(env_dir), prefix=".unpacked"))
+
+    try:
+        with profiling.span("pack_environment", packages=len(names)) as span:
+            processes.run(
+                [str(Path(env_dir) / "bin" / "python"), "-c", ZIP_SCRIPT, str(archive)]
+                + [str(site_packages)]
+                + names,
+                phase="compileall",
+                echo=False,
+            )
+
+            pth.write_text(ZIP_FILENAME + "\n")
+            span["bytes"] = archive.stat().st_size
+
+            for i in names:
+                os.replace(str(site_packages / i), str(backup / i))
+
+        verify_entry_point(toolpath)
+    except (exceptions.ValidationError, subprocess.SubprocessError) as error:
+        click.secho(f"Packing failed, keeping packages: {error}", fg="yellow")
+
+        for i in os.listdir(str(backup)):
+            os.replace(str(backup / i), str(site_packages / i))
+
+        for i in archive, pth:
+            if i.exists():
+                i.unlink()
+
+        names = []
+    finally:
+        shutil.rmtree(str(backup), ignore_errors=True)
+
+    return names
+
+
+def measure_startup(toolpath, runs=STARTUP_RUNS):
+    """
+    Measure the seconds it takes to run `toolpath --help`.
+
+    Arguments:
+        toolpath (str): path to the executable.
+        runs (int): number of runs, the first one is the cold start.
+
+    Raises:
+        ValidationError: if the entry point fails.
+
+    Returns:
+        dict: `cold` (first run) and `warm` (median of the others) seconds.
+    """
+    seconds = []
+
+    with profiling.span("measure_startup") as span:
+        for _ in range(runs):
+            start = time.perf_counter()
+            verify_entry_point(toolpath)
+            seconds.append(round(time.perf_counter() - start, 3))
+
+        warm = sorted(seconds[1:] or seconds)
+        span.update(cold=seconds[0], warm=warm[len(warm) // 2])
+
+    return {"cold": seconds[0], "warm": warm[len(warm) // 2]}
+
+
+def optimize_environment(env_dir, toolpath, optimization):
+    """
+    Precompile and optionally pack `env_dir`, measuring the entry point startup.
+
+    The startup times before and after the optimization are written to the
+    environment so that registrations that reuse it can report them.
+
+    Arguments:
+        env_dir (Path): path to the virtual environment.
+        toolpath (str): path to the entry point.
+        optimization (str): one of `OPTIMIZATIONS`.
+
+    Returns:
+        dict: `optimization`, startup times `before` and `after` (see
+            `measure_startup`, None if the entry point doesn't run) and
+            the `packed` modules and packages.
+    """
+    env_dir = Path(env_dir)
+    result = {"optimization": optimization, "before": None, "after": None}
+
+    try:
+        result["before"] = measure_startup(toolpath)
+    except exceptions.ValidationError as error:
+        click.secho(f"Can't measure startup time: {error}", fg="yellow")
+
+    click.echo(f"Optimizing virtual environment ({optimization})...")
+    precompile_environment(env_dir)
+
+    # packing can only be verified with an entry point that runs
+    if optimization == "zip" and result["before"]:
+        result["packed"] = pack_environment(env_dir, toolpath)
+
+    if result["before"]:
+        result["after"] = measure_startup(toolpath)
+        click.echo(
+            f"Startup time: {result['before']['cold']:.3f}s cold, "
+            f"{result['before']['warm']:.3f}s warm before, "
+            f"{result['after']['cold']:.3f}s cold, "
+            f"{result['after']['warm']:.3f}s warm after."
+        )
+
+    (env_dir / STARTUP_FILENAME).write_text(json.dumps(result, indent=4))
+    return result
+
+
+def read_startup(env_dir):
+    """Read the startup times recorded by `optimize_environment`, None if missing."""
+    try:
+        return json.loads((Path(env_dir) / STARTUP_FILENAME).read_text())
+    except (OSError, ValueError):
+        return None
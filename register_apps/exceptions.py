@@ -39,3 +39,8 @@ class CantBeRunError(PackageBaseException):
 class MissingDataError(PackageBaseException):
 
     """A class to raise when data is missing."""
+
+
+class CancelledError(PackageBaseException):
+
+    """A class to raise when a command is cancelled."""
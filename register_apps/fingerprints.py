@@ -0,0 +1,67 @@
+"""register_apps fingerprints of the inputs used to register a version."""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+
+# json file created next to each optdir entry (i.e. optdir/name/version)
+FINGERPRINT_FILENAME = ".fingerprint"
+
+
+def get_fingerprint(**inputs):
+    """Get the sha256 hex digest of the resolved `inputs` of a registration."""
+    inputs = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(inputs.encode("utf-8")).hexdigest()
+
+
+def read_fingerprints(optdir):
+    """
+    Read the fingerprints recorded for a registration directory.
+
+    Arguments:
+        optdir (Path): registration directory (e.g. optdir/name/version).
+
+    Returns:
+        dict: fingerprints by part (e.g. `environment`, `image` or
+            `wrapper:<target>`), empty if none were recorded.
+    """
+    path = Path(optdir) / FINGERPRINT_FILENAME
+
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_fingerprints(optdir, **fingerprints):
+    """Atomically update the recorded `fingerprints` of a registration."""
+    path = Path(optdir) / FINGERPRINT_FILENAME
+    recorded = read_fingerprints(optdir)
+    recorded.update(fingerprints)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(recorded, indent=4, sort_keys=True))
+    os.replace(str(tmp_path), str(path))
+
+
+def is_current(optdir, part, fingerprint, outputs=()):
+    """
+    Check if `part` was registered with the same inputs and still exists.
+
+    Arguments:
+        optdir (Path): registration directory.
+        part (str): registration part name.
+        fingerprint (str): fingerprint of the current inputs.
+        outputs (list): paths that must exist for `part` to be reused.
+
+    Returns:
+        bool: True if `part` doesn't need to be regenerated.
+    """
+    recorded = read_fingerprints(optdir).get(part)
+    return recorded == fingerprint and all(os.path.exists(str(i)) for i in outputs)
+
+
+def has_changed(optdir, part, fingerprint):
+    """Check if `part` was registered before with different inputs."""
+    recorded = read_fingerprints(optdir).get(part)
+    return recorded is not None and recorded != fingerprint
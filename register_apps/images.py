@@ -0,0 +1,451 @@
+"""register_apps content-addressed singularity image store."""
+
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+
+import click
+
+from register_apps import exceptions
+from register_apps import processes
+from register_apps import profiling
+from register_apps import registries
+from register_apps import utils
+
+# name of the image store directory created inside the optdir
+STORE_DIRNAME = ".images"
+
+# extensions of the images created by singularity pull
+IMAGE_PATTERNS = ["*.simg", "*.sif"]
+
+# pull directories older than this number of seconds were interrupted
+STALE_PULL = 24 * 3600
+
+# lists the executable files matching a glob ($1) inside an image
+FIND_EXECUTABLES = 'for i in $1; do [ -f "$i" ] && [ -x "$i" ] && echo "$i"; done; true'
+
+# SIF global header: `SIF_MAGIC` after the launch script, then little endian
+# data offset and data size fields that add up to the image size
+SIF_MAGIC = (32, b"SIF_MAGIC")
+SIF_DATA = struct.Struct("<qq")
+SIF_DATA_OFFSET = 112
+
+# squashfs superblock (after the launch script of .simg images), the total
+# bytes of the filesystem are stored 40 bytes after its magic
+SQUASHFS_MAGIC = b"hsqs"
+SQUASHFS_BYTES = struct.Struct("<q")
+SQUASHFS_BYTES_OFFSET = 40
+
+
+def get_store(optdir):
+    """Get the image store directory for an `optdir` root."""
+    return Path(optdir) / STORE_DIRNAME
+
+
+def get_file_digest(path, chunk_size=2**20):
+    """Compute the sha256 hex digest of a file reading it in chunks."""
+    sha256 = hashlib.sha256()
+
+    with open(str(path), "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def get_images(directory):
+    """List singularity images in `directory`."""
+    images = []
+
+    for i in IMAGE_PATTERNS:
+        images += list(Path(directory).glob(i))
+
+    return images
+
+
+def get_declared_size(path):
+    """
+    Get the image size declared in the SIF or squashfs header of `path`.
+
+    Arguments:
+        path (Path): path to a singularity image.
+
+    Returns:
+        int: bytes, None if the format is not recognized (e.g. ext3 images).
+    """
+    with open(str(path), "rb") as f:
+        header = f.read(4096)
+
+    offset, magic = SIF_MAGIC
+
+    if header[offset : offset + len(magic)] == magic:
+        if len(header) < SIF_DATA_OFFSET + SIF_DATA.size:
+            return SIF_DATA_OFFSET + SIF_DATA.size
+
+        return sum(SIF_DATA.unpack_from(header, SIF_DATA_OFFSET))
+
+    offset = header.find(SQUASHFS_MAGIC)
+
+    if offset != -1 and len(header) >= offset + SQUASHFS_BYTES_OFFSET + 8:
+        return (
+            offset
+            + SQUASHFS_BYTES.unpack_from(header, offset + SQUASHFS_BYTES_OFFSET)[0]
+        )
+
+    return None
+
+
+def verify_image(path, size=None, digest=None):
+    """
+    Check that an image is complete before it's used.
+
+    Arguments:
+        path (Path): path to a singularity image.
+        size (int): expected bytes, e.g. the size recorded in the store.
+        digest (str): expected sha256 hex digest (the image is read).
+
+    Raises:
+        ValidationError: if the image is empty, smaller than the size in its
+            header (i.e. an interrupted pull), or doesn't match `size` or
+            `digest`.
+    """
+    actual = os.path.getsize(str(path))
+    declared = get_declared_size(path) if actual else None
+
+    if not actual:
+        raise exceptions.ValidationError(f"Empty image: {path}")
+
+    if declared is not None and actual < declared:
+        raise exceptions.ValidationError(
+            f"Partial image: {path} has {actual} of {declared} bytes"
+        )
+
+    if size is not None and actual != size:
+        raise exceptions.ValidationError(
+            f"Image size mismatch: {path} has {actual} bytes, expected {size}"
+        )
+
+    if digest is not None and get_file_digest(path) != digest:
+        raise exceptions.ValidationError(f"Image digest mismatch: {path}")
+
+
+def get_url_record_path(store, image_url):
+    """Get the path of the json record that maps `image_url` to a digest."""
+    key = hashlib.sha256(image_url.encode("utf-8")).hexdigest()
+    return Path(store) / "urls" / f"{key}.json"
+
+
+def get_url_record(store, image_url):
+    """
+    Get the store record of a previously pulled `image_url`.
+
+    Arguments:
+        store (Path): image store directory.
+        image_url (str): singularity image url.
+
+    Returns:
+        dict: record with `url`, `digest`, `filename`, `path` and `size`
+            keys, None if the url has not been pulled or its blob is missing
+            or doesn't have the recorded size.
+    """
+    record_path = get_url_record_path(store, image_url)
+
+    if not record_path.is_file():
+        return None
+
+    record = json.loads(record_path.read_text())
+
+    try:
+        size = os.path.getsize(record["path"])
+    except OSError:
+        return None
+
+    return record if size == record.get("size", size) else None
+
+
+def write_url_record(store, image_url, record):
+    """Atomically write the store `record` of `image_url`."""
+    record_path = get_url_record_path(store, image_url)
+    record_path.parent.mkdir(exist_ok=True, parents=True)
+    tmp_path = record_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(record, indent=4, sort_keys=True))
+    os.replace(str(tmp_path), str(record_path))
+
+
+def add_image(store, image_path, image_url, expected_digest=None):
+    """
+    Verify an image and move it into the store keyed by its sha256 digest.
+
+    If an identical image is already stored, `image_path` is removed and
+    the stored copy is reused.
+
+    Arguments:
+        store (Path): image store directory.
+        image_path (Path): path to the pulled image.
+        image_url (str): url used to pull the image.
+        expected_digest (str): sha256 hex digest the image must have.
+
+    Returns:
+        dict: the store record of `image_url`.
+    """
+    verify_image(image_path)
+
+    with profiling.span("digest", bytes=image_path.stat().st_size):
+        digest = get_file_digest(image_path)
+
+    if expected_digest and digest != expected_digest:
+        image_path.unlink()
+        raise exceptions.ValidationError(
+            f"Image digest mismatch for {image_url}: {digest} != {expected_digest}"
+        )
+
+    blob = Path(store) / "sha256" / f"{digest}{image_path.suffix}"
+    blob.parent.mkdir(exist_ok=True, parents=True)
+
+    if blob.is_file():
+        image_path.unlink()
+    else:
+        image_path.chmod(mode=0o755)
+        os.replace(str(image_path), str(blob))
+
+    record = {
+        "url": image_url,
+        "digest": f"sha256:{digest}",
+        "filename": image_path.name,
+        "path": str(blob),
+        "size": blob.stat().st_size,
+    }
+
+    write_url_record(store, image_url, record)
+    return record
+
+
+def get_cache_dir(store, image_url):
+    """Get the directory where the layers of `image_url` are cached while pulling."""
+    return Path(store) / "cache" / get_url_record_path(store, image_url).stem
+
+
+def clean_pulls(store, age=STALE_PULL):
+    """Remove the pull and layer cache directories left by interrupted pulls."""
+    for directory in Path(store) / "tmp", Path(store) / "cache":
+        for i in directory.iterdir() if directory.is_dir() else []:
+            try:
+                if i.is_dir() and time.time() - i.stat().st_mtime > age:
+                    shutil.rmtree(str(i), ignore_errors=True)
+            except OSError:
+                continue
+
+
+def pull_image(  # pylint: disable=R0913
+    store, singularity, image_url, registry_digest=None, registry_client=None
+):
+    """
+    Pull `image_url` into a temporary directory and add it to the store.
+
+    Singularity caches downloaded layers in `<store>/cache/<url key>`
+    (unless `SINGULARITY_CACHEDIR` is set), so retried or interrupted pulls
+    only download missing layers. The layers are removed once the image is
+    stored, and `clean_pulls` removes those of abandoned pulls.
+
+    The image is verified before it's moved into the store, interrupted
+    pulls never reach the store or the optdirs. Only the size declared in
+    the image header is checked, since the digest of a built image is not
+    known before pulling it (registry digests identify the manifests). The
+    registry digest of docker urls is recorded so that `register_apps sync`
+    can find out if their tags changed.
+
+    Arguments:
+        store (Path): image store directory.
+        singularity (str): path to singularity.
+        image_url (str): singularity image url.
+        registry_digest (str): digest `image_url` resolves to, if known.
+        registry_client (object): client used to resolve the digest if it's
+            not known, lookups are skipped if None (see `registries`).
+
+    Returns:
+        dict: the store record of `image_url`.
+    """
+    tmpdir = Path(store) / "tmp"
+    tmpdir.mkdir(exist_ok=True, parents=True)
+    clean_pulls(store)
+    pulldir = Path(tempfile.mkdtemp(dir=str(tmpdir)))
+    env = dict(os.environ)
+    cachedir = None
+
+    if "SINGULARITY_CACHEDIR" not in env:
+        cachedir = get_cache_dir(store, image_url)
+        env["SINGULARITY_CACHEDIR"] = str(cachedir)
+
+    def clean():  # remove partial pulls before retrying
+        shutil.rmtree(str(pulldir), ignore_errors=True)
+        pulldir.mkdir()
+
+    # resolved before pulling, a tag that moves during the pull is synced later
+    if not registry_digest:
+        registry_digest = registries.resolve_digest(image_url, registry_client)
+
+    try:
+        with profiling.span("singularity_pull", url=image_url) as span:
+            processes.run(
+                ["/bin/bash", "-c", f"umask 22 && {singularity} pull {image_url}"],
+                phase="pull",
+                retry=True,
+                cwd=str(pulldir),
+                env=env,
+                on_retry=clean,
+            )
+
+            images = get_images(pulldir)
+            assert len(images) == 1, f"Expected one image after pulling {image_url}"
+            span.update(exit_code=0, bytes=images[0].stat().st_size)
+
+        click.echo(f"Pulled {utils.format_bytes(images[0].stat().st_size)}.")
+        record = add_image(store, images[0], image_url)
+
+        if registry_digest:
+            record["registry_digest"] = registry_digest
+            write_url_record(store, image_url, record)
+
+        # layers are only kept to resume interrupted pulls
+        if cachedir:
+            shutil.rmtree(str(cachedir), ignore_errors=True)
+
+        return record
+    finally:
+        shutil.rmtree(str(pulldir), ignore_errors=True)
+
+
+def get_image_digest(image, store, image_url, compute=True):
+    """
+    Get the sha256 hex digest of a registered `image`.
+
+    The digest is read from the store record when `image` is linked to the
+    stored blob, otherwise it is computed from the image bytes.
+
+    Arguments:
+        image (Path): path to the image inside an optdir.
+        store (Path): image store directory.
+        image_url (str): singularity image url.
+        compute (bool): if False, return None for images not in the store.
+
+    Returns:
+        str: sha256 hex digest.
+    """
+    record = get_url_record(store, image_url)
+
+    if record and os.path.samefile(str(image), record["path"]):
+        return record["digest"].split(":", 1)[1]
+
+    return get_file_digest(image) if compute else None
+
+
+def link_image(src, dst):
+    """Hardlink `src` to `dst`, fallback to a symlink across filesystems."""
+    try:
+        utils.force_link(src, dst)
+    except OSError:
+        utils.force_symlink(src, dst)
+
+
+def _link_record(record, optdir):
+    """Link the stored blob of `record` in `optdir` and return the link path."""
+    image = Path(optdir) / record["filename"]
+
+    with profiling.span("link_image"):
+        link_image(record["path"], image)
+
+    return image
+
+
+def get_or_create_image(optdir, store, singularity, image_url, registry_client=None):
+    """
+    Get the image in `optdir` or link it from the store, pulling if needed.
+
+    Image bytes are pulled and stored once per digest in the `store`, every
+    registration directory gets a hardlink (or symlink) to the stored blob.
+
+    Arguments:
+        optdir (Path): registration directory (e.g. optdir/name/version).
+        store (Path): image store directory.
+        singularity (str): path to singularity.
+        image_url (str): singularity image url.
+        registry_client (object): client used to record the registry digest
+            of pulled images, see `pull_image`.
+
+    Returns:
+        Path: path to the image inside `optdir`.
+    """
+    with profiling.span("get_or_create_image", url=image_url) as span:
+        images = get_images(optdir)
+        assert len(images) <= 1, f"Found multiple images at {optdir}"
+
+        if images:
+            try:
+                verify_image(images[0])
+                click.echo(f"Image exists at: {images[0]}")
+                span["hit"] = "optdir"
+                return images[0]
+            except exceptions.ValidationError as error:
+                click.secho(f"{error}, replacing it...", fg="yellow", err=True)
+                images[0].unlink()
+
+        record_path = get_url_record_path(store, image_url)
+        record_path.parent.mkdir(exist_ok=True, parents=True)
+
+        # concurrent registrations of the same url wait for a single pull
+        with utils.lock(record_path.with_suffix(".lock")):
+            # `register_apps gc` removes unlinked blobs holding the store lock
+            with utils.lock(Path(store) / ".lock"):
+                record = get_url_record(store, image_url)
+
+                if record:
+                    click.echo(f"Image found in store: {record['path']}")
+                    span["hit"] = "store"
+                    return _link_record(record, optdir)
+
+            # new blobs are not removed until they are stale
+            record = pull_image(
+                store, singularity, image_url, registry_client=registry_client
+            )
+            span["hit"] = None
+            return _link_record(record, optdir)
+
+
+def find_executables(singularity, image, pattern):
+    """
+    Find the executable files inside `image` that match a glob `pattern`.
+
+    The glob is expanded by `sh` inside the container, so it must be an
+    absolute path (e.g. `/opt/tools/bin/*`).
+
+    Arguments:
+        singularity (str): path to singularity.
+        image (str): path to the singularity image.
+        pattern (str): glob of the executables.
+
+    Returns:
+        list: sorted paths of the executables inside the image.
+    """
+    if not pattern.startswith("/"):
+        raise exceptions.ValidationError(f"Glob must be an absolute path: {pattern}")
+
+    with profiling.span("find_executables", pattern=pattern) as span:
+        output = processes.run(
+            [singularity, "exec", image, "sh", "-c", FIND_EXECUTABLES, "sh", pattern],
+            phase="inspect",
+            echo=False,
+            capture=True,
+        )
+
+        executables = sorted({i for i in output.splitlines() if i.startswith("/")})
+        span["found"] = len(executables)
+
+    if not executables:
+        raise exceptions.MissingOutputError(f"No executables match {pattern}")
+
+    return executables
@@ -0,0 +1,151 @@
+"""register_apps index of registered apps."""
+
+from fnmatch import fnmatch
+from pathlib import Path
+import datetime
+import json
+import os
+
+from register_apps import utils
+
+# append-only json lines file created inside the optdir
+INDEX_FILENAME = ".registry.jsonl"
+
+# fields that identify a registered app, the latest entry of a key wins
+KEY_FIELDS = ("kind", "name", "version", "target")
+
+
+def get_index(optdir):
+    """Get the index path for an `optdir` root."""
+    return Path(optdir) / INDEX_FILENAME
+
+
+def get_key(entry):
+    """Get the tuple that identifies a registered app."""
+    return tuple(entry.get(i) for i in KEY_FIELDS)
+
+
+def append(optdir, entries):
+    """
+    Append `entries` to the index with a single write.
+
+    Arguments:
+        optdir (str): optdir root.
+        entries (list): list of dictionaries to append.
+    """
+    path = get_index(optdir)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    lines = "".join(json.dumps(i, sort_keys=True) + "\n" for i in entries)
+
+    # appends are not atomic in NFS
+    with utils.lock(path.with_suffix(".lock")):
+        fd = os.open(str(path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+        try:
+            os.write(fd, lines.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+
+def add_entry(optdir, **fields):
+    """
+    Record a registration in the index of `optdir`.
+
+    Arguments:
+        optdir (str): optdir root.
+        fields (dict): `kind`, `name`, `version` and `target` identify the
+            app, other common fields are `image`, `image_url`, `digest`,
+            `venv`, `wrapper` and `link`.
+
+    Returns:
+        dict: the recorded entry.
+    """
+    return add_entries(optdir, [fields])[0]
+
+
+def add_entries(optdir, entries):
+    """
+    Record a batch of registrations in the index of `optdir` at once.
+
+    Arguments:
+        optdir (str): optdir root.
+        entries (list): dictionaries of fields, see `add_entry`.
+
+    Returns:
+        list: the recorded entries.
+    """
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    recorded = []
+
+    for fields in entries:
+        entry = {i: None for i in KEY_FIELDS}
+        entry.update(
+            {k: str(v) if isinstance(v, Path) else v for k, v in fields.items()}
+        )
+        entry["registered"] = now
+        recorded.append(entry)
+
+    append(optdir, recorded)
+    return recorded
+
+
+def remove_entries(optdir, entries):
+    """Record that `entries` were removed from `optdir`."""
+    now = datetime.datetime.now().isoformat(timespec="seconds")
+    append(
+        optdir,
+        [dict(zip(KEY_FIELDS, get_key(i)), removed=now) for i in entries],
+    )
+
+
+def read_entries(optdir):
+    """
+    Read the current registered apps from the index of `optdir`.
+
+    Arguments:
+        optdir (str): optdir root.
+
+    Returns:
+        list: latest entry of each registered app sorted by name and version.
+    """
+    path = get_index(optdir)
+    entries = {}
+
+    if not path.is_file():
+        return []
+
+    with open(str(path), "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # pragma: no cover
+                continue  # skip lines truncated by interrupted writes
+
+            if entry.get("removed"):
+                entries.pop(get_key(entry), None)
+            else:
+                entries[get_key(entry)] = entry
+
+    return sorted(
+        entries.values(),
+        key=lambda i: [str(i.get(j) or "") for j in ("name", "version", "target")],
+    )
+
+
+def query(entries, **patterns):
+    """
+    Filter `entries` with shell-style `patterns` (e.g. name="toil_*").
+
+    Arguments:
+        entries (list): index entries.
+        patterns (dict): field names and patterns, None values are ignored.
+
+    Returns:
+        list: entries matching all patterns.
+    """
+    patterns = {k: v for k, v in patterns.items() if v is not None}
+    return [
+        i
+        for i in entries
+        if all(fnmatch(str(i.get(k)), v) for k, v in patterns.items())
+    ]
@@ -0,0 +1,92 @@
+"""
+Module that contains the `register_apps` command group.
+
+Subcommands are imported only when invoked, so that `register_apps --help`
+and other quick calls don't pay for importing every implementation.
+"""
+
+import importlib
+
+import click
+
+from register_apps import __version__
+
+# subcommand names, import paths and short help used without importing them
+COMMANDS = {
+    "toil": (
+        "register_apps.cli:register_toil",
+        "Register versioned toil container pipelines.",
+    ),
+    "singularity": (
+        "register_apps.cli:register_singularity",
+        "Register versioned singularity commands.",
+    ),
+    "python": (
+        "register_apps.cli:register_python",
+        "Register versioned python pipelines.",
+    ),
+    "batch": (
+        "register_apps.cli:register_batch",
+        "Register multiple apps from a manifest.",
+    ),
+    "list": ("register_apps.queries:list_apps", "List registered apps."),
+    "query": ("register_apps.queries:query", "Query registered apps."),
+    "stats": ("register_apps.queries:stats", "Report call stats of registered apps."),
+    "gc": ("register_apps.maintenance:gc", "Remove least recently used versions."),
+    "sync": (
+        "register_apps.maintenance:sync_images",
+        "Re-pull images whose tags changed.",
+    ),
+    "dedup": (
+        "register_apps.maintenance:deduplicate",
+        "Hardlink identical files across environments.",
+    ),
+    "export": (
+        "register_apps.transfers:export_bundle",
+        "Export a version as a bundle.",
+    ),
+    "import": ("register_apps.transfers:import_bundle", "Import a bundle."),
+}
+
+
+class LazyGroup(click.Group):
+
+    """A click group that imports its subcommands when they are invoked."""
+
+    def __init__(self, *args, lazy_commands=None, **kwargs):
+        """Set `lazy_commands` as a dict of names to import paths and help."""
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx):
+        """List both loaded and lazy subcommands."""
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx, cmd_name):
+        """Import a lazy subcommand the first time it's requested."""
+        if cmd_name in self.lazy_commands and cmd_name not in self.commands:
+            module, attribute = self.lazy_commands[cmd_name][0].split(":")
+            command = getattr(importlib.import_module(module), attribute)
+            self.add_command(command, cmd_name)
+
+        return super().get_command(ctx, cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        """Write the subcommands help without importing them."""
+        rows = []
+
+        for i in self.list_commands(ctx):
+            if i in self.lazy_commands:
+                rows.append((i, self.lazy_commands[i][1]))
+            else:
+                rows.append((i, self.commands[i].get_short_help_str()))
+
+        if rows:
+            with formatter.section("Commands"):
+                formatter.write_dl(rows)
+
+
+@click.group(name="register_apps", cls=LazyGroup, lazy_commands=COMMANDS)
+@click.version_option(version=__version__)
+def main():
+    """Register and manage versioned apps."""
@@ -0,0 +1,101 @@
+"""
+register_apps commands that maintain registered versions in place.
+
+They live apart from `cli` so that registrations don't import the garbage
+collection, sync and deduplication implementations.
+"""
+
+import time
+
+import click
+
+from register_apps import cleanup
+from register_apps import dedup
+from register_apps import images
+from register_apps import options
+from register_apps import sync
+from register_apps import utils
+
+
+@click.command()
+@options.OPTDIR
+@options.BINDIR
+@options.MAX_AGE
+@options.MAX_SIZE
+@options.KEEP
+@options.DRY_RUN
+def gc(optdir, bindir, max_age, max_size, keep, dry_run):  # pylint: disable=R0913
+    """Remove least recently used versions, their environments and images."""
+    if max_age is None and max_size is None:
+        raise click.UsageError("Provide --max_age and/or --max_size.")
+
+    store = images.get_store(optdir)
+    selected = cleanup.select_versions(
+        versions=cleanup.get_versions(optdir),
+        store=store,
+        max_age=max_age,
+        max_size=None if max_size is None else max_size * 1024**3,
+        keep=keep,
+    )
+
+    reclaimed = cleanup.get_reclaimed_bytes(selected, store)
+    click.echo(f"Found {len(selected)} versions to remove:\n")
+
+    for i in selected:
+        last_used = time.strftime("%Y-%m-%d %H:%M", time.localtime(i["last_used"]))
+        click.echo(f"\t{last_used}  {i['name']} {i['version']}")
+
+    if not dry_run:
+        cleanup.remove_versions(optdir, bindir, selected)
+
+    click.secho(
+        f"\n{'Would free' if dry_run else 'Freed'} {utils.format_bytes(reclaimed)}.",
+        fg="green",
+    )
+
+
+@click.command(name="sync")
+@options.OPTDIR
+@options.QUERY_NAME
+@options.SINGULARITY
+@options.REGISTRY_CLIENT
+@options.LOOKUP_JOBS
+@options.DRY_RUN
+def sync_images(  # pylint: disable=R0913
+    optdir, name, singularity, registry_client, jobs, dry_run
+):
+    """Re-pull registered images whose tags point to new digests."""
+    results = sync.sync_images(
+        optdir,
+        singularity,
+        name=name,
+        client=registry_client,
+        jobs=jobs,
+        dry_run=dry_run,
+    )
+
+    for i in results:
+        line = f"\t{i['status']:<10} {i['url']}"
+        click.secho(line, fg="red" if i["status"] == "failed" else None)
+
+        if i.get("error"):
+            click.echo(f"\t\t{i['error']}")
+
+    if any(i["status"] == "failed" for i in results):
+        raise click.ClickException("Some images could not be synced.")
+
+
+@click.command(name="dedup")
+@options.OPTDIR
+@options.MIN_SIZE
+@options.HASH_JOBS
+@options.DRY_RUN
+def deduplicate(optdir, min_size, jobs, dry_run):
+    """Hardlink identical files across registered virtual environments."""
+    result = dedup.deduplicate(optdir, min_size=min_size, jobs=jobs, dry_run=dry_run)
+    click.echo(f"Scanned {result['scanned']} files, hashed {result['hashed']}.")
+    click.secho(
+        f"{'Would link' if dry_run else 'Linked'} {result['linked']} files, "
+        f"{'would free' if dry_run else 'freed'} {utils.format_bytes(result['freed'])}.",
+        fg="green",
+    )
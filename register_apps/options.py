@@ -1,7 +1,8 @@
 """register_apps cli options."""
-import os
+import functools
 import click
 from register_apps import __version__
+from register_apps import preflight
 
 
 _DEFAULT_OPTDIR = "/work/isabl/local"
@@ -43,7 +44,8 @@ GITHUB_USER = click.option(
 )
 VOLUMES = click.option(
     "--volumes",
-    type=click.Tuple([click.Path(exists=True, resolve_path=True, dir_okay=True), str]),
+    type=click.Tuple([str, str]),
+    callback=preflight.validate_volumes,
     multiple=True,
     default=_DEFAULT_VOLUMES,
     show_default=False,
@@ -60,14 +62,45 @@ BINDIR = click.option(
     show_default=True,
     type=click.Path(resolve_path=True, dir_okay=True),
     help="path were executables will be linked to",
-    default=os.getenv("TOIL_REGISTER_BIN", _DEFAULT_BINDIR),
+    envvar="TOIL_REGISTER_BIN",
+    default=_DEFAULT_BINDIR,
 )
 OPTDIR = click.option(
     "--optdir",
     show_default=True,
     type=click.Path(resolve_path=True, dir_okay=True),
     help="path were images will be versioned and cached",
-    default=os.getenv("TOIL_REGISTER_OPT", _DEFAULT_OPTDIR),
+    envvar="TOIL_REGISTER_OPT",
+    default=_DEFAULT_OPTDIR,
+)
+WHEELHOUSE = click.option(
+    "--wheelhouse",
+    type=click.Path(resolve_path=True, file_okay=False),
+    help="(optional) directory of cached wheels used to install packages",
+    envvar="TOIL_REGISTER_WHEELHOUSE",
+    default=None,
+)
+OFFLINE = click.option(
+    "--offline",
+    is_flag=True,
+    default=False,
+    help="install packages only from the wheelhouse, without using PyPi",
+)
+ARTIFACTS = click.option(
+    "--artifacts",
+    type=click.Path(resolve_path=True, file_okay=False),
+    help="(optional) directory of prebuilt virtual environments, environments "
+    "are unpacked from it if available or archived into it after installing",
+    envvar="TOIL_REGISTER_ARTIFACTS",
+    default=None,
+)
+ENV_BACKEND = click.option(
+    "--env_backend",
+    show_default=True,
+    type=click.Choice(["venv", "virtualenvwrapper"]),
+    help="backend used to create the virtual environments in $WORKON_HOME",
+    envvar="TOIL_REGISTER_ENV_BACKEND",
+    default="venv",
 )
 PYTHON2 = click.option(
     "--python",
@@ -87,16 +120,317 @@ SINGULARITY = click.option(
     help="path to singularity",
     default="singularity",
 )
+WRAPPER = click.option(
+    "--wrapper",
+    show_default=True,
+    type=click.Choice(["legacy", "exec"]),
+    help="executable template, exec replaces bash with the command and "
+    "doesn't fork uuidgen to create singularity workdirs",
+    envvar="TOIL_REGISTER_WRAPPER",
+    default="legacy",
+)
+SINGULARITY_WRAPPER = click.option(
+    "--wrapper",
+    show_default=True,
+    type=click.Choice(["legacy", "exec", "instance"]),
+    help="executable template, exec replaces bash with the command and "
+    "doesn't fork uuidgen to create singularity workdirs, instance runs "
+    "commands in a persistent singularity instance",
+    envvar="TOIL_REGISTER_WRAPPER",
+    default="legacy",
+)
+USAGE_STAMP = click.option(
+    "--usage_stamp",
+    is_flag=True,
+    default=False,
+    help="make executables touch a stamp on each call, used by `register_apps gc` "
+    "to find the versions that were used last",
+)
+OPTIMIZE = click.option(
+    "--optimize",
+    envvar="TOIL_REGISTER_OPTIMIZE",
+    type=click.Choice(["none", "bytecode", "zip"]),
+    default="none",
+    show_default=True,
+    help="precompile the bytecode of new virtual environments (bytecode) and also "
+    "pack their pure python packages in an importable zip (zip), the startup time "
+    "of the entry point is measured before and after",
+)
+DEDUP = click.option(
+    "--dedup",
+    "dedup_venv",
+    envvar="TOIL_REGISTER_DEDUP",
+    is_flag=True,
+    default=False,
+    help="hardlink the files of new virtual environments that are identical to "
+    "files of other registered environments, see `register_apps dedup`",
+)
+TELEMETRY = click.option(
+    "--telemetry",
+    "telemetry_dir",
+    envvar="TOIL_REGISTER_TELEMETRY",
+    default=None,
+    type=click.Path(file_okay=False),
+    help="(optional) make executables append a record of each call to a per-app "
+    "log in this directory, see `register_apps stats`",
+)
+INSTANCE_TIMEOUT = click.option(
+    "--instance_timeout",
+    show_default=True,
+    type=int,
+    default=600,
+    help="idle seconds before stopping a persistent singularity instance",
+)
+STAGE_DIR = click.option(
+    "--stage_dir",
+    default=None,
+    help="(optional) node-local directory expression (e.g. /scratch or '${TMPDIR}') "
+    "where wrappers copy the image on first use instead of reading it from optdir",
+)
+STAGE_LIMIT = click.option(
+    "--stage_limit",
+    show_default=True,
+    type=float,
+    default=50,
+    help="maximum GB of staged images per user and node, least recently used "
+    "images are evicted",
+)
+STAGE_VERIFY = click.option(
+    "--stage_verify",
+    show_default=True,
+    type=click.Choice(["size", "digest"]),
+    default="size",
+    help="how staged copies are verified",
+)
+PROFILE = click.option(
+    "--profile",
+    envvar="TOIL_REGISTER_PROFILE",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="(optional) append the timing spans of each phase to this JSON lines file",
+)
+PROFILE_TRACE = click.option(
+    "--profile_trace",
+    envvar="TOIL_REGISTER_PROFILE_TRACE",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="(optional) write the timing spans as a chrome trace (chrome://tracing)",
+)
 TARGET = click.option(
     "--target",
     show_default=True,
-    required=True,
-    help="name of the target script that will be created",
+    help="name of the target script that will be created, see also --targets",
 )
 COMMAND = click.option(
     "--command",
     show_default=True,
-    required=True,
     help="command that will be added at the end of the singularity exec instruction "
     "(e.g. bwa_mem.pl)",
 )
+TARGETS = click.option(
+    "--targets",
+    multiple=True,
+    metavar="TARGET=COMMAND",
+    help="target scripts and commands to register from the same image, "
+    "can be used multiple times (e.g. --targets bwa=bwa --targets st=samtools)",
+)
+TARGETS_GLOB = click.option(
+    "--targets_glob",
+    default=None,
+    help="register a target for each executable inside the image matching this "
+    "glob, named after the executable (e.g. '/opt/tools/bin/*')",
+)
+MANIFEST = click.option(
+    "--manifest",
+    required=True,
+    type=click.Path(exists=True, dir_okay=False),
+    help="JSON or YAML manifest with a list of registrations",
+)
+JOBS = click.option(
+    "--jobs",
+    show_default=True,
+    type=int,
+    default=4,
+    help="maximum number of registrations running at the same time",
+)
+EXECUTOR = click.option(
+    "--executor",
+    show_default=True,
+    type=click.Choice(["thread", "process"]),
+    default="thread",
+    help="pool used to run the registrations",
+)
+REPORT = click.option(
+    "--report",
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help="(optional) path to write the registration results as JSON",
+)
+AS_JSON = click.option(
+    "--json",
+    "as_json",
+    is_flag=True,
+    default=False,
+    help="print all the recorded fields as JSON",
+)
+QUERY_KIND = click.option(
+    "--kind",
+    default=None,
+    type=click.Choice(["toil", "singularity", "python"]),
+    help="filter by kind of registration",
+)
+QUERY_NAME = click.option(
+    "--name", default=None, help="filter by package or image repository pattern"
+)
+QUERY_VERSION = click.option(
+    "--version", default=None, help="filter by version pattern"
+)
+QUERY_TARGET = click.option("--target", default=None, help="filter by target pattern")
+STATS_BY = click.option(
+    "--by",
+    show_default=True,
+    type=click.Choice(["name", "version", "target"]),
+    default="version",
+    help="aggregate calls per app name, per version or per version and target",
+)
+STATS_DAYS = click.option(
+    "--days",
+    type=float,
+    default=None,
+    help="only include calls made in this number of days",
+)
+MAX_AGE = click.option(
+    "--max_age",
+    type=float,
+    default=None,
+    help="remove versions that haven't been used in this number of days",
+)
+MAX_SIZE = click.option(
+    "--max_size",
+    type=float,
+    default=None,
+    help="remove least recently used versions until the optdir uses these GB",
+)
+KEEP = click.option(
+    "--keep",
+    show_default=True,
+    type=int,
+    default=1,
+    help="number of most recently used versions never removed per app",
+)
+DRY_RUN = click.option(
+    "--dry_run",
+    is_flag=True,
+    default=False,
+    help="only report what would be changed",
+)
+REGISTRY_CLIENT = click.option(
+    "--registry_client",
+    envvar="TOIL_REGISTER_REGISTRY",
+    default=None,
+    help="(optional) module:attribute import path of the registry client used "
+    "to resolve tags to digests, defaults to the docker registry API client, "
+    "use 'none' to disable registry lookups",
+)
+LOOKUP_JOBS = click.option(
+    "--jobs",
+    show_default=True,
+    type=int,
+    default=8,
+    help="number of concurrent registry lookups",
+)
+MIN_SIZE = click.option(
+    "--min_size",
+    show_default=True,
+    type=int,
+    default=1,
+    help="ignore files smaller than this number of bytes",
+)
+HASH_JOBS = click.option(
+    "--jobs",
+    show_default=True,
+    type=int,
+    default=4,
+    help="number of files hashed at the same time",
+)
+APP_NAME = click.option(
+    "--name", required=True, help="package or image repository name"
+)
+APP_VERSION = click.option("--version", required=True, help="registered version")
+BUNDLE_OUTPUT = click.option(
+    "--output",
+    required=True,
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    help="path of the bundle to be created",
+)
+BUNDLE = click.argument("bundle", type=click.Path(exists=True, dir_okay=False))
+COMPRESSION = click.option(
+    "--compression",
+    show_default=True,
+    type=click.Choice(["auto", "zstd", "gzip"]),
+    default="auto",
+    help="payload compression, auto uses zstd if available, gzip is compressed "
+    "with pigz if available",
+)
+
+
+def group(name, **decorators):
+    """
+    Combine options whose values are passed to the command as a `name` dict.
+
+    Arguments:
+        name (str): name of the command argument with the options values.
+        decorators (dict): options keyed by their parameter names.
+
+    Returns:
+        function: decorator that adds the options to a click command.
+    """
+
+    def decorator(command):
+        @functools.wraps(command)
+        def wrapper(*args, **kwargs):
+            kwargs[name] = {i: kwargs.pop(i) for i in decorators}
+            return command(*args, **kwargs)
+
+        for i in reversed(list(decorators.values())):
+            wrapper = i(wrapper)
+
+        return wrapper
+
+    return decorator
+
+
+# virtual environment options of register_toil and register_python
+ENVIRONMENT = group(
+    "environment",
+    wheelhouse=WHEELHOUSE,
+    offline=OFFLINE,
+    artifacts=ARTIFACTS,
+    env_backend=ENV_BACKEND,
+    optimize=OPTIMIZE,
+    dedup_venv=DEDUP,
+)
+
+# options of the executables written by register_toil and register_python
+EXECUTABLE = group(
+    "executable",
+    wrapper=WRAPPER,
+    usage_stamp=USAGE_STAMP,
+    telemetry_dir=TELEMETRY,
+)
+
+# options of the executables written by register_singularity
+SINGULARITY_EXECUTABLE = group(
+    "executable",
+    wrapper=SINGULARITY_WRAPPER,
+    usage_stamp=USAGE_STAMP,
+    telemetry_dir=TELEMETRY,
+)
+
+# node-local image staging options of register_singularity
+STAGING = group(
+    "staging",
+    stage_dir=STAGE_DIR,
+    stage_limit=STAGE_LIMIT,
+    stage_verify=STAGE_VERIFY,
+)
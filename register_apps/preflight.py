@@ -0,0 +1,250 @@
+"""register_apps concurrent filesystem preflight checks with timeouts."""
+
+from glob import escape
+from glob import has_magic
+import fnmatch
+import os
+import stat
+import threading
+import time
+
+import click
+
+from register_apps import exceptions
+
+# seconds after which a path check is reported as hung
+TIMEOUT = 10
+
+# seconds after which a successful path check is reported as slow
+SLOW = 2
+
+# results of the checks run by this process, hung checks are cached as well
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def clear_cache():
+    """Forget the results of previous checks."""
+    with _CACHE_LOCK:
+        _CACHE.clear()
+
+
+def scan_pattern(pattern, check_size=False):
+    """
+    Find the paths matching a shell-style `pattern`.
+
+    Directories are listed with `os.scandir` so that the file type (and
+    size if `check_size`) of each match is known without extra stats.
+
+    Arguments:
+        pattern (str): path or glob pattern.
+        check_size (bool): include the size of matched files.
+
+    Returns:
+        list: dictionaries with `path`, `is_file`, `is_dir` and `size` keys.
+    """
+    if not has_magic(pattern):
+        try:
+            result = os.stat(pattern)
+        except OSError:
+            return []
+
+        is_file = stat.S_ISREG(result.st_mode)
+        return [
+            {
+                "path": pattern,
+                "is_file": is_file,
+                "is_dir": stat.S_ISDIR(result.st_mode),
+                "size": result.st_size if is_file else None,
+            }
+        ]
+
+    dirname, basename = os.path.split(pattern)
+    dirnames = [dirname]
+    matches = []
+
+    if has_magic(dirname):
+        dirnames = [i["path"] for i in scan_pattern(dirname) if i["is_dir"]]
+
+    for directory in dirnames:
+        try:
+            with os.scandir(directory or os.curdir) as entries:
+                for i in entries:
+                    if i.name.startswith(".") and not basename.startswith("."):
+                        continue
+
+                    if fnmatch.fnmatch(i.name, basename):
+                        is_file = i.is_file()
+                        matches.append(
+                            {
+                                "path": os.path.join(directory, i.name),
+                                "is_file": is_file,
+                                "is_dir": i.is_dir(),
+                                "size": (
+                                    i.stat().st_size if is_file and check_size else None
+                                ),
+                            }
+                        )
+        except OSError:
+            continue
+
+    return sorted(matches, key=lambda i: i["path"])
+
+
+def check_pattern(pattern, kind="dir", check_size=False):
+    """
+    Check that `pattern` matches existing files or directories.
+
+    Arguments:
+        pattern (str): path or glob pattern.
+        kind (str): `file`, `dir` or `path` (either a file or a directory).
+        check_size (bool): fail if matched files are empty.
+
+    Returns:
+        list: matched paths resolved with `os.path.realpath`.
+    """
+    matches = scan_pattern(pattern, check_size=check_size)
+
+    if not matches:
+        raise exceptions.ValidationError(f"{pattern} pattern matched no {kind}s.")
+
+    for i in matches:
+        if kind == "dir" and not i["is_dir"]:
+            raise exceptions.ValidationError(f"{i['path']} is not a directory.")
+
+        if kind == "file" and not i["is_file"]:
+            raise exceptions.ValidationError(f"{i['path']} is not a file.")
+
+        if kind == "file" and check_size and not i["size"]:
+            raise exceptions.ValidationError(f"{i['path']} is an empty file.")
+
+    # make sure directories can be listed, stats can be served from cache
+    for i in matches:
+        if i["is_dir"]:
+            with os.scandir(i["path"]) as entries:
+                next(entries, None)
+
+    return [os.path.realpath(i["path"]) for i in matches]
+
+
+def _run_check(key, function, args):
+    result = {"pattern": args[0], "status": "running", "start": time.time()}
+
+    def target():
+        try:
+            result["paths"] = function(*args)
+            result["status"] = "ok"
+        except (exceptions.ValidationError, OSError) as error:
+            result["error"] = str(error)
+            result["status"] = "invalid"
+
+        result["seconds"] = time.time() - result["start"]
+
+    # daemon threads don't block the exit of the process if a mount hangs
+    thread = threading.Thread(target=target, daemon=True)
+    result["thread"] = thread
+    _CACHE[key] = result
+    thread.start()
+    return result
+
+
+def check_patterns(patterns, kind="dir", check_size=False, timeout=None, slow=None):
+    """
+    Check `patterns` concurrently, each one with its own `timeout`.
+
+    Checks that don't finish within `timeout` are reported as `hung`, those
+    that take more than `slow` seconds are reported as `slow`. Results are
+    cached for the rest of the run, including checks that are still hung.
+
+    Arguments:
+        patterns (list): paths or glob patterns.
+        kind (str): `file`, `dir` or `path`.
+        check_size (bool): fail if matched files are empty.
+        timeout (float): seconds before a check is reported as hung.
+        slow (float): seconds before a check is reported as slow.
+
+    Returns:
+        list: dictionaries with `pattern`, `status` (`ok`, `slow`, `invalid`
+            or `hung`), `paths`, `error` and `seconds` keys.
+    """
+    if timeout is None:
+        timeout = float(os.getenv("TOIL_REGISTER_PREFLIGHT_TIMEOUT", TIMEOUT))
+
+    if slow is None:
+        slow = float(os.getenv("TOIL_REGISTER_PREFLIGHT_SLOW", SLOW))
+    checks = []
+
+    with _CACHE_LOCK:
+        for pattern in patterns:
+            key = (pattern, kind, check_size)
+            checks.append(_CACHE.get(key) or _run_check(key, check_pattern, key))
+
+    for i in checks:
+        i["thread"].join(max(0, i["start"] + timeout - time.time()))
+
+    results = []
+
+    for i in checks:
+        status = i["status"]
+
+        if status == "running":
+            status = "hung"
+        elif status == "ok" and i["seconds"] > slow:
+            status = "slow"
+
+        results.append(
+            {
+                "pattern": i["pattern"],
+                "status": status,
+                "paths": i.get("paths", []),
+                "error": i.get("error"),
+                "seconds": i.get("seconds", time.time() - i["start"]),
+            }
+        )
+
+    return results
+
+
+def raise_for_results(results):
+    """
+    Warn about slow paths and raise an error for invalid or hung ones.
+
+    Arguments:
+        results (list): results returned by `check_patterns`.
+
+    Raises:
+        ValidationError: if any check is invalid or hung.
+    """
+    for i in results:
+        if i["status"] == "slow":
+            click.secho(
+                f"Slow filesystem: {i['pattern']} took {i['seconds']:.1f}s.",
+                fg="yellow",
+                err=True,
+            )
+
+    invalid = [i["error"] for i in results if i["status"] == "invalid"]
+    hung = [
+        f"{i['pattern']} (no response after {i['seconds']:.1f}s, hung mount?)"
+        for i in results
+        if i["status"] == "hung"
+    ]
+
+    if invalid or hung:
+        raise exceptions.ValidationError(
+            "\n".join(
+                invalid + ([f"Hung filesystems: {', '.join(hung)}"] if hung else [])
+            )
+        )
+
+
+def validate_volumes(ctx, param, value):  # pylint: disable=W0613
+    """Click callback that checks volumes concurrently and resolves them."""
+    results = check_patterns([escape(i) for i, _ in value], kind="path")
+
+    try:
+        raise_for_results(results)
+    except exceptions.ValidationError as error:
+        raise click.BadParameter(str(error))
+
+    return tuple((i["paths"][0], j) for i, (_, j) in zip(results, value))
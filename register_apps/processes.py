@@ -0,0 +1,263 @@
+"""register_apps subprocess runner with streamed output, timeouts and retries."""
+
+from collections import deque
+import functools
+import os
+import random
+import re
+import signal
+import subprocess
+import threading
+import time
+
+import click
+
+from register_apps import exceptions
+
+# default seconds before each phase is killed, 0 disables the timeout
+TIMEOUTS = {
+    "venv": 600,
+    "pip": 3600,
+    "pull": 3600,
+    "compileall": 1200,
+    "verify": 300,
+    "inspect": 300,
+    "python": 60,
+}
+
+# default retries of phases that reach registries or PyPi
+RETRIES = 2
+
+# output of failures that are likely to succeed when retried
+TRANSIENT_PATTERNS = re.compile(
+    r"timed? ?out|temporary failure|connection (reset|refused|aborted)|"
+    r"max retries exceeded|too ?many ?requests|service unavailable|bad gateway|"
+    r"gateway time-?out|remote end closed|unexpected eof|broken pipe|"
+    r"\bhttp(/[\d.]+)?( error)?:? (429|5\d\d)\b|\bstatus( code)?:? (429|5\d\d)\b",
+    re.IGNORECASE,
+)
+
+# lines of output kept to describe failures
+TAIL_LINES = 50
+
+# running processes of `cancellable` functions and their cancellation events
+_RUNNING = {}
+_RUNNING_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def get_timeout(phase):
+    """Get the timeout of `phase` from `TOIL_REGISTER_<PHASE>_TIMEOUT` or defaults."""
+    timeout = float(
+        os.getenv(f"TOIL_REGISTER_{phase.upper()}_TIMEOUT", TIMEOUTS[phase])
+    )
+    return timeout or None
+
+
+def get_retries():
+    """Get the number of retries from `TOIL_REGISTER_RETRIES` or defaults."""
+    return int(os.getenv("TOIL_REGISTER_RETRIES", RETRIES))
+
+
+def is_transient(error):
+    """Check if a failed command timed out or failed with a transient error."""
+    if isinstance(error, subprocess.TimeoutExpired):
+        return True
+
+    return bool(TRANSIENT_PATTERNS.search(error.output or ""))
+
+
+def _kill(process, expired=None):
+    """Kill `process` and its children, which share its session."""
+    if expired is not None:
+        expired.set()
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def cancellable(function, cancelled):
+    """Wrap `function` so that `cancel(cancelled)` kills the commands it runs."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        _LOCAL.cancelled = cancelled
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _LOCAL.cancelled = None
+
+    return wrapper
+
+
+def cancel(cancelled):
+    """Set `cancelled` and kill the running commands of its `cancellable` functions."""
+    with _RUNNING_LOCK:
+        cancelled.set()
+
+        for process, event in _RUNNING.items():
+            if event is cancelled:
+                _kill(process)
+
+
+def _read(stream, emit):
+    """Emit the lines of `stream` as they're produced."""
+    pending = b""
+
+    # read chunks so that progress bars (lines ending in \r) are streamed
+    for chunk in iter(lambda: os.read(stream.fileno(), 2**16), b""):
+        complete = re.findall(rb"[^\r\n]*[\r\n]", pending + chunk)
+        pending = (pending + chunk)[sum(len(i) for i in complete) :]
+
+        for i in complete:
+            emit(i)
+
+    if pending:
+        emit(pending)
+
+
+def _run(command, timeout, echo, capture, cwd, env):  # pylint: disable=R0913
+    """Run `command` once streaming its stdout and stderr."""
+    tail, lines = deque(maxlen=TAIL_LINES), []
+    expired = threading.Event()
+    cancelled = getattr(_LOCAL, "cancelled", None) or threading.Event()
+
+    def emit(data, stderr=False):
+        line = data.decode("utf-8", errors="replace")
+        tail.append(line)
+
+        if capture and not stderr:
+            lines.append(line)
+
+        if echo:
+            click.echo(line, nl=False, err=stderr)
+
+    # registered under the lock so that `cancel` can't miss the process
+    with _RUNNING_LOCK:
+        if cancelled.is_set():
+            raise exceptions.CancelledError(f"Cancelled before running {command}.")
+
+        # stderr is only kept apart if stdout is captured
+        process = subprocess.Popen(
+            command,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if capture else subprocess.STDOUT,
+            start_new_session=True,
+        )
+
+        _RUNNING[process] = cancelled
+
+    timer = timeout and threading.Timer(timeout, _kill, [process, expired])
+    reader = capture and threading.Thread(
+        target=_read, args=(process.stderr, functools.partial(emit, stderr=True))
+    )
+
+    try:
+        if timer:
+            timer.start()
+
+        if reader:
+            reader.start()
+
+        _read(process.stdout, emit)
+        process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+
+        with _RUNNING_LOCK:
+            _RUNNING.pop(process)
+
+        if process.poll() is None:
+            _kill(process)
+            process.wait()
+
+        if reader:
+            reader.join()
+            process.stderr.close()
+
+        process.stdout.close()
+
+    # the merged tail describes failures
+    output = "".join(tail)
+
+    if cancelled.is_set():
+        raise exceptions.CancelledError(f"Cancelled {command}:\n{output}")
+
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(command, timeout, output=output)
+
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, output=output)
+
+    return "".join(lines) if capture else None
+
+
+def run(  # pylint: disable=R0913
+    command,
+    phase,
+    echo=True,
+    capture=False,
+    retry=False,
+    timeout=None,
+    cwd=None,
+    env=None,
+    backoff=5,
+    on_retry=None,
+):
+    """
+    Run `command` streaming its output line by line, with a timeout.
+
+    The command runs in its own session so that the whole process tree is
+    killed when the timeout expires or when the `cancellable` function that
+    runs it is cancelled. Only the last `TAIL_LINES` lines of stdout and
+    stderr are kept to describe failures.
+
+    Arguments:
+        command (list): command arguments.
+        phase (str): one of `TIMEOUTS`, used to get the default timeout.
+        echo (bool): print the output as it's produced.
+        capture (bool): return the whole stdout, stderr is only streamed
+            and kept in the tail.
+        retry (bool): retry transient failures with exponential backoff.
+        timeout (float): seconds before the command is killed.
+        cwd (str): working directory.
+        env (dict): environment variables, defaults to the current ones.
+        backoff (float): seconds before the first retry.
+        on_retry (callable): called before each retry (e.g. to clean up).
+
+    Raises:
+        subprocess.CalledProcessError: if the command fails.
+        subprocess.TimeoutExpired: if the command doesn't finish in time.
+        exceptions.CancelledError: if the command is cancelled.
+
+    Returns:
+        str: the stdout if `capture`, else None.
+    """
+    timeout = get_timeout(phase) if timeout is None else timeout
+    retries = get_retries() if retry else 0
+
+    for attempt in range(retries + 1):
+        try:
+            return _run(command, timeout, echo, capture, cwd, env)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as error:
+            if attempt == retries or not is_transient(error):
+                raise
+
+            delay = backoff * 2**attempt * random.uniform(0.5, 1.5)
+            click.secho(
+                f"Retrying {phase} in {delay:.1f}s ({error})...", fg="yellow", err=True
+            )
+
+            time.sleep(delay)
+
+            if on_retry:
+                on_retry()
+
+    return None  # pragma: no cover
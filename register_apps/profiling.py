@@ -0,0 +1,146 @@
+"""register_apps timing spans of the registration phases."""
+
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# profiling state shared by the threads of a process
+_STATE = {"path": None, "trace": None, "events": [], "depth": 0}
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+
+
+def is_enabled():
+    """Check if spans are being recorded."""
+    return bool(_STATE["path"] or _STATE["trace"])
+
+
+def enable(path=None, trace=None):
+    """
+    Start recording spans, nested calls are finished by the outermost one.
+
+    Arguments:
+        path (str): json lines file where spans are appended as they end.
+        trace (str): chrome trace file written by `finish`.
+    """
+    with _LOCK:
+        if not _STATE["depth"]:
+            _STATE.update(path=path, trace=trace, events=[])
+
+        _STATE["depth"] += 1
+
+
+def finish():
+    """Stop recording spans and write the chrome trace if requested."""
+    with _LOCK:
+        _STATE["depth"] -= 1
+
+        if _STATE["depth"]:
+            return
+
+        if _STATE["trace"]:
+            with open(_STATE["trace"], "w") as f:
+                json.dump({"traceEvents": _STATE["events"]}, f)
+
+        _STATE.update(path=None, trace=None, events=[])
+
+
+def _write(record):
+    line = json.dumps(record, sort_keys=True, default=str) + "\n"
+
+    with _LOCK:
+        if _STATE["path"]:
+            fd = os.open(_STATE["path"], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+            try:
+                os.write(fd, line.encode("utf-8"))
+            finally:
+                os.close(fd)
+
+        if _STATE["trace"]:
+            _STATE["events"].append(
+                {
+                    "name": record["name"],
+                    "ph": "X",
+                    "ts": int(record["start"] * 1e6),
+                    "dur": int(record["seconds"] * 1e6),
+                    "pid": record["pid"],
+                    "tid": record["thread"],
+                    "args": {
+                        k: v
+                        for k, v in record.items()
+                        if k not in {"name", "start", "seconds", "pid", "thread"}
+                    },
+                }
+            )
+
+
+@contextlib.contextmanager
+def span(name, **fields):
+    """
+    Time a phase of a registration (e.g. `pip`, `singularity_pull`).
+
+    Fields can be added to the yielded dictionary (e.g. `exit_code` or
+    `bytes`), the exit code of failed subprocesses is added automatically.
+
+    Arguments:
+        name (str): phase name.
+        fields (dict): json serializable fields to record.
+
+    Yields:
+        dict: fields of the span.
+    """
+    if not is_enabled():
+        yield fields
+        return
+
+    stack = _LOCAL.__dict__.setdefault("stack", [])
+    record = dict(
+        fields,
+        name=name,
+        parent=stack[-1] if stack else None,
+        pid=os.getpid(),
+        thread=threading.get_ident(),
+        start=time.time(),
+        status="ok",
+    )
+
+    stack.append(name)
+    clock = time.perf_counter()
+
+    try:
+        yield record
+    except BaseException as error:
+        record["status"] = "error"
+        record["error"] = str(error) or type(error).__name__
+
+        if getattr(error, "returncode", None) is not None:
+            record["exit_code"] = error.returncode
+
+        raise
+    finally:
+        stack.pop()
+        record["seconds"] = time.perf_counter() - clock
+        _write(record)
+
+
+def profiled(command):
+    """Decorate a click command to record spans when profiling is requested."""
+
+    @functools.wraps(command)
+    def wrapper(*args, profile=None, profile_trace=None, **kwargs):
+        if not (profile or profile_trace):
+            return command(*args, **kwargs)
+
+        enable(profile, profile_trace)
+
+        try:
+            with span(command.__name__):
+                return command(*args, **kwargs)
+        finally:
+            finish()
+
+    return wrapper
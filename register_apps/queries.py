@@ -0,0 +1,93 @@
+"""
+register_apps commands that only read the index and telemetry logs.
+
+These commands are called very often (e.g. by orchestration scripts), so
+they live apart from `cli` and only import what they read and the options.
+"""
+
+import json
+import time
+
+import click
+
+from register_apps import index
+from register_apps import options
+from register_apps import telemetry
+
+
+@click.command(name="list")
+@options.OPTDIR
+@options.AS_JSON
+def list_apps(optdir, as_json):
+    """List registered apps reading only the optdir index."""
+    _echo_entries(index.read_entries(optdir), as_json)
+
+
+@click.command()
+@options.OPTDIR
+@options.QUERY_KIND
+@options.QUERY_NAME
+@options.QUERY_VERSION
+@options.QUERY_TARGET
+@options.AS_JSON
+def query(optdir, kind, name, version, target, as_json):  # pylint: disable=R0913
+    """Query registered apps using shell-style patterns (e.g. 'toil_*')."""
+    entries = index.query(
+        index.read_entries(optdir),
+        kind=kind,
+        name=name,
+        version=version,
+        target=target,
+    )
+
+    _echo_entries(entries, as_json)
+
+
+@click.command()
+@options.TELEMETRY
+@options.QUERY_NAME
+@options.STATS_BY
+@options.STATS_DAYS
+@options.AS_JSON
+def stats(telemetry_dir, name, by, days, as_json):
+    """Report call counts and latency percentiles of apps with telemetry."""
+    if not telemetry_dir:
+        raise click.UsageError("Provide --telemetry or TOIL_REGISTER_TELEMETRY.")
+
+    since = None if days is None else time.time() - days * 24 * 3600
+    records = telemetry.read_records(telemetry_dir, name=name, since=since)
+    by = {"name": ("name",), "version": ("name", "version")}.get(
+        by, ("name", "version", "target")
+    )
+    results = telemetry.get_stats(records, by=by)
+
+    if as_json:
+        click.echo(json.dumps(results, indent=4, sort_keys=True))
+        return
+
+    columns = list(by) + ["calls", "errors", "hosts", "p50", "p90", "p99", "last"]
+    rows = [columns]
+
+    for i in results:
+        row = dict(i, last=time.strftime("%Y-%m-%d %H:%M", time.localtime(i["last"])))
+        row.update({j: f"{i[j]:.2f}s" for j in ("p50", "p90", "p99")})
+        rows.append([str(row[j]) for j in columns])
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+
+    for row in rows:
+        click.echo("  ".join(j.ljust(widths[i]) for i, j in enumerate(row)).rstrip())
+
+
+def _echo_entries(entries, as_json):
+    """Print `entries` as a table or as JSON."""
+    if as_json:
+        click.echo(json.dumps(entries, indent=4, sort_keys=True))
+        return
+
+    columns = ["kind", "name", "version", "target", "registered"]
+    rows = [columns] + [[str(i.get(j) or "") for j in columns] for i in entries]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+
+    for row in rows:
+        click.echo("  ".join(j.ljust(widths[i]) for i, j in enumerate(row)).rstrip())
@@ -0,0 +1,190 @@
+"""register_apps registry clients used to resolve image tags to digests."""
+
+import importlib
+import json
+import os
+import re
+
+from register_apps import exceptions
+from register_apps import profiling
+
+# client used when `TOIL_REGISTER_REGISTRY` is not set
+DEFAULT_CLIENT = "register_apps.registries:DockerRegistryClient"
+
+# client spec that disables registry lookups (e.g. in air-gapped nodes)
+DISABLED = "none"
+
+# seconds before a manifest lookup is abandoned
+TIMEOUT = 10
+
+# manifests lists are accepted so that multi-arch tags resolve to one digest
+MANIFEST_TYPES = [
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+]
+
+
+def parse_docker_url(image_url):
+    """
+    Split a `docker://` url into registry, repository and tag or digest.
+
+    Arguments:
+        image_url (str): e.g. `docker://leukgen/docker-pcapcore:v0.1.1`.
+
+    Returns:
+        tuple: registry host, repository and reference (tag or digest).
+    """
+    if not image_url.startswith("docker://"):
+        raise exceptions.ValidationError(f"Not a docker image url: {image_url}")
+
+    name = image_url[len("docker://") :]
+    registry, repository = "registry-1.docker.io", name
+    first, _, rest = name.partition("/")
+
+    if rest and ("." in first or ":" in first or first == "localhost"):
+        registry, repository = first, rest
+    elif not rest:
+        repository = f"library/{name}"
+
+    if "@" in repository:
+        repository, reference = repository.split("@", 1)
+    elif ":" in repository.rsplit("/", 1)[-1]:
+        repository, reference = repository.rsplit(":", 1)
+    else:
+        reference = "latest"
+
+    return registry, repository, reference
+
+
+class DockerRegistryClient:
+
+    """Resolve docker tags with manifest HEAD requests of the registry API."""
+
+    def __init__(self, timeout=TIMEOUT):
+        """Set the `timeout` in seconds of each request."""
+        self.timeout = timeout
+
+    def get_digest(self, image_url):
+        """
+        Get the digest of the manifest `image_url` currently points to.
+
+        Only manifest HEAD requests are made (no layers are downloaded),
+        anonymous tokens are requested when the registry asks for them.
+
+        Arguments:
+            image_url (str): `docker://` image url.
+
+        Returns:
+            str: manifest digest, e.g. `sha256:...`.
+        """
+        registry, repository, reference = parse_docker_url(image_url)
+
+        if reference.startswith("sha256:"):
+            return reference
+
+        local = registry.split(":")[0] in {"localhost", "127.0.0.1"}
+        url = (
+            f"{'http' if local else 'https'}://{registry}"
+            f"/v2/{repository}/manifests/{reference}"
+        )
+
+        headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+
+        # urllib is slow to import and only needed for lookups
+        from urllib import request  # pylint: disable=C0415
+
+        try:
+            response = self._head(url, headers)
+        except request.HTTPError as error:
+            if error.code != 401:
+                raise
+
+            token = self._get_token(error.headers.get("WWW-Authenticate", ""))
+            headers["Authorization"] = f"Bearer {token}"
+            response = self._head(url, headers)
+
+        digest = response.headers.get("Docker-Content-Digest")
+
+        if not digest:
+            raise exceptions.MissingDataError(f"No digest returned for {image_url}")
+
+        return digest
+
+    def _head(self, url, headers):
+        from urllib import request  # pylint: disable=C0415
+
+        return request.urlopen(
+            request.Request(url, headers=headers, method="HEAD"),
+            timeout=self.timeout,
+        )
+
+    def _get_token(self, challenge):
+        fields = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+
+        if not challenge.lower().startswith("bearer") or "realm" not in fields:
+            raise exceptions.ValidationError(f"Unsupported authentication: {challenge}")
+
+        from urllib import parse  # pylint: disable=C0415
+        from urllib import request  # pylint: disable=C0415
+
+        query = parse.urlencode({k: v for k, v in fields.items() if k != "realm"})
+
+        with request.urlopen(f"{fields['realm']}?{query}", timeout=self.timeout) as f:
+            response = json.loads(f.read().decode("utf-8"))
+
+        return response.get("token") or response["access_token"]
+
+
+def get_client(spec=None):
+    """
+    Create the registry client at a `module:attribute` import path.
+
+    Clients are objects with a `get_digest(image_url)` method, they are
+    selected with `spec`, `TOIL_REGISTER_REGISTRY` or `DEFAULT_CLIENT`.
+    Lookups are disabled with `DISABLED` (i.e. `none`).
+
+    Arguments:
+        spec (str): import path of a client class or factory.
+
+    Returns:
+        object: registry client, None if lookups are disabled.
+    """
+    spec = spec or os.getenv("TOIL_REGISTER_REGISTRY") or DEFAULT_CLIENT
+
+    if spec == DISABLED:
+        return None
+
+    try:
+        module, attribute = spec.split(":")
+        factory = getattr(importlib.import_module(module), attribute)
+    except (ValueError, ImportError, AttributeError) as error:
+        raise exceptions.ConfigurationError(f"Invalid registry client {spec}: {error}")
+
+    return factory()
+
+
+def resolve_digest(image_url, client):
+    """
+    Get the registry digest of `image_url`, None if it can't be resolved.
+
+    Arguments:
+        image_url (str): singularity image url.
+        client (object): registry client, see `get_client`.
+
+    Returns:
+        str: manifest digest or None.
+    """
+    if client is None or not image_url.startswith("docker://"):
+        return None
+
+    with profiling.span("registry_lookup", url=image_url) as span:
+        try:
+            digest = client.get_digest(image_url)
+        except (exceptions.PackageBaseException, OSError, ValueError) as error:
+            span["error"] = str(error)
+            return None
+
+        span["digest"] = digest
+        return digest
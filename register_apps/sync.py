@@ -0,0 +1,188 @@
+"""register_apps sync of registered images with the current registry digests."""
+
+from concurrent import futures
+from pathlib import Path
+import os
+
+import click
+
+from register_apps import exceptions
+from register_apps import images
+from register_apps import index
+from register_apps import registries
+from register_apps import utils
+from register_apps import wrappers
+
+
+def get_registered_urls(optdir, name=None):
+    """
+    Group the index entries of registered images by image url.
+
+    Arguments:
+        optdir (str): optdir root.
+        name (str): shell-style pattern of the apps to include.
+
+    Returns:
+        dict: lists of index entries keyed by image url.
+    """
+    urls = {}
+
+    for i in index.query(index.read_entries(optdir), name=name):
+        if i.get("image_url") and i.get("image"):
+            urls.setdefault(i["image_url"], []).append(i)
+
+    return urls
+
+
+def check_urls(store, urls, client, jobs=8):
+    """
+    Compare the recorded and current registry digests of `urls` concurrently.
+
+    Arguments:
+        store (Path): image store directory.
+        urls (list): image urls.
+        client (object): registry client, see `registries.get_client`.
+        jobs (int): number of concurrent manifest lookups.
+
+    Returns:
+        list: dictionaries with `url`, `recorded`, `digest` and `status`
+            (`unchanged`, `changed`, `unknown` if no digest was recorded,
+            `missing` if the url isn't in the store, or `failed`) keys.
+    """
+
+    def check(url):
+        record = images.get_url_record(store, url)
+        result = {"url": url, "recorded": (record or {}).get("registry_digest")}
+
+        try:
+            result["digest"] = client.get_digest(url)
+        except Exception as error:  # pylint: disable=broad-except
+            result.update(status="failed", digest=None, error=str(error))
+            return result
+
+        if not record:
+            result["status"] = "missing"
+        elif not result["recorded"]:
+            result["status"] = "unknown"
+        elif result["recorded"] != result["digest"]:
+            result["status"] = "changed"
+        else:
+            result["status"] = "unchanged"
+
+        return result
+
+    with futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        return list(pool.map(check, urls))
+
+
+def update_image(optdir, store, singularity, url, entries, digest):
+    """
+    Pull a changed `url` once and relink it in every registration using it.
+
+    Wrappers that stage the image embed its digest and size, so they are
+    updated to stage the new image.
+
+    Arguments:
+        optdir (str): optdir root.
+        store (Path): image store directory.
+        singularity (str): path to singularity.
+        url (str): image url.
+        entries (list): index entries of the registrations using `url`.
+        digest (str): registry digest the url currently resolves to.
+
+    Returns:
+        dict: the new store record of `url`.
+    """
+    old = images.get_url_record(store, url) or {}
+    record_path = images.get_url_record_path(store, url)
+
+    with utils.lock(record_path.with_suffix(".lock")):
+        record = images.pull_image(store, singularity, url, registry_digest=digest)
+
+    for entry in entries:
+        image = Path(entry["image"])
+
+        with utils.lock(image.parent / ".lock"):
+            images.link_image(record["path"], image)
+
+            if entry.get("wrapper") and old and old["digest"] != record["digest"]:
+                _update_wrapper(Path(entry["wrapper"]), old, record)
+
+        entry = dict(entry, digest=record["digest"].split(":", 1)[1])
+        entry.pop("registered", None)
+        index.add_entry(optdir, **entry)
+
+    return record
+
+
+def _update_wrapper(wrapper, old, record):
+    """Atomically update the staging preamble of `wrapper` for a new image."""
+    script = wrapper.read_text()
+    updated = wrappers.update_staging(
+        script,
+        old["digest"].split(":", 1)[1],
+        old.get("size"),
+        record["digest"].split(":", 1)[1],
+        record["size"],
+    )
+
+    if updated != script:
+        tmp_path = wrapper.with_name(f".{wrapper.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(updated)
+        tmp_path.chmod(0o755)
+        os.replace(str(tmp_path), str(wrapper))
+
+
+def sync_images(  # pylint: disable=R0913
+    optdir, singularity, name=None, client=None, jobs=8, dry_run=False
+):
+    """
+    Re-pull and relink the registered images whose tags changed upstream.
+
+    Arguments:
+        optdir (str): optdir root.
+        singularity (str): path to singularity.
+        name (str): shell-style pattern of the apps to sync.
+        client (str): import path of the registry client.
+        jobs (int): number of concurrent manifest lookups.
+        dry_run (bool): only report the changed images.
+
+    Returns:
+        list: results returned by `check_urls`, pulled images have a
+            `pulled` status.
+    """
+    store = images.get_store(optdir)
+    urls = get_registered_urls(optdir, name)
+    client = registries.get_client(client)
+
+    if client is None:
+        raise exceptions.ConfigurationError("Registry lookups are disabled.")
+
+    results = check_urls(store, sorted(urls), client, jobs)
+
+    for i in results:
+        if dry_run or i["status"] not in {"changed", "unknown"}:
+            continue
+
+        # the first digest of images registered before digests were recorded
+        if i["status"] == "unknown":
+            record = images.get_url_record(store, i["url"])
+            images.write_url_record(
+                store, i["url"], dict(record, registry_digest=i["digest"])
+            )
+
+            i["status"] = "recorded"
+            continue
+
+        click.echo(f"Pulling {i['url']}...")
+
+        try:
+            update_image(
+                optdir, store, singularity, i["url"], urls[i["url"]], i["digest"]
+            )
+
+            i["status"] = "pulled"
+        except Exception as error:  # pylint: disable=broad-except
+            i.update(status="failed", error=str(error))
+
+    return results
@@ -0,0 +1,142 @@
+"""register_apps invocation logs written by the wrappers and their stats."""
+
+from fnmatch import fnmatch
+from pathlib import Path
+import math
+import os
+
+# tab separated fields appended by the wrappers, see `wrappers.get_telemetry`
+FIELDS = ("timestamp", "host", "version", "target", "exit_code", "microseconds")
+
+# suffix of the per-app logs
+LOG_SUFFIX = ".log"
+
+
+def get_log(directory, name):
+    """
+    Create the log of app `name` so that the users of its group can append.
+
+    New telemetry directories are setgid, so that logs belong to the group
+    of the directory instead of the group of the registering user.
+
+    Arguments:
+        directory (str): telemetry directory.
+        name (str): package or image repository name.
+
+    Returns:
+        Path: log path.
+    """
+    directory = Path(directory)
+    log = directory / f"{name}{LOG_SUFFIX}"
+
+    if not directory.is_dir():
+        directory.mkdir(parents=True, exist_ok=True)
+        os.chmod(str(directory), 0o2775)
+
+    if not log.exists():
+        log.touch()
+        os.chmod(str(log), 0o664)
+
+    return log
+
+
+def parse_record(line):
+    """
+    Parse a line of a log, return None if it's malformed (e.g. a partial write).
+
+    Arguments:
+        line (str): tab separated `FIELDS`.
+
+    Returns:
+        dict: with `timestamp`, `host`, `version`, `target`, `exit_code` and
+            `seconds` keys.
+    """
+    values = line.rstrip("\n").split("\t")
+
+    if len(values) != len(FIELDS):
+        return None
+
+    record = dict(zip(FIELDS, values))
+
+    try:
+        record["timestamp"] = int(record["timestamp"])
+        record["exit_code"] = int(record["exit_code"])
+        record["seconds"] = int(record.pop("microseconds")) / 1e6
+    except ValueError:
+        return None
+
+    return record
+
+
+def read_records(directory, name=None, since=None):
+    """
+    Read the calls recorded in a telemetry directory.
+
+    Arguments:
+        directory (str): telemetry directory.
+        name (str): shell-style pattern of the apps to read.
+        since (float): ignore calls before this unix timestamp.
+
+    Yields:
+        dict: a parsed record with the app `name`.
+    """
+    for log in sorted(Path(directory).glob(f"*{LOG_SUFFIX}")):
+        app = log.name[: -len(LOG_SUFFIX)]
+
+        if name and not fnmatch(app, name):
+            continue
+
+        with open(str(log), errors="replace") as f:
+            for line in f:
+                record = parse_record(line)
+
+                if record and (since is None or record["timestamp"] >= since):
+                    record["name"] = app
+                    yield record
+
+
+def percentile(values, q):
+    """Get the nearest-rank `q` percentile of sorted `values`."""
+    if not values:
+        return None
+
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def get_stats(records, by=("name", "version")):
+    """
+    Aggregate records into call counts and latency percentiles.
+
+    Arguments:
+        records (iterable): records returned by `read_records`.
+        by (tuple): record fields used to group the calls.
+
+    Returns:
+        list: dictionaries with the `by` fields, `calls`, `errors`, `hosts`,
+            `p50`, `p90`, `p99`, `max` (seconds) and `last` (timestamp) keys.
+    """
+    groups = {}
+
+    for i in records:
+        group = groups.setdefault(tuple(i[j] for j in by), [])
+        group.append(i)
+
+    stats = []
+
+    for key, group in sorted(groups.items()):
+        seconds = sorted(i["seconds"] for i in group)
+        stats.append(
+            dict(
+                zip(by, key),
+                calls=len(group),
+                errors=sum(1 for i in group if i["exit_code"]),
+                hosts=len({i["host"] for i in group}),
+                p50=percentile(seconds, 50),
+                p90=percentile(seconds, 90),
+                p99=percentile(seconds, 99),
+                max=seconds[-1],
+                last=max(i["timestamp"] for i in group),
+            )
+        )
+
+    return stats
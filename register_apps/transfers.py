@@ -0,0 +1,44 @@
+"""
+register_apps commands that move registered versions across sites.
+
+They live apart from `cli` so that registrations don't import the bundles
+implementation and its compression libraries.
+"""
+
+import shutil
+
+import click
+
+from register_apps import bundles
+from register_apps import environments
+from register_apps import options
+
+
+@click.command(name="export")
+@options.OPTDIR
+@options.APP_NAME
+@options.APP_VERSION
+@options.BUNDLE_OUTPUT
+@options.COMPRESSION
+def export_bundle(optdir, name, version, output, compression):
+    """Export a registered version as a portable bundle."""
+    manifest = bundles.export_bundle(optdir, name, version, output, compression)
+    click.secho(
+        f"\nExported {len(manifest['files'])} files, {len(manifest['images'])} "
+        f"images and {len(manifest['venvs'])} environments to:\n\n\t{output}\n",
+        fg="green",
+    )
+
+
+@click.command(name="import")
+@options.BUNDLE
+@options.OPTDIR
+@options.BINDIR
+@options.PYTHON3
+def import_bundle(bundle, optdir, bindir, python):
+    """Import a bundle created with `register_apps export`."""
+    entries = bundles.import_bundle(
+        bundle, optdir, bindir, environments.get_workon_home(), shutil.which(python)
+    )
+
+    click.secho(f"\nImported {len(entries)} apps.\n", fg="green")
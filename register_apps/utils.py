@@ -1,16 +1,29 @@
 """register_apps utils."""
 
+import contextlib
 import os
-import tarfile
+import random
+import re
+import threading
+import time
+
+from register_apps import profiling
 
 
 def force_link(src, dst):
-    """Force a link between src and dst."""
+    """Force a link between src and dst, `dst` is replaced atomically."""
+    # renaming a link over another link to the same inode is a no-op
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        return
+
+    tmp_path = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    os.link(src, tmp_path)
+
     try:
-        os.unlink(dst)
-        os.link(src, dst)
+        os.replace(tmp_path, dst)
     except OSError:
-        os.link(src, dst)
+        os.unlink(tmp_path)
+        raise
 
 
 def force_symlink(src, dst):
@@ -22,7 +35,185 @@ def force_symlink(src, dst):
         os.symlink(src, dst)
 
 
+def format_bytes(size):
+    """Format a number of bytes in human readable units (e.g. 1.5 GB)."""
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024.0
+    return f"{size:.1f} TB"
+
+
+def rewrite_paths(paths, replacements):
+    """
+    Replace path prefixes in text files, binary files and symlinks are skipped.
+
+    Arguments:
+        paths (list): files to rewrite in place.
+        replacements (dict): old paths as keys and new paths as values.
+
+    Returns:
+        list: files that were rewritten.
+    """
+    if not replacements:
+        return []
+
+    # replace longer paths first and only whole path components
+    replacements = {
+        k.encode("utf-8"): v.encode("utf-8") for k, v in replacements.items()
+    }
+    pattern = b"|".join(re.escape(i) for i in sorted(replacements, key=len)[::-1])
+    pattern = re.compile(b"(" + pattern + rb")(?![\w.-])")
+    rewritten = []
+
+    for path in paths:
+        path = str(path)
+
+        if os.path.islink(path) or not os.path.isfile(path):
+            continue
+
+        with open(path, "rb") as f:
+            content = f.read()
+
+        if b"\0" in content[:8192]:
+            continue
+
+        new_content = pattern.sub(lambda i: replacements[i.group(1)], content)
+
+        if new_content != content:
+            mode = os.stat(path).st_mode
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+
+            with open(tmp_path, "wb") as f:
+                f.write(new_content)
+
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+            rewritten.append(path)
+
+    return rewritten
+
+
 def tar_dir(output_path, source_dir):
     """Compress a `source_dir` in `output_path`."""
+    import tarfile  # pylint: disable=import-outside-toplevel
+
     with tarfile.open(output_path, "w:gz") as tar:
         tar.add(source_dir, arcname=os.path.basename(source_dir))
+
+
+@contextlib.contextmanager
+def lock(path, poll=1, stale=300, timeout=None):
+    """
+    Acquire an advisory lock that is safe to use in NFS.
+
+    The lock is acquired by hardlinking a unique file to `path`, which is
+    atomic even in NFS. While held, the lock mtime is refreshed so that
+    locks of dead processes can be broken after `stale` seconds.
+
+    Arguments:
+        path (str): path to the lock file.
+        poll (float): maximum seconds between attempts to acquire the lock,
+            attempts start 10ms apart and back off exponentially.
+        stale (float): seconds after which an unrefreshed lock is broken.
+        timeout (float): maximum seconds to wait, wait forever if None.
+
+    Yields:
+        bool: True if the lock was held by another process when requested.
+
+    Raises:
+        TimeoutError: if the lock can't be acquired before `timeout`.
+    """
+    path = str(path)
+    unique = f"{path}.{os.uname().nodename}.{os.getpid()}.{os.urandom(16).hex()}"
+
+    with open(unique, "w") as f:
+        f.write(unique)
+
+    try:
+        with profiling.span("lock", path=path) as span:
+            waited = span["waited"] = _acquire_lock(unique, path, poll, stale, timeout)
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=_refresh_lock, args=(path, stop, stale / 3.0), daemon=True
+        )
+        heartbeat.start()
+
+        try:
+            yield waited
+        finally:
+            stop.set()
+            heartbeat.join()
+
+            # the lock may have been broken as stale and taken by another process
+            try:
+                if os.path.samefile(path, unique):
+                    os.unlink(path)
+            except OSError:
+                pass
+    finally:
+        os.unlink(unique)
+
+
+def _acquire_lock(unique, path, poll, stale, timeout):
+    """Hardlink `unique` to `path` and return True if the lock was held."""
+    start = time.time()
+    waited = False
+    delay = 0.01
+
+    while True:
+        try:
+            os.link(unique, path)
+        except OSError:
+            pass
+
+        # the link count is reliable even if the link call failed in NFS
+        if os.stat(unique).st_nlink == 2:
+            return waited
+
+        try:
+            stat = os.stat(path)
+
+            if time.time() - stat.st_mtime > stale:
+                _break_lock(path, stat)
+                continue
+        except OSError:
+            continue
+
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(f"Timed out waiting for lock: {path}")
+
+        # short critical sections (e.g. index appends) are waited briefly
+        waited = True
+        time.sleep(min(delay, poll) * random.uniform(0.5, 1))
+        delay *= 2
+
+
+def _break_lock(path, stat):
+    """
+    Remove the stale lock at `path` unless it changed since it was `stat`'ed.
+
+    The lock is renamed to a unique name first, so that only one process
+    breaks it, and put back if it was refreshed or replaced in the meantime.
+    """
+    broken = f"{path}.{os.uname().nodename}.{os.getpid()}.{os.urandom(16).hex()}"
+    os.rename(path, broken)
+
+    try:
+        moved = os.stat(broken)
+
+        if (moved.st_ino, moved.st_mtime) != (stat.st_ino, stat.st_mtime):
+            os.link(broken, path)
+    except OSError:
+        pass
+    finally:
+        os.unlink(broken)
+
+
+def _refresh_lock(path, stop, interval):
+    while not stop.wait(interval):
+        try:
+            os.utime(path)
+        except OSError:  # pragma: no cover
+            pass
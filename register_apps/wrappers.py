@@ -0,0 +1,380 @@
+"""register_apps executable wrappers."""
+
+import re
+
+import click
+
+from register_apps import utils
+
+# wrapper modes, legacy runs the tool as a child of bash and forks uuidgen
+MODES = ["legacy", "exec", "instance"]
+
+# file touched by wrappers on each call to track when a version was last used
+STAMP_FILENAME = ".last_used"
+
+# runs commands in a long-lived instance per user and node, the instance is
+# started lazily under an exclusive lock and every call holds a shared lock
+# until it exits so that the reaper only stops instances nobody is using
+INSTANCE_TEMPLATE = """#!/bin/bash
+instance="{name}_${{USER}}_${{HOSTNAME%%.*}}"
+instance="${{instance//[^A-Za-z0-9_]/_}}"
+state="${{TMPDIR:-/tmp}}/.register_apps_${{USER}}"
+[ -d "$state" ] || mkdir -p "$state"
+: > "$state/$instance.used"
+exec 9> "$state/$instance.lock"
+flock -s 9
+
+idle() {{
+    [ ! -e "$state/$instance.used" ] ||
+    [ $(( $(date +%s) - $(stat -c %Y "$state/$instance.used") )) -ge {timeout} ]
+}}
+
+running() {{
+    local reaper
+    read -r reaper 2> /dev/null < "$state/$instance.pid"
+    [ -n "$reaper" ] && kill -0 "$reaper" 2> /dev/null
+}}
+
+if ! running; then
+    flock 9
+
+    if ! running; then
+        {singularity} instance stop "$instance" > /dev/null 2>&1 9>&-
+
+        if ! {singularity} instance start {options} "$instance" > /dev/null 9>&-; then
+            exec 9>&-
+            {run}{singularity} exec {options} {command} "$@"{record}
+        fi
+
+        (
+            exec 9>&-
+            while sleep {interval}; do
+                idle || continue
+                exec 9> "$state/$instance.lock"
+                flock 9
+                if idle; then
+                    rm -f "$state/$instance.pid"
+                    {singularity} instance stop "$instance"
+                    exit
+                fi
+                exec 9>&-
+            done
+        ) < /dev/null > /dev/null 2>&1 &
+
+        echo $! > "$state/$instance.pid"
+    fi
+
+    flock -s 9
+fi
+
+{run}{singularity} exec instance://"$instance" {command} "$@"{record}
+"""
+
+
+# copies the image to node-local scratch on first use, the copy is verified
+# and marked as ready with a `.ok` file whose mtime is used for LRU eviction
+STAGING_TEMPLATE = """image={image}
+stage="{stage_dir}/.register_apps_${{USER}}"
+staged="$stage/{key}"
+
+stage_image() {{
+    local used tmp="$staged.$HOSTNAME.$$"
+    [ -d "$stage" ] || mkdir -p "$stage" || return 1
+    exec 8> "$stage/.lock" && flock 8 || return 1
+    [ -f "$staged.ok" ] && return 0
+    used=$(du -cb "$stage"/*.img 2> /dev/null | tail -n 1 | cut -f 1)
+
+    for ok in $(ls -tr "$stage"/*.ok 2> /dev/null); do
+        [ $(( used + {size} )) -le {limit} ] && break
+        used=$(( used - $(stat -c %s "${{ok%.ok}}") ))
+        rm -f "$ok" "${{ok%.ok}}"
+    done
+
+    [ $(( used + {size} )) -le {limit} ] &&
+    cp "$image" "$tmp" &&
+    [ $(stat -c %s "$tmp") -eq {size} ] &&
+    {verify}mv "$tmp" "$staged" &&
+    : > "$staged.ok" && return 0
+    rm -f "$tmp"
+    return 1
+}}
+
+if [ -f "$staged.ok" ]; then
+    : > "$staged.ok"
+    image="$staged"
+elif stage_image; then
+    image="$staged"
+fi
+
+exec 8>&-
+"""
+
+# appends `timestamp host version target exit_code wall_microseconds` to a
+# log using bash builtins only, EPOCHREALTIME requires bash 5+
+TELEMETRY_TEMPLATE = """__start=${{EPOCHREALTIME/[.,]/}}
+[ -n "$__start" ] || printf -v __start '%(%s)T000000' -1
+
+__record() {{
+    local code=$? end=${{EPOCHREALTIME/[.,]/}}
+    [ -n "$end" ] || printf -v end '%(%s)T000000' -1
+    printf '%s\\t%s\\t%s\\t%s\\t%s\\t%s\\n' "${{__start:0:-6}}" "${{HOSTNAME%%.*}}" \\
+        "{version}" "{target}" "$code" "$(( end - __start ))" 2> /dev/null >> "{log}"
+    exit $code
+}}
+"""
+
+
+def get_telemetry(log, version, target):
+    """
+    Get the bash preamble that defines the `__record` telemetry function.
+
+    Wrappers with telemetry run the command as a child of bash (instead of
+    using `exec`) and call `__record` to append a line to `log` with the
+    call timestamp, host, version, target, exit code and wall microseconds.
+
+    Arguments:
+        log (str): path to the per-app log.
+        version (str): registered version.
+        target (str): registered executable name.
+
+    Returns:
+        str: bash preamble.
+    """
+    return TELEMETRY_TEMPLATE.format(log=log, version=version, target=target)
+
+
+def get_staging(image, stage_dir, limit, digest, size, verify="size"):
+    """
+    Get the bash preamble that stages `image` in node-local scratch.
+
+    The preamble defines an `image` variable pointing to the staged copy,
+    or to the original `image` if it can't be staged. Staging is done once
+    per node under a lock, verifying the copy size (and digest if `verify`
+    is `digest`) and evicting least recently used images above `limit`.
+
+    Arguments:
+        image (str): path to the singularity image.
+        stage_dir (str): node-local directory expression (e.g. /scratch).
+        limit (int): maximum bytes of staged images per user and node.
+        digest (str): sha256 hex digest of the image.
+        size (int): size of the image in bytes.
+        verify (str): either `size` or `digest`.
+
+    Returns:
+        str: bash preamble.
+    """
+    if verify == "digest":
+        verify = f'[ "$(sha256sum "$tmp" | cut -d " " -f 1)" == {digest} ] &&\n    '
+    else:
+        verify = ""
+
+    return STAGING_TEMPLATE.format(
+        image=image,
+        stage_dir=stage_dir,
+        key=f"{digest}.img",
+        size=int(size),
+        limit=int(limit),
+        verify=verify,
+    )
+
+
+def update_staging(script, old_digest, old_size, digest, size):
+    """
+    Make a wrapper stage a new image with the same path (e.g. a synced tag).
+
+    Arguments:
+        script (str): wrapper script created with a `get_staging` preamble.
+        old_digest (str): sha256 hex digest of the previous image.
+        old_size (int): size in bytes of the previous image.
+        digest (str): sha256 hex digest of the new image.
+        size (int): size in bytes of the new image.
+
+    Returns:
+        str: the updated script, unchanged if it doesn't stage the image.
+    """
+    if f'staged="$stage/{old_digest}.img"' not in script:
+        return script
+
+    script = script.replace(old_digest, digest)
+    script = script.replace(f"used + {old_size} ", f"used + {size} ")
+    return script.replace(f"-eq {old_size} ]", f"-eq {size} ]")
+
+
+def get_workdir(tmpvar, prefix, mode):
+    """
+    Get a unique singularity workdir expression for a wrapper.
+
+    The `exec` mode builds it from bash builtins only (hostname, pid and
+    random numbers) instead of forking `uuidgen` on every call.
+
+    Arguments:
+        tmpvar (str): environment variable expression of the temp directory.
+        prefix (str): workdir name prefix (e.g. image repository and version).
+        mode (str): one of `MODES`.
+
+    Returns:
+        str: workdir expression.
+    """
+    if mode == "legacy":
+        return f"{tmpvar}/${{USER}}_{prefix}_`uuidgen`"
+    return f"{tmpvar}/${{USER}}_{prefix}_${{HOSTNAME}}_$$_${{RANDOM}}${{RANDOM}}"
+
+
+def get_script(command, mode, telemetry=None):
+    """
+    Get the bash script that runs `command`.
+
+    Arguments:
+        command (list): command arguments to be joined by spaces.
+        mode (str): one of `MODES`, `exec` and `instance` replace bash with
+            the command.
+        telemetry (str): preamble that records calls (see `get_telemetry`),
+            the command is not replaced with `exec` so that it can be timed.
+
+    Returns:
+        str: bash script.
+    """
+    command = list(command)
+
+    if telemetry:
+        script = f"#!/bin/bash\n{' '.join(command).rstrip()}; __record\n"
+        return add_preamble(script, telemetry)
+
+    if mode != "legacy":
+        command.insert(0, "exec")
+
+    return f"#!/bin/bash\n{' '.join(command)}"
+
+
+def get_singularity_script(  # pylint: disable=R0913
+    singularity,
+    image,
+    command,
+    volumes,
+    tmpvar,
+    prefix,
+    mode="legacy",
+    timeout=600,
+    staging=None,
+    telemetry=None,
+):
+    """
+    Get the script of a command that runs inside a singularity image.
+
+    Arguments:
+        singularity (str): path to singularity.
+        image (str): path to the singularity image.
+        command (str): command to run inside the image.
+        volumes (list): tuples of host and container paths to bind.
+        tmpvar (str): environment variable expression of the temp directory.
+        prefix (str): workdir and instance name prefix.
+        mode (str): one of `MODES`.
+        timeout (int): idle seconds before stopping an instance.
+        staging (str): preamble that stages the image (see `get_staging`).
+        telemetry (str): preamble that records calls (see `get_telemetry`).
+
+    Returns:
+        str: bash script.
+    """
+    # telemetry goes first so that staging is included in the wall time
+    preamble = "\n".join(i for i in (telemetry, staging) if i)
+
+    if staging:
+        image = '"$image"'
+
+    if mode == "instance":
+        options = [
+            "--workdir",
+            get_workdir(tmpvar, prefix, "exec"),
+            " ".join(f"--bind {i}:{j}" for i, j in volumes),
+            image,
+        ]
+
+        script = INSTANCE_TEMPLATE.format(
+            name=re.sub(r"[^A-Za-z0-9_]", "_", prefix),
+            singularity=singularity,
+            options=" ".join(i for i in options if i),
+            command=command,
+            timeout=int(timeout),
+            interval=max(1, min(60, int(timeout) // 2)),
+            run="" if telemetry else "exec ",
+            record="; __record" if telemetry else "",
+        )
+    else:
+        script = get_script(
+            [
+                singularity,
+                "exec",
+                "--workdir",
+                get_workdir(tmpvar, prefix, mode),
+                " ".join(f"--bind {i}:{j}" for i, j in volumes),
+                image,
+                command,
+                '"$@"\n',
+            ],
+            mode,
+            preamble if telemetry else None,
+        )
+
+        if telemetry:
+            return script
+
+    return add_preamble(script, preamble) if preamble else script
+
+
+def get_toil_script(  # pylint: disable=R0913
+    toolpath, image, volumes, tmpvar, mode="legacy", telemetry=None
+):
+    """Get the script of a toil container pipeline."""
+    return get_script(
+        [
+            toolpath,
+            '"$@"',
+            "--singularity",
+            image,
+            " ".join(f"--volumes {i} {j}" for i, j in volumes),
+            "--workDir",
+            tmpvar,
+            "\n",
+        ],
+        mode,
+        telemetry,
+    )
+
+
+def get_python_script(toolpath, mode="legacy", telemetry=None):
+    """Get the script of a python package entry point."""
+    return get_script([toolpath, '"$@"', "\n"], mode, telemetry)
+
+
+def add_preamble(script, preamble):
+    """Insert `preamble` right after the shebang of `script`."""
+    shebang, script = script.split("\n", 1)
+    return f"{shebang}\n{preamble}\n{script}"
+
+
+def get_usage_stamp(directory):
+    """Get a bash line that touches the usage stamp of `directory` with builtins."""
+    return f': > "{directory}/{STAMP_FILENAME}" 2> /dev/null'
+
+
+def write_executable(optexe, binexe, script):
+    """Write `script` to `optexe` and link it to `binexe`."""
+    write_executables([(optexe, binexe, script)])
+
+
+def write_executables(executables):
+    """Write and link a batch of `(optexe, binexe, script)` executables."""
+    click.echo(f"Creating and linking {len(executables)} executable(s)...")
+    paths = []
+
+    for optexe, binexe, script in executables:
+        optexe.write_text(script)
+        optexe.chmod(mode=0o755)
+        utils.force_symlink(optexe, binexe)
+        paths += [optexe, binexe]
+
+    click.secho(
+        "\nExecutables available at:\n" + "".join(f"\n\t{i}" for i in paths) + "\n",
+        fg="green",
+    )
@@ -0,0 +1,109 @@
+"""register_apps batch tests."""
+
+import json
+
+from click.testing import CliRunner
+import click
+import pytest
+
+from register_apps import batch
+from register_apps import cli
+from register_apps import exceptions
+
+
+@click.command()
+@click.option("--pypi_name")
+@click.option("--pypi_version")
+@click.option("--volumes", type=click.Tuple([str, str]), multiple=True)
+def fake_register(pypi_name, pypi_version, volumes):
+    """Fake register command that fails for the `broken` package."""
+    assert pypi_name != "broken", "broken package"
+    assert volumes == (("/tmp", "/carlos"),)
+    click.echo(f"registered {pypi_name} {pypi_version}")
+
+
+def test_load_manifest(tmpdir):
+    """Test manifest defaults are merged into each registration."""
+    manifest = tmpdir.join("manifest.json")
+    manifest.write(
+        json.dumps(
+            {
+                "defaults": {"optdir": "/opt", "bindir": "/bin"},
+                "registrations": [
+                    {"kind": "python", "pypi_name": "a", "pypi_version": "1"},
+                    {"kind": "toil", "pypi_name": "b", "optdir": "/other"},
+                ],
+            }
+        )
+    )
+
+    registrations = batch.load_manifest(manifest.strpath)
+    assert registrations[0]["optdir"] == "/opt"
+    assert registrations[1]["optdir"] == "/other"
+    assert registrations[1]["bindir"] == "/bin"
+
+    manifest.write(json.dumps([{"kind": "docker"}]))
+    with pytest.raises(exceptions.ValidationError):
+        batch.load_manifest(manifest.strpath)
+
+
+def test_load_manifest_yaml(tmpdir):
+    """Test YAML manifests are loaded like JSON ones."""
+    pytest.importorskip("yaml")
+    manifest = tmpdir.join("manifest.yaml")
+    manifest.write("- kind: python\n  pypi_name: a\n  pypi_version: '1'\n")
+    assert batch.load_manifest(manifest.strpath)[0]["pypi_version"] == "1"
+
+
+def test_get_arguments():
+    """Test registration items are converted to command line arguments."""
+    args = batch.get_arguments(
+        {
+            "kind": "toil",
+            "pypi_name": "a",
+            "volumes": [["/ifs", "/ifs"], ["/res", "/res"]],
+            "offline": True,
+            "github_user": None,
+        }
+    )
+
+    assert args == [
+        "--pypi_name",
+        "a",
+        "--volumes",
+        "/ifs",
+        "/ifs",
+        "--volumes",
+        "/res",
+        "/res",
+        "--offline",
+    ]
+
+    args = batch.get_arguments({"targets": {"bwa": "bwa", "st": "samtools view"}})
+    assert args == ["--targets", "bwa=bwa", "--targets", "st=samtools view"]
+
+
+def test_register_batch(tmpdir, monkeypatch):
+    """Test register_batch reports each registration and fails if any fails."""
+    monkeypatch.setattr(cli, "register_python", fake_register)
+    manifest = tmpdir.join("manifest.json")
+    report = tmpdir.join("report.json")
+    registrations = [
+        {"kind": "python", "pypi_name": name, "pypi_version": "v1"}
+        for name in ["a", "b", "broken"]
+    ]
+
+    for i in registrations:
+        i["volumes"] = [["/tmp", "/carlos"]]
+
+    manifest.write(json.dumps(registrations))
+    result = CliRunner().invoke(
+        cli.register_batch,
+        ["--manifest", manifest.strpath, "--jobs", "2", "--report", report.strpath],
+    )
+
+    results = json.loads(report.read())
+    assert result.exit_code == 1
+    assert [i["status"] for i in results] == ["ok", "ok", "failed"]
+    assert "broken package" in results[2]["error"]
+    assert "2 succeeded, 1 failed" in result.output
@@ -0,0 +1,43 @@
+"""register_apps benchmarks smoke tests."""
+
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+import subprocess
+import sys
+
+import pytest
+
+BENCHMARKS = join(dirname(dirname(abspath(__file__))), "benchmarks")
+
+
+@pytest.mark.parametrize("kind", ["python", "singularity", "toil"])
+def test_bench_registration(kind):
+    """Test the registration benchmark runs and reports every size."""
+    output = subprocess.check_output(
+        [
+            sys.executable,
+            join(BENCHMARKS, "bench_registration.py"),
+            "--apps",
+            "1",
+            "3",
+            "--kind",
+            kind,
+            "--hits",
+            "2",
+        ]
+    ).decode()
+
+    rows = [i.split() for i in output.splitlines() if i.startswith(kind)]
+    assert [i[1] for i in rows] == ["1", "3"]
+    assert all(i[-1] == "0" for i in rows), output
+    assert "store" in output
+
+
+def test_bench_wrappers():
+    """Test the wrapper benchmark reports every wrapper mode."""
+    output = subprocess.check_output(
+        [sys.executable, join(BENCHMARKS, "bench_wrappers.py"), "--calls", "2"]
+    ).decode()
+
+    assert len(output.strip().splitlines()) == 4
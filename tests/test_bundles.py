@@ -0,0 +1,225 @@
+"""register_apps bundles tests."""
+
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tarfile
+
+from click.testing import CliRunner
+import pytest
+
+from register_apps import archives
+from register_apps import bundles
+from register_apps import cli
+from register_apps import environments
+from register_apps import exceptions
+from register_apps import index
+from register_apps import main
+from register_apps import utils as apps_utils
+from tests import utils
+
+
+def test_rewrite_paths(tmpdir):
+    """Test rewrite_paths only rewrites text files."""
+    text, binary = tmpdir.join("text"), tmpdir.join("binary")
+    text.write("#!/old/env/bin/python\n/old/env/lib /old/envs\n")
+    binary.write_binary(b"\0/old/env")
+    os.symlink(text.strpath, tmpdir.join("link").strpath)
+    paths = [text, binary, tmpdir.join("link"), tmpdir.join("missing")]
+    rewritten = apps_utils.rewrite_paths(paths, {"/old/env": "/new", "/old": "/x"})
+    assert rewritten == [text.strpath]
+    assert text.read() == "#!/new/bin/python\n/new/lib /x/envs\n"
+    assert binary.read_binary() == b"\0/old/env"
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_export_and_import(tmpdir, monkeypatch, compression):
+    """Test bundles are exported and imported in a new site."""
+    if compression == "zstd" and archives.get_compression() != "zstd":
+        pytest.skip("zstd is not available.")
+
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    runner = CliRunner()
+    singularity, _ = utils.make_fake_singularity(tmpdir)
+    wheelhouse = tmpdir.mkdir("wheelhouse")
+    utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    optdir = tmpdir.join("opt")
+    result = runner.invoke(
+        cli.register_toil,
+        [
+            "--pypi_name",
+            "fake_tool",
+            "--pypi_version",
+            "v0.1.1",
+            "--optdir",
+            optdir.strpath,
+            "--bindir",
+            tmpdir.join("bin").strpath,
+            "--python",
+            sys.executable,
+            "--volumes",
+            "/tmp",
+            "/carlos",
+            "--singularity",
+            singularity,
+            "--wheelhouse",
+            wheelhouse.strpath,
+            "--offline",
+        ],
+    )
+
+    assert not result.exit_code, result.output
+
+    # the environment was created with an interpreter the new site doesn't have
+    venv = tmpdir.join("envs", "production__fake_tool__v0.1.1")
+    config = venv.join("pyvenv.cfg")
+    config.write(re.sub(r"(?m)^home = .*$", "home = /old/bin", config.read()))
+
+    for i in venv.join("bin").listdir("python*"):
+        if i.islink() and os.path.isabs(os.readlink(i.strpath)):
+            i.remove()
+            os.symlink("/old/bin/python3", i.strpath)
+
+    bundle = tmpdir.join("bundle.tar").strpath
+    args = ["--optdir", optdir.strpath, "--name", "fake_tool", "--version", "v0.1.1"]
+    args += ["--output", bundle, "--compression", compression]
+    result = runner.invoke(main.main, ["export"] + args)
+    assert not result.exit_code, result.output
+
+    # import in a new site, there are no original paths anymore
+    os.rename(tmpdir.strpath, tmpdir.strpath + "_old")
+    site = tmpdir.strpath + "_old"
+    monkeypatch.setenv("WORKON_HOME", os.path.join(site, "new_envs"))
+    optdir = os.path.join(site, "new_opt")
+    bindir = os.path.join(site, "new_bin")
+    args = [os.path.join(site, "bundle.tar"), "--optdir", optdir, "--bindir", bindir]
+    args += ["--python", sys.executable]
+    result = runner.invoke(main.main, ["import"] + args)
+    assert not result.exit_code, result.output
+
+    # interpreter links and pyvenv.cfg point to the python of the new site
+    venv = os.path.join(site, "new_envs", "production__fake_tool__v0.1.1")
+    python = os.path.realpath(sys.executable)
+    assert f"home = {os.path.dirname(python)}\n" in open(venv + "/pyvenv.cfg").read()
+    assert os.path.realpath(os.path.join(venv, "bin", "python")) == python
+
+    binexe = os.path.join(bindir, "fake_tool_v0.1.1")
+    script = open(binexe).read()
+    assert optdir in script and tmpdir.strpath + "/" not in script
+    assert b"0.1.1" in subprocess.check_output([binexe, "--version"])
+
+    entry = index.read_entries(optdir)[0]
+    assert entry["link"] == binexe
+    assert entry["venv"] == os.path.join(
+        site, "new_envs", "production__fake_tool__v0.1.1"
+    )
+    assert os.listdir(os.path.join(optdir, ".images", "sha256"))
+
+    # imports do not overwrite registered apps
+    assert runner.invoke(main.main, ["import"] + args).exit_code
+
+
+def make_bundle(path, members):
+    """Create a bundle tar with `members` (names and bytes)."""
+    with tarfile.open(path, "w") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+@pytest.mark.parametrize(
+    "fields, members, message",
+    [
+        (None, {}, "has no manifest.json"),
+        ({"entries": None}, {}, "manifest misses: ['entries']"),
+        ({"compression": "lzma"}, {}, "Unknown bundle compression"),
+        ({"name": ".."}, {}, "Invalid name in bundle manifest: .."),
+        ({"files": ["../../bin/app"]}, {}, "Invalid name in bundle manifest"),
+        ({}, {}, "misses members: ['images/app.sif', 'payload.tar.gz']"),
+        ({}, {"payload.tar.gz": b""}, "misses members: ['images/app.sif']"),
+    ],
+)
+def test_import_invalid_bundle(tmpdir, fields, members, message):
+    """Test bundles are checked before anything is extracted."""
+    bundle = tmpdir.join("bundle.tar").strpath
+    manifest = dict(
+        name="app", version="v1", optdir="/old/opt/app/v1", compression="gzip",
+        images=["app.sif"], files=["app"], venvs=[], entries=[],
+    )  # fmt: skip
+
+    if fields is not None:
+        manifest = {k: v for k, v in dict(manifest, **fields).items() if v is not None}
+        members[bundles.MANIFEST_NAME] = json.dumps(manifest).encode("utf-8")
+
+    make_bundle(bundle, members)
+
+    with pytest.raises(exceptions.ValidationError) as error:
+        bundles.import_bundle(
+            bundle, tmpdir.join("opt"), tmpdir.join("bin"), tmpdir, sys.executable
+        )
+
+    assert message in str(error.value)
+    assert not tmpdir.join("opt").check()
+
+
+@pytest.mark.parametrize(
+    "name, kind, linkname",
+    [
+        ("/tmp/file", tarfile.REGTYPE, ""),
+        ("../file", tarfile.REGTYPE, ""),
+        ("outside/file", tarfile.REGTYPE, ""),
+        ("link", tarfile.SYMTYPE, "/etc/passwd"),
+        ("dir/link", tarfile.SYMTYPE, "../../file"),
+        ("link", tarfile.LNKTYPE, "../file"),
+    ],
+)
+def test_extract_member_rejects_unsafe(tmpdir, name, kind, linkname):
+    """Test members extracted or linked outside the directory are rejected."""
+    path = tmpdir.mkdir("extracted")
+    path.join("outside").mksymlinkto(tmpdir)
+    info = tarfile.TarInfo(name)
+    info.type, info.linkname = kind, linkname
+
+    with tarfile.open(tmpdir.join("archive.tar").strpath, "w") as tar:
+        tar.addfile(info, io.BytesIO(b""))
+
+    with tarfile.open(tmpdir.join("archive.tar").strpath) as tar:
+        with pytest.raises(exceptions.ValidationError):
+            archives.extract_member(tar, tar.getmembers()[0], path.strpath)
+
+    assert sorted(os.listdir(tmpdir.strpath)) == ["archive.tar", "extracted"]
+    assert os.listdir(path.strpath) == ["outside"]
+
+
+def test_extract_environment_member(tmpdir):
+    """Test interpreter links are linked to the local python, other links kept."""
+    members = [
+        ("env/bin", tarfile.DIRTYPE, ""),
+        ("env/bin/python", tarfile.SYMTYPE, "/old/bin/python3"),
+        ("env/bin/python3", tarfile.SYMTYPE, "python"),
+        ("env/bin/tool", tarfile.SYMTYPE, "/old/bin/tool"),
+    ]
+
+    with tarfile.open(tmpdir.join("archive.tar").strpath, "w") as tar:
+        for name, kind, linkname in members:
+            info = tarfile.TarInfo(name)
+            info.type, info.linkname = kind, linkname
+            tar.addfile(info)
+
+    path = tmpdir.mkdir("extracted").strpath
+
+    with tarfile.open(tmpdir.join("archive.tar").strpath) as tar:
+        for member in tar.getmembers()[:3]:
+            environments.extract_environment_member(tar, member, path, sys.executable)
+
+        with pytest.raises(exceptions.ValidationError):
+            environments.extract_environment_member(
+                tar, tar.getmembers()[3], path, sys.executable
+            )
+
+    assert os.readlink(os.path.join(path, "env", "bin", "python")) == sys.executable
+    assert os.readlink(os.path.join(path, "env", "bin", "python3")) == "python"
@@ -0,0 +1,158 @@
+"""register_apps cleanup tests."""
+
+from pathlib import Path
+import os
+import time
+
+from click.testing import CliRunner
+
+from register_apps import cleanup
+from register_apps import images
+from register_apps import index
+from register_apps import main
+from register_apps import utils
+from register_apps import wrappers
+
+
+def register(optdir, bindir, name, version, blob, days=0, **fields):
+    """Create a fake registration last used `days` ago."""
+    directory = Path(optdir) / name / version
+    directory.mkdir(parents=True)
+    utils.force_link(blob, directory / "image.sif")
+    wrapper = directory / name
+    wrapper.write_text("#!/bin/bash\n")
+    link = Path(bindir) / f"{name}_{version}"
+    utils.force_symlink(wrapper, link)
+    index.add_entry(
+        optdir, kind="singularity", name=name, version=version, target=name,
+        wrapper=str(wrapper), link=str(link), **fields
+    )  # fmt: skip
+
+    stamp = directory / wrappers.STAMP_FILENAME
+    stamp.touch()
+    used = time.time() - days * 86400
+
+    for i in list(directory.iterdir()):
+        os.utime(str(i), (used, used))
+
+    return directory
+
+
+def test_gc(tmpdir):
+    """Test gc removes unused versions, their links, entries and images."""
+    optdir = tmpdir.mkdir("opt").strpath
+    bindir = tmpdir.mkdir("bin").strpath
+    store = images.get_store(optdir)
+    (store / "sha256").mkdir(parents=True)
+    old, new = store / "sha256" / "old.sif", store / "sha256" / "new.sif"
+    old.write_bytes(b"0" * 1000)
+    new.write_bytes(b"1" * 10)
+
+    register(optdir, bindir, "app", "v1", old, days=30)
+    register(optdir, bindir, "app", "v2", old, days=20)
+    register(optdir, bindir, "app", "v3", new, days=1)
+    register(optdir, bindir, "other", "v1", new, days=30)
+
+    versions = cleanup.get_versions(optdir)
+    assert [(i["name"], i["version"]) for i in versions][-1] == ("app", "v3")
+    assert not cleanup.select_versions(versions, store, max_age=60)
+    assert not cleanup.select_versions(versions, store, max_age=10, keep=3)
+
+    # the shared image is only reclaimed when both versions are removed
+    selected = cleanup.select_versions(versions, store, max_age=25)
+    assert [i["version"] for i in selected] == ["v1"]
+    assert cleanup.get_reclaimed_bytes(selected, store) < 1000
+    selected = cleanup.select_versions(versions, store, max_age=10)
+    assert [i["version"] for i in selected] == ["v1", "v2"]
+    assert cleanup.get_reclaimed_bytes(selected, store) > 1000
+
+    # size based selection removes least recently used first
+    selected = cleanup.select_versions(versions, store, max_size=100)
+    assert [i["version"] for i in selected] == ["v1", "v2"]
+
+    runner = CliRunner()
+    args = ["gc", "--optdir", optdir, "--bindir", bindir, "--max_age", "10"]
+    result = runner.invoke(main.main, args + ["--dry_run"])
+    assert not result.exit_code, result.output
+    assert "Would free" in result.output
+    assert len(cleanup.get_versions(optdir)) == 4
+
+    result = runner.invoke(main.main, args)
+    assert not result.exit_code, result.output
+    assert "Freed" in result.output
+    assert not old.exists() and new.exists()
+    assert not (Path(optdir) / "app" / "v1").exists()
+    assert sorted(os.listdir(bindir)) == ["app_v3", "other_v1"]
+    assert [i["version"] for i in index.read_entries(optdir)] == ["v3", "v1"]
+
+    result = runner.invoke(main.main, ["gc", "--optdir", optdir, "--bindir", bindir])
+    assert result.exit_code
+
+
+def test_select_versions_stats_once(tmpdir, monkeypatch):
+    """Test size based selection stats the files of each version once."""
+    optdir = tmpdir.mkdir("opt").strpath
+    bindir = tmpdir.mkdir("bin").strpath
+    store = images.get_store(optdir)
+    (store / "sha256").mkdir(parents=True)
+
+    for i in range(5):
+        blob = store / "sha256" / f"{i}.sif"
+        blob.write_bytes(b"0" * 100)
+        register(optdir, bindir, "app", f"v{i}", blob, days=10 - i)
+
+    walked = []
+    get_files = cleanup.get_files
+
+    def counted(paths):
+        walked.extend(str(i) for i in paths)
+        return get_files(paths)
+
+    monkeypatch.setattr(cleanup, "get_files", counted)
+    versions = cleanup.get_versions(optdir)
+    selected = cleanup.select_versions(versions, store, max_size=150)
+    assert [i["version"] for i in selected] == ["v0", "v1", "v2", "v3"]
+    assert cleanup.get_reclaimed_bytes(selected, store) >= 400
+
+    versions_walked = [i for i in walked if "sha256" not in i]
+    assert sorted(versions_walked) == sorted(str(i["path"]) for i in versions)
+
+
+def test_remove_versions_keeps_shared(tmpdir):
+    """Test removals keep unrelated links and environments of other versions."""
+    optdir = tmpdir.mkdir("opt").strpath
+    bindir = tmpdir.mkdir("bin")
+    store = images.get_store(optdir)
+    (store / "sha256").mkdir(parents=True)
+    blob = store / "sha256" / "blob.sif"
+    blob.write_bytes(b"0" * 10)
+    shared, own = tmpdir.mkdir("shared"), tmpdir.mkdir("own")
+
+    register(optdir, bindir.strpath, "app", "v1", blob, days=30, venv=own.strpath)
+    register(optdir, bindir.strpath, "app", "v2", blob, days=30, venv=shared.strpath)
+    register(optdir, bindir.strpath, "app", "v3", blob, venv=shared.strpath)
+    bindir.join("dangling").mksymlinkto(tmpdir.join("missing"))
+
+    versions = cleanup.get_versions(optdir)
+    cleanup.remove_versions(optdir, bindir.strpath, versions[:2])
+    assert not own.exists() and shared.exists()
+    assert sorted(os.listdir(bindir.strpath)) == ["app_v3", "dangling"]
+    assert [i["version"] for i in cleanup.get_versions(optdir)] == ["v3"]
+
+
+def test_remove_versions_keeps_used(tmpdir):
+    """Test versions used after they were selected are not removed."""
+    optdir = tmpdir.mkdir("opt").strpath
+    bindir = tmpdir.mkdir("bin").strpath
+    store = images.get_store(optdir)
+    (store / "sha256").mkdir(parents=True)
+    blob = store / "sha256" / "blob.sif"
+    blob.write_bytes(b"0" * 10)
+    directory = register(optdir, bindir, "app", "v1", blob, days=30)
+
+    versions = cleanup.get_versions(optdir)
+    (directory / wrappers.STAMP_FILENAME).touch()
+    cleanup.remove_versions(optdir, bindir, versions)
+    assert directory.is_dir() and blob.exists()
+    assert os.listdir(bindir) == ["app_v1"]
+    assert len(index.read_entries(optdir)) == 1
@@ -1,11 +1,17 @@
 """register_apps cli tests."""
 # pylint: disable=E1135
+import os
 import subprocess
+import sys
+import time
 
 from click.testing import CliRunner
+import click
 import pytest
 
 from register_apps import cli
+from register_apps import environments
+from register_apps import index
 from tests import utils
 
 
@@ -171,3 +177,362 @@ def test_register_python_github(tmpdir):
         )
     assert not runner.invoke(cli.register_python, ["--help"]).exit_code
 
+
+@pytest.mark.parametrize("command", [cli.register_toil, cli.register_python])
+def test_instance_wrapper_is_singularity_only(command):
+    """Test the instance wrapper is rejected by toil and python registrations."""
+    result = CliRunner().invoke(command, ["--wrapper", "instance"])
+    assert result.exit_code == 2
+    assert "Invalid value for '--wrapper'" in result.output
+    assert "instance" in CliRunner().invoke(cli.register_singularity, ["--help"]).output
+
+
+def test_get_wheelhouse(tmpdir):
+    """Test the wheelhouse is created and required for offline installs."""
+    wheelhouse = cli._get_wheelhouse(tmpdir.join("wheels").strpath, offline=False)
+    assert wheelhouse.is_dir()
+    assert cli._get_wheelhouse(None, offline=False) is None
+
+    with pytest.raises(click.UsageError):
+        cli._get_wheelhouse(None, offline=True)
+
+
+def test_register_python_offline(tmpdir, monkeypatch):
+    """Test register_python installing from a local wheelhouse."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    runner = CliRunner()
+    optdir = tmpdir.mkdir("opt")
+    bindir = tmpdir.mkdir("bin")
+    wheelhouse = tmpdir.mkdir("wheelhouse")
+    utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    optexe = optdir.join("fake_tool", "v0.1.1", "fake_tool")
+    binexe = bindir.join("fake_tool_v0.1.1")
+    args = [
+        "--pypi_name",
+        "fake_tool",
+        "--pypi_version",
+        "v0.1.1",
+        "--optdir",
+        optdir.strpath,
+        "--bindir",
+        bindir.strpath,
+        "--python",
+        sys.executable,
+        "--wheelhouse",
+        wheelhouse.strpath,
+        "--offline",
+    ]
+
+    result = runner.invoke(cli.register_python, args)
+
+    assert not result.exit_code, result.output
+
+    for i in optexe.strpath, binexe.strpath:
+        assert b"0.1.1" in subprocess.check_output(
+            args=[i, "--version"], stderr=subprocess.STDOUT
+        )
+
+    entry = index.read_entries(optdir.strpath)[0]
+    assert entry["kind"] == "python"
+    assert entry["wrapper"] == optexe.strpath
+    assert entry["venv"] == tmpdir.join("envs", "production__fake_tool__v0.1.1")
+
+    # registering again with the same inputs is a no-op
+    result = runner.invoke(cli.register_python, args)
+    assert not result.exit_code, result.output
+    assert "Already registered" in result.output
+    assert "Installing package" not in result.output
+    assert len(open(index.get_index(optdir.strpath)).readlines()) == 1
+
+    # only the wrapper is written again when the template changes
+    result = runner.invoke(cli.register_python, args + ["--wrapper", "exec"])
+    assert not result.exit_code, result.output
+    assert "Installing package" not in result.output
+    assert optexe.read().startswith("#!/bin/bash\nexec ")
+    assert index.read_entries(optdir.strpath)[0]["startup"] is None
+
+    # the environment is shared with other optdirs, it works while rebuilt
+    install_package, working = environments.install_package, []
+
+    def install(env_dir, commands):
+        working.append(subprocess.call([binexe.strpath, "--version"]) == 0)
+        install_package(env_dir, commands)
+
+    monkeypatch.setattr(environments, "install_package", install)
+
+    # optimizing reinstalls the environment and records its startup time
+    result = runner.invoke(cli.register_python, args + ["--optimize", "zip"])
+    assert not result.exit_code, result.output
+    assert "Installing package" in result.output
+    assert "Startup time:" in result.output
+    assert index.read_entries(optdir.strpath)[0]["startup"]["cold"] > 0
+    assert b"0.1.1" in subprocess.check_output([binexe.strpath, "--version"])
+    assert working == [True]
+    assert os.listdir(tmpdir.join("envs").strpath) == ["production__fake_tool__v0.1.1"]
+
+
+def test_register_python_artifacts(tmpdir, monkeypatch):
+    """Test register_python unpacking prebuilt environments in other sites."""
+    runner = CliRunner()
+    wheelhouse = tmpdir.mkdir("wheelhouse")
+    utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    args = [
+        "--pypi_name",
+        "fake_tool",
+        "--pypi_version",
+        "v0.1.1",
+        "--python",
+        sys.executable,
+        "--wheelhouse",
+        wheelhouse.strpath,
+        "--offline",
+        "--artifacts",
+        tmpdir.join("artifacts").strpath,
+    ]
+
+    for site in "a", "b":
+        monkeypatch.setenv("WORKON_HOME", tmpdir.join(site, "envs").strpath)
+        result = runner.invoke(
+            cli.register_python,
+            args
+            + ["--optdir", tmpdir.join(site, "opt").strpath]
+            + ["--bindir", tmpdir.join(site, "bin").strpath],
+        )
+
+        assert not result.exit_code, result.output
+        binexe = tmpdir.join(site, "bin", "fake_tool_v0.1.1")
+        assert b"0.1.1" in subprocess.check_output([binexe.strpath, "--version"])
+
+    assert "Installing package" not in result.output
+    assert "Unpacking prebuilt" in result.output
+
+
+def test_register_toil_offline(tmpdir, monkeypatch):
+    """Test register_toil installs and pulls concurrently, cleaning on errors."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    runner = CliRunner()
+    singularity, _ = utils.make_fake_singularity(tmpdir)
+    optdir = tmpdir.mkdir("opt")
+    wheelhouse = tmpdir.mkdir("wheelhouse")
+    env_dir = tmpdir.join("envs", "production__fake_tool__v0.1.1")
+    optexe = optdir.join("fake_tool", "v0.1.1", "fake_tool")
+    args = [
+        "--pypi_name",
+        "fake_tool",
+        "--pypi_version",
+        "v0.1.1",
+        "--optdir",
+        optdir.strpath,
+        "--bindir",
+        tmpdir.join("bin").strpath,
+        "--python",
+        sys.executable,
+        "--volumes",
+        "/tmp",
+        "/carlos",
+        "--wheelhouse",
+        wheelhouse.strpath,
+        "--offline",
+    ]
+
+    # the pull fails, the environment is removed
+    wheel = utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    result = runner.invoke(cli.register_toil, args + ["--singularity", "/bin/false"])
+    assert result.exit_code
+    assert not env_dir.exists()
+
+    # the wheel is missing, the image link is removed but kept in the store
+    os.unlink(wheel)
+    result = runner.invoke(cli.register_toil, args + ["--singularity", singularity])
+    assert result.exit_code
+    assert not env_dir.exists()
+    assert not optdir.join("fake_tool", "v0.1.1").listdir()
+    assert optdir.join(".images", "sha256").listdir()
+
+    utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    result = runner.invoke(cli.register_toil, args + ["--singularity", singularity])
+    assert not result.exit_code, result.output
+    assert "--singularity " + optdir.strpath in optexe.read()
+    assert env_dir.exists()
+    assert b"0.1.1" in subprocess.check_output([optexe.strpath, "--version"])
+
+    # offline registrations don't look up registry digests
+    records = optdir.join(".images", "urls").listdir("*.json")
+    assert all("registry_digest" not in i.read() for i in records)
+
+
+def test_install_package_and_get_image_cancels(tmpdir, monkeypatch):
+    """Test a failed install kills the pull instead of waiting for it."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    singularity, _ = utils.make_fake_singularity(tmpdir, content="`sleep 30`")
+    optdir = tmpdir.mkdir("opt")
+    start = time.time()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        cli._install_package_and_get_image(  # pylint: disable=protected-access
+            install_kwargs=dict(
+                env_backend="venv",
+                python=sys.executable,
+                pypi_name="fake_tool",
+                pypi_version="v0.1.1",
+                github_user=None,
+                wheelhouse=tmpdir.mkdir("wheelhouse").strpath,
+                offline=True,
+            ),
+            image_args=(
+                optdir.strpath,
+                optdir.join(".images").strpath,
+                singularity,
+                "docker://fake/tool:v1",
+            ),
+        )
+
+    assert time.time() - start < 25
+    assert not tmpdir.join("envs", "production__fake_tool__v0.1.1").exists()
+    assert not optdir.join(".images", "tmp").listdir()
+
+
+def test_register_singularity_staging(tmpdir, monkeypatch):
+    """Test register_singularity with a fake singularity and image staging."""
+    monkeypatch.setenv("USER", "me")
+    singularity, _ = utils.make_fake_singularity(tmpdir)
+    optdir = tmpdir.mkdir("opt")
+    bindir = tmpdir.mkdir("bin")
+    result = CliRunner().invoke(
+        cli.register_singularity,
+        [
+            "--image_repository",
+            "docker-pcapcore",
+            "--image_version",
+            "v0.1.1",
+            "--volumes",
+            "/tmp",
+            "/carlos",
+            "--optdir",
+            optdir.strpath,
+            "--bindir",
+            bindir.strpath,
+            "--singularity",
+            singularity,
+            "--command",
+            "echo",
+            "--target",
+            "echo_target",
+            "--wrapper",
+            "exec",
+            "--stage_dir",
+            tmpdir.join("scratch").strpath,
+        ],
+    )
+
+    assert not result.exit_code, result.output
+    assert subprocess.check_output([bindir.join("echo_target").strpath, "hi"]) == (
+        b"hi\n"
+    )
+
+    assert tmpdir.join("scratch", ".register_apps_me").listdir("*.img.ok")
+
+
+def test_register_singularity_targets(tmpdir):
+    """Test register_singularity with many targets from the same image."""
+    runner = CliRunner()
+    singularity, calls = utils.make_fake_singularity(tmpdir)
+    optdir = tmpdir.mkdir("opt")
+    bindir = tmpdir.join("bin")
+    tools = tmpdir.mkdir("tools")
+
+    for i in "bwa", "samtools", "README":
+        tools.join(i).write("#!/bin/bash\necho " + i + ' "$@"\n')
+
+    tools.join("bwa").chmod(0o755)
+    tools.join("samtools").chmod(0o755)
+    args = [
+        "--image_repository",
+        "bundle",
+        "--image_version",
+        "v1",
+        "--optdir",
+        optdir.strpath,
+        "--bindir",
+        bindir.strpath,
+        "--singularity",
+        singularity,
+        "--volumes",
+        "/tmp",
+        "/tmp",
+        "--targets_glob",
+        tools.join("*").strpath,
+        "--targets",
+        "samtools=echo override",
+        "--target",
+        "hello",
+        "--command",
+        "echo hello",
+    ]
+
+    result = runner.invoke(cli.register_singularity, args)
+    assert not result.exit_code, result.output
+    assert len(calls.readlines()) == 1
+    assert sorted(i.basename for i in bindir.listdir()) == ["bwa", "hello", "samtools"]
+    assert subprocess.check_output([bindir.join("bwa").strpath, "x"]) == b"bwa x\n"
+    assert subprocess.check_output([bindir.join("samtools").strpath]) == b"override\n"
+
+    entries = index.read_entries(optdir.strpath)
+    assert sorted(i["target"] for i in entries) == ["bwa", "hello", "samtools"]
+
+    # registering again is a no-op for all targets
+    result = runner.invoke(cli.register_singularity, args)
+    assert not result.exit_code, result.output
+    assert "Already registered" in result.output
+    assert "Creating and linking" not in result.output
+    assert len(calls.readlines()) == 1
+
+    # targets must be given with their commands
+    result = runner.invoke(cli.register_singularity, args[:13] + ["--target", "x"])
+    assert "--target and --command must be used together" in result.output
+    result = runner.invoke(cli.register_singularity, args[:13] + ["--targets", "x"])
+    assert "use TARGET=COMMAND" in result.output
+
+
+def test_register_singularity_fingerprints(tmpdir):
+    """Test register_singularity only regenerates what changed."""
+    runner = CliRunner()
+    singularity, calls = utils.make_fake_singularity(tmpdir)
+    optdir = tmpdir.mkdir("opt")
+    optexe = optdir.join("docker-pcapcore", "v0.1.1", "echo_target")
+    args = [
+        "--image_repository",
+        "docker-pcapcore",
+        "--image_version",
+        "v0.1.1",
+        "--optdir",
+        optdir.strpath,
+        "--bindir",
+        tmpdir.join("bin").strpath,
+        "--singularity",
+        singularity,
+        "--command",
+        "echo",
+        "--target",
+        "echo_target",
+    ]
+
+    result = runner.invoke(cli.register_singularity, args + ["--volumes", "/tmp", "/b"])
+    assert not result.exit_code, result.output
+    result = runner.invoke(cli.register_singularity, args + ["--volumes", "/tmp", "/b"])
+    assert "Already registered" in result.output
+
+    # a new wrapper is written without pulling the image again
+    result = runner.invoke(cli.register_singularity, args + ["--volumes", "/tmp", "/c"])
+    assert not result.exit_code, result.output
+    assert "--bind /tmp:/c" in optexe.read()
+    assert len(calls.readlines()) == 1
+    assert len(index.read_entries(optdir.strpath)) == 1
+
+    # the image is replaced when the url changes
+    args += ["--image_url", "docker://other/docker-pcapcore:v0.1.1"]
+    result = runner.invoke(cli.register_singularity, args + ["--volumes", "/tmp", "/c"])
+    assert not result.exit_code, result.output
+    assert "Image url changed" in result.output
+    assert len(calls.readlines()) == 2
+    assert index.read_entries(optdir.strpath)[0]["image_url"].startswith("docker://o")
@@ -0,0 +1,90 @@
+"""register_apps dedup tests."""
+
+from pathlib import Path
+import os
+
+from click.testing import CliRunner
+
+from register_apps import dedup
+from register_apps import environments
+from register_apps import main
+
+
+def make_venv(optdir, name, version, files):
+    """Create a registered version with a fake environment containing `files`."""
+    (Path(optdir) / name / version).mkdir(parents=True)
+    venv = environments.get_workon_home() / environments.get_env_name(name, version)
+    site_packages = venv / "lib" / "python3.6" / "site-packages"
+    site_packages.mkdir(parents=True)
+    (venv / "bin").mkdir()
+    (venv / "bin" / "tool").write_text(f"#!{venv}/bin/python\n")
+
+    for i, content in files.items():
+        (site_packages / i).parent.mkdir(parents=True, exist_ok=True)
+        (site_packages / i).write_text(content)
+
+    return site_packages
+
+
+def test_dedup(tmpdir, monkeypatch):
+    """Test dedup hardlinks identical files across environments."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    optdir = tmpdir.join("opt").strpath
+    common = {"numpy/core.py": "x" * 1000, "toil/__init__.py": "y" * 10}
+    v1 = make_venv(optdir, "app", "v1", dict(common, unique="1"))
+    v2 = make_venv(optdir, "app", "v2", dict(common, unique="2"))
+    v3 = make_venv(optdir, "other", "v1", common)
+    os.chmod(str(v3 / "toil" / "__init__.py"), 0o600)  # can't share permissions
+    runner = CliRunner()
+
+    result = runner.invoke(main.main, ["dedup", "--optdir", optdir, "--dry_run"])
+    assert not result.exit_code, result.output
+    assert "Would link 3 files, would free 2.0 KB" in result.output
+    assert not (v1 / "numpy" / "core.py").samefile(v2 / "numpy" / "core.py")
+    assert not dedup.get_index_path(optdir).exists()
+
+    result = runner.invoke(main.main, ["dedup", "--optdir", optdir])
+    assert not result.exit_code, result.output
+    assert "Scanned 8 files, hashed 8" in result.output
+    assert "Linked 3 files" in result.output
+
+    for i in (v2, v3):
+        assert (v1 / "numpy" / "core.py").samefile(i / "numpy" / "core.py")
+
+    assert (v1 / "toil" / "__init__.py").samefile(v2 / "toil" / "__init__.py")
+    assert not (v1 / "toil" / "__init__.py").samefile(v3 / "toil" / "__init__.py")
+    assert not (v1 / "unique").samefile(v2 / "unique")
+    assert (v1 / "unique").read_text() == "1"
+
+    # only new files are hashed in later runs
+    v4 = make_venv(optdir, "app", "v3", dict(common, unique="3"))
+    result = runner.invoke(main.main, ["dedup", "--optdir", optdir])
+    assert "Scanned 11 files, hashed 3" in result.output
+    assert "Linked 2 files" in result.output
+    assert (v1 / "numpy" / "core.py").samefile(v4 / "numpy" / "core.py")
+
+
+def test_dedup_new_environment(tmpdir, monkeypatch):
+    """Test a new environment is deduplicated against the index."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    optdir = tmpdir.join("opt").strpath
+    v1 = make_venv(optdir, "app", "v1", {"a.py": "a" * 100, "b.py": "b"})
+    dedup.deduplicate(optdir)
+
+    # files removed after being recorded are skipped
+    v2 = make_venv(optdir, "app", "v2", {"a.py": "a" * 100, "b.py": "b"})
+    (v1 / "b.py").unlink()
+    result = dedup.deduplicate(optdir, venvs=[v2.parent.parent.parent])
+
+    assert (result["scanned"], result["hashed"], result["linked"]) == (2, 2, 1)
+    assert (v1 / "a.py").samefile(v2 / "a.py")
+    assert set(dedup.read_index(optdir)) == {
+        str(v1 / "a.py"),
+        str(v1 / "b.py"),
+        str(v2 / "a.py"),
+        str(v2 / "b.py"),
+    }
+
+    # full runs forget removed files
+    dedup.deduplicate(optdir)
+    assert str(v1 / "b.py") not in dedup.read_index(optdir)
@@ -0,0 +1,147 @@
+"""register_apps environments tests."""
+
+import subprocess
+import sys
+
+import pytest
+
+from register_apps import environments
+from register_apps import exceptions
+from tests import utils
+
+
+def test_get_pip_commands():
+    """Test pip commands for online, cached and offline installs."""
+    online = environments.get_pip_commands("toil_snapigv", "v0.1.1")
+    assert online == [["install", "toil_snapigv==v0.1.1"]]
+
+    cached = environments.get_pip_commands(
+        "toil_snapigv", "v0.1.1", "papaemmelab", "/w"
+    )
+
+    assert cached[0][:5] == ["wheel", "--wheel-dir", "/w", "--find-links", "/w"]
+    assert cached[0][-1].startswith("git+https://github.com/papaemmelab/")
+    assert cached[1] == [
+        "install",
+        "--no-index",
+        "--find-links",
+        "/w",
+        "toil_snapigv==v0.1.1",
+    ]
+
+    offline = environments.get_pip_commands(
+        "toil_snapigv", "v0.1.1", "papaemmelab", "/w", offline=True
+    )
+
+    assert offline == cached[1:]
+
+
+def test_create_environment_virtualenv_fallback(tmpdir, monkeypatch):
+    """Test interpreters without venv use the virtualenv of register_apps."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.strpath)
+    commands = []
+
+    def run(command, **kwargs):  # pylint: disable=unused-argument
+        commands.append(command)
+
+        if command[1:3] == ["-m", "venv"]:
+            raise subprocess.CalledProcessError(1, command)
+
+    monkeypatch.setattr(environments.processes, "run", run)
+    environments.create_environment("venv", "/usr/bin/python2", "env")
+    assert commands[-1] == [
+        sys.executable,
+        "-m",
+        "virtualenv",
+        "-p",
+        "/usr/bin/python2",
+        tmpdir.join("env").strpath,
+    ]
+
+
+def test_create_environment_and_install_offline(tmpdir, monkeypatch):
+    """Test environments are installed offline, archived and relocated."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    wheelhouse = tmpdir.mkdir("wheelhouse")
+    utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    env = environments.get_env_name("fake_tool", "v0.1.1")
+    env_dir = environments.create_environment("venv", sys.executable, env)
+
+    assert env_dir == tmpdir.join("envs", "production__fake_tool__v0.1.1")
+
+    with pytest.raises(exceptions.MissingOutputError):
+        environments.get_entry_point(env_dir, "fake_tool")
+
+    environments.install_package(
+        env_dir,
+        environments.get_pip_commands(
+            "fake_tool", "v0.1.1", wheelhouse=wheelhouse, offline=True
+        ),
+    )
+
+    toolpath = environments.get_entry_point(env_dir, "fake_tool")
+    assert b"fake_tool 0.1.1" in subprocess.check_output([toolpath, "--version"])
+
+    # archive a relocatable environment and unpack it somewhere else
+    name = environments.get_artifact_name(env, sys.executable)
+    assert name.startswith(f"{env}__py{sys.version_info[0]}.")
+    assert not environments.get_artifact(tmpdir.join("artifacts"), name)
+    artifact = environments.archive_environment(env_dir, tmpdir.join("artifacts"), name)
+    assert environments.get_artifact(tmpdir.join("artifacts"), name) == artifact
+
+    new_env_dir = tmpdir.join("other", env)
+    environments.unpack_environment(artifact, new_env_dir, sys.executable)
+    toolpath = environments.get_entry_point(new_env_dir, "fake_tool")
+    assert open(toolpath).readline() == f"#!{new_env_dir}/bin/python\n"
+    assert b"fake_tool 0.1.1" in subprocess.check_output([toolpath, "--version"])
+    assert new_env_dir.join("lib").visit("*.pyc")
+    environments.verify_entry_point(toolpath)
+
+    with pytest.raises(exceptions.ValidationError):
+        environments.verify_entry_point(tmpdir.join("missing").strpath)
+
+
+def test_get_artifact_name_ignores_warnings(tmpdir):
+    """Test interpreter warnings printed to stderr don't change artifact names."""
+    python = tmpdir.join("python")
+    python.write(
+        f"#!/bin/bash\necho 'WARNING: 1.2' >&2\nexec {sys.executable} \"$@\"\n"
+    )
+    python.chmod(0o755)
+    name = environments.get_artifact_name("env", python.strpath)
+    assert name.startswith(f"env__py{sys.version_info[0]}.{sys.version_info[1]}__")
+
+
+def test_optimize_environment(tmpdir, monkeypatch):
+    """Test pure python modules are packed in a zip to start faster."""
+    monkeypatch.setenv("WORKON_HOME", tmpdir.join("envs").strpath)
+    wheelhouse = tmpdir.mkdir("wheelhouse")
+    utils.make_wheel(wheelhouse, "fake_tool", "v0.1.1")
+    env_dir = environments.create_environment("venv", sys.executable, "optimized")
+    environments.install_package(
+        env_dir,
+        environments.get_pip_commands(
+            "fake_tool", "v0.1.1", wheelhouse=wheelhouse, offline=True
+        ),
+    )
+
+    toolpath = environments.get_entry_point(env_dir, "fake_tool")
+    site_packages = environments.get_site_packages(env_dir)
+    assert "fake_tool.py" in environments.get_zippable(site_packages)
+    assert "pip" not in environments.get_zippable(site_packages)
+
+    # modules that can't be packed are kept in site-packages
+    with monkeypatch.context() as context:
+        context.setattr(environments, "ZIP_SCRIPT", "import sys; sys.exit(1)")
+        assert not environments.pack_environment(env_dir, toolpath)
+
+    assert (site_packages / "fake_tool.py").is_file()
+    assert not list(env_dir.glob(".unpacked*"))
+
+    result = environments.optimize_environment(env_dir, toolpath, "zip")
+    assert result["packed"] == ["fake_tool.py"]
+    assert result["after"]["cold"] > 0 and result["after"]["warm"] > 0
+    assert environments.read_startup(env_dir) == result
+    assert not (site_packages / "fake_tool.py").exists()
+    assert (site_packages / environments.ZIP_FILENAME).is_file()
+    assert b"fake_tool 0.1.1" in subprocess.check_output([toolpath, "--version"])
@@ -0,0 +1,26 @@
+"""register_apps fingerprints tests."""
+
+from register_apps import fingerprints
+
+
+def test_fingerprints(tmpdir):
+    """Test fingerprints are stable and track changed components."""
+    fingerprint = fingerprints.get_fingerprint(a=1, b=[1, 2])
+    assert fingerprint == fingerprints.get_fingerprint(b=[1, 2], a=1)
+    assert fingerprint != fingerprints.get_fingerprint(a=1, b=[2, 1])
+    assert not fingerprints.read_fingerprints(tmpdir.strpath)
+    assert not fingerprints.has_changed(tmpdir.strpath, "image", fingerprint)
+    assert not fingerprints.is_current(tmpdir.strpath, "image", fingerprint)
+
+    fingerprints.write_fingerprints(tmpdir.strpath, image=fingerprint)
+    fingerprints.write_fingerprints(tmpdir.strpath, environment="other")
+    assert fingerprints.is_current(tmpdir.strpath, "image", fingerprint)
+    assert fingerprints.has_changed(tmpdir.strpath, "environment", fingerprint)
+    assert not fingerprints.is_current(
+        tmpdir.strpath, "image", fingerprint, outputs=[tmpdir.join("missing")]
+    )
+
+    assert set(fingerprints.read_fingerprints(tmpdir.strpath)) == {
+        "image",
+        "environment",
+    }
@@ -0,0 +1,161 @@
+"""register_apps images tests."""
+
+import os
+import struct
+import threading
+
+import pytest
+
+from register_apps import cli
+from register_apps import exceptions
+from register_apps import images
+from tests import utils
+
+
+def test_get_or_create_image_uses_store(tmpdir):
+    """Test pulled images are stored once and linked in optdirs."""
+    singularity, calls = utils.make_fake_singularity(tmpdir)
+    optdir = tmpdir.mkdir("opt")
+    store = images.get_store(optdir.strpath)
+    image_url = "docker://leukgen/docker-pcapcore:v0.1.1"
+    first = optdir.mkdir("bwa").mkdir("v1")
+    second = optdir.mkdir("samtools").mkdir("v1")
+
+    first_image = cli._get_or_create_image(first, store, singularity, image_url)
+    second_image = cli._get_or_create_image(second, store, singularity, image_url)
+
+    assert len(calls.readlines()) == 1
+    assert os.path.basename(first_image) == "docker-pcapcore_v0.1.1.sif"
+    assert os.path.samefile(first_image, second_image)
+    assert os.stat(first_image).st_nlink == 3
+    assert oct(os.stat(first_image).st_mode)[-3:] == "755"
+
+    record = images.get_url_record(store, image_url)
+    assert record["digest"] == "sha256:" + images.get_file_digest(first_image)
+    assert not os.listdir(str(store / "tmp"))
+
+    # existing images are reused without checking the store
+    assert cli._get_or_create_image(first, store, singularity, "bad") == first_image
+
+
+def test_get_or_create_image_dedups_digests(tmpdir):
+    """Test urls with the same image share a stored blob."""
+    singularity, calls = utils.make_fake_singularity(tmpdir, content="same")
+    store = images.get_store(tmpdir.strpath)
+    latest = images.get_or_create_image(
+        tmpdir.mkdir("latest"), store, singularity, "docker://user/image:latest"
+    )
+    tagged = images.get_or_create_image(
+        tmpdir.mkdir("tagged"), store, singularity, "docker://user/image:v1"
+    )
+
+    assert len(calls.readlines()) == 2
+    assert latest.name != tagged.name
+    assert "registry_digest" not in images.get_url_record(
+        store, "docker://user/image:latest"
+    )
+    assert os.path.samefile(str(latest), str(tagged))
+    assert len(os.listdir(str(store / "sha256"))) == 1
+
+
+def test_get_or_create_image_concurrently(tmpdir):
+    """Test concurrent registrations of an image pull it once."""
+    singularity, calls = utils.make_fake_singularity(tmpdir, content="`sleep 0.2`")
+    store = images.get_store(tmpdir.strpath)
+    image_url = "docker://user/image:v1"
+    optdirs = [tmpdir.mkdir(str(i)) for i in range(3)]
+    threads = [
+        threading.Thread(
+            target=images.get_or_create_image,
+            args=(i, store, singularity, image_url),
+        )
+        for i in optdirs
+    ]
+
+    for i in threads:
+        i.start()
+
+    for i in threads:
+        i.join()
+
+    assert len(calls.readlines()) == 1
+    assert all(images.get_images(i) for i in optdirs)
+
+
+def make_sif(path, data_size):
+    """Write a SIF image with a header that declares `data_size` bytes of data."""
+    header = b"#!/usr/bin/env run-singularity\n".ljust(32, b"\0") + b"SIF_MAGIC\0"
+    header = header.ljust(images.SIF_DATA_OFFSET, b"\0")
+    header += struct.pack("<qq", 128, data_size)
+    path.write_binary(header + b"x" * data_size)
+    return path
+
+
+def test_verify_image(tmpdir):
+    """Test images are verified against the size in their header."""
+    sif = make_sif(tmpdir.join("image.sif"), 100)
+    assert images.get_declared_size(sif.strpath) == 228
+    images.verify_image(sif.strpath, size=228, digest=images.get_file_digest(sif))
+
+    with pytest.raises(exceptions.ValidationError, match="size mismatch"):
+        images.verify_image(sif.strpath, size=1)
+
+    with pytest.raises(exceptions.ValidationError, match="digest mismatch"):
+        images.verify_image(sif.strpath, digest="0" * 64)
+
+    sif.write_binary(sif.read_binary()[:200])
+
+    with pytest.raises(exceptions.ValidationError, match="228"):
+        images.verify_image(sif.strpath)
+
+    simg = tmpdir.join("image.simg")
+    header = b"#!/usr/bin/env run-singularity\nhsqs".ljust(71, b"\0")
+    simg.write_binary(header + struct.pack("<q", 100) + b"x" * 100)
+    assert images.get_declared_size(simg.strpath) == 131
+    images.verify_image(simg.strpath)
+
+    # images of unknown formats are only checked to be non empty
+    tmpdir.join("other.simg").write("content")
+    images.verify_image(tmpdir.join("other.simg").strpath)
+    tmpdir.join("empty.simg").write("")
+
+    with pytest.raises(exceptions.ValidationError, match="Empty"):
+        images.verify_image(tmpdir.join("empty.simg").strpath)
+
+
+def test_partial_images_are_replaced(tmpdir):
+    """Test partial images and stale pulls are replaced or removed."""
+    singularity, calls = utils.make_fake_singularity(
+        tmpdir, content="$SINGULARITY_CACHEDIR"
+    )
+    store = images.get_store(tmpdir.strpath)
+    image_url = "docker://user/image:v1"
+    optdir = tmpdir.mkdir("opt")
+    stale = store / "tmp" / "tmpstale"
+    stale_layers = store / "cache" / "stale"
+
+    for i in stale, stale_layers:
+        i.mkdir(parents=True)
+        os.utime(str(i), (0, 0))
+
+    # an interrupted pull left a partial image in the optdir
+    partial = make_sif(optdir.join("image_v1.sif"), 100)
+    partial.write_binary(partial.read_binary()[:150])
+    image = images.get_or_create_image(optdir, store, singularity, image_url)
+    assert len(calls.readlines()) == 1
+    assert image.read_text().strip() == str(images.get_cache_dir(store, image_url))
+    assert not stale.exists() and not stale_layers.exists()
+
+    # the layers are removed after a successful pull
+    assert not os.listdir(str(store / "cache"))
+
+    # truncated store blobs are pulled again
+    record = images.get_url_record(store, image_url)
+    image.unlink()
+
+    with open(record["path"], "a") as f:
+        f.truncate(1)
+
+    assert images.get_url_record(store, image_url) is None
+    images.get_or_create_image(optdir, store, singularity, image_url)
+    assert len(calls.readlines()) == 2
@@ -0,0 +1,61 @@
+"""register_apps index tests."""
+
+import json
+
+from click.testing import CliRunner
+
+from register_apps import index
+from register_apps import main
+
+
+def test_index(tmpdir):
+    """Test index entries are updated, queried and removed."""
+    optdir = tmpdir.strpath
+    assert not index.read_entries(optdir)
+
+    index.add_entry(optdir, kind="python", name="a", version="v1", target="a")
+    index.add_entry(optdir, kind="python", name="a", version="v2", target="a")
+    index.add_entry(optdir, kind="toil", name="b", version="v1", target="b")
+    index.add_entry(
+        optdir, kind="python", name="a", version="v1", target="a", venv="/new"
+    )
+
+    entries = index.read_entries(optdir)
+    assert [(i["name"], i["version"]) for i in entries] == [
+        ("a", "v1"),
+        ("a", "v2"),
+        ("b", "v1"),
+    ]
+
+    assert entries[0]["venv"] == "/new"
+    assert len(index.query(entries, name="a", version="v*")) == 2
+    assert len(index.query(entries, kind="toil", name=None)) == 1
+
+    index.remove_entries(optdir, entries[:1])
+    assert len(index.read_entries(optdir)) == 2
+
+
+def test_list_and_query(tmpdir):
+    """Test list and query commands print the index."""
+    runner = CliRunner()
+    optdir = tmpdir.strpath
+    index.add_entry(optdir, kind="singularity", name="pcap", version="v1", target="bwa")
+    index.add_entry(optdir, kind="toil", name="toil_a", version="v1", target="toil_a")
+
+    result = runner.invoke(main.main, ["list", "--optdir", optdir])
+    assert not result.exit_code, result.output
+    assert result.output.split("\n")[0].split() == [
+        "kind",
+        "name",
+        "version",
+        "target",
+        "registered",
+    ]
+
+    assert len(result.output.strip().split("\n")) == 3
+    result = runner.invoke(
+        main.main, ["query", "--optdir", optdir, "--name", "toil_*", "--json"]
+    )
+
+    entries = json.loads(result.output)
+    assert [i["name"] for i in entries] == ["toil_a"]
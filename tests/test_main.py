@@ -0,0 +1,114 @@
+"""register_apps main tests."""
+
+import json
+import subprocess
+import sys
+
+from click.testing import CliRunner
+
+from register_apps import main
+
+# modules that `register_apps --help` must not import
+HEAVY_MODULES = [
+    "register_apps.cli",
+    "register_apps.bundles",
+    "concurrent.futures",
+    "subprocess",
+    "tarfile",
+]
+
+# maximum milliseconds spent importing register_apps.main besides click
+MAX_IMPORT_MS = 50
+
+
+def get_import_times(code):
+    """Get the cumulative import microseconds of each module imported by `code`."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+
+    times = {}
+
+    for line in output.stderr.decode().splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line.split("|")
+
+            if cumulative.strip().isdigit():
+                times[module.strip()] = int(cumulative)
+
+    return times, output.stdout.decode()
+
+
+def test_lazy_subcommands():
+    """Test subcommands are listed without being imported."""
+    runner = CliRunner()
+    result = runner.invoke(main.main, ["--help"])
+    assert not result.exit_code, result.output
+
+    for i in main.COMMANDS:
+        assert f"  {i} " in result.output
+
+    result = runner.invoke(main.main, ["toil", "--help"])
+    assert not result.exit_code, result.output
+    assert "--pypi_name" in result.output
+    assert "toil" in main.main.commands
+
+
+def test_startup_time():
+    """Test importing register_apps.main stays fast."""
+    code = (
+        "import sys, json\n"
+        "from register_apps.main import main\n"
+        "main(['--help'], standalone_mode=False)\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+
+    times, output = get_import_times(code)
+    modules = json.loads(output.splitlines()[-1])
+    assert not set(HEAVY_MODULES) & set(modules)
+
+    # click is imported by register_apps.main, discount it
+    own_ms = (times["register_apps.main"] - times.get("click", 0)) / 1000
+    assert own_ms < MAX_IMPORT_MS, f"register_apps.main import took {own_ms} ms"
+
+
+def test_index_commands_are_lightweight(tmpdir):
+    """Test list and query don't import the registration implementations."""
+    code = (
+        "import sys, json\n"
+        "from register_apps.main import main\n"
+        "for i in 'list', 'query':\n"
+        f"    main([i, '--optdir', {tmpdir.strpath!r}], standalone_mode=False)\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+
+    _, output = get_import_times(code)
+    modules = json.loads(output.splitlines()[-1])
+    assert "kind" in output
+    assert not {"register_apps.cli", "tarfile", "urllib.request"} & set(modules)
+
+
+def test_registrations_are_lightweight():
+    """Test registration commands don't import the maintenance implementations."""
+    code = (
+        "import sys, json\n"
+        "import register_apps.cli\n"
+        "print(json.dumps(sorted(sys.modules)))\n"
+    )
+
+    _, output = get_import_times(code)
+    modules = set(json.loads(output.splitlines()[-1]))
+    assert (
+        not {
+            "register_apps.bundles",
+            "register_apps.cleanup",
+            "register_apps.dedup",
+            "register_apps.sync",
+            "concurrent.futures",
+            "urllib.request",
+        }
+        & modules
+    )
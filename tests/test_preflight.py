@@ -0,0 +1,73 @@
+"""register_apps preflight tests."""
+
+import threading
+import time
+
+import click
+import pytest
+
+from register_apps import exceptions
+from register_apps import preflight
+
+
+def test_scan_pattern(tmpdir):
+    """Test scan_pattern lists the paths matched by a pattern."""
+    tmpdir.mkdir("a").join("file.txt").write("hello")
+    tmpdir.mkdir("b").join("empty.txt").write("")
+    tmpdir.join("b", ".hidden.txt").write("")
+    matches = preflight.scan_pattern(tmpdir.join("*", "*.txt").strpath, True)
+    assert [(i["is_file"], i["is_dir"], i["size"]) for i in matches] == [
+        (True, False, 5),
+        (True, False, 0),
+    ]
+
+    assert preflight.scan_pattern(tmpdir.join("a").strpath)[0]["is_dir"]
+    assert not preflight.scan_pattern(tmpdir.join("missing*").strpath)
+    assert not preflight.scan_pattern(tmpdir.join("missing").strpath)
+
+
+def test_check_patterns(tmpdir, monkeypatch):
+    """Test hung, slow, valid and invalid volumes are reported."""
+    preflight.clear_cache()
+    released = threading.Event()
+    check_pattern = preflight.check_pattern
+
+    def fake_check_pattern(pattern, kind, check_size):
+        if pattern.endswith("hung"):
+            released.wait()
+        elif pattern.endswith("slow"):
+            time.sleep(0.2)
+        return check_pattern(pattern, kind, check_size)
+
+    for i in "hung", "slow", "ok":
+        tmpdir.mkdir(i)
+
+    monkeypatch.setattr(preflight, "check_pattern", fake_check_pattern)
+    patterns = [tmpdir.join(i).strpath for i in ["hung", "slow", "ok", "missing"]]
+    start = time.time()
+    results = preflight.check_patterns(patterns, timeout=0.5, slow=0.1)
+    assert time.time() - start < 1
+    assert [i["status"] for i in results] == ["hung", "slow", "ok", "invalid"]
+    assert results[2]["paths"] == [tmpdir.join("ok").strpath]
+
+    # results are cached for the rest of the run, including hung checks
+    start = time.time()
+    assert preflight.check_patterns(patterns[:1], timeout=0.5)[0]["status"] == "hung"
+    assert time.time() - start < 0.1
+
+    with pytest.raises(exceptions.ValidationError) as error:
+        preflight.raise_for_results(results)
+
+    assert "missing pattern matched no dirs" in str(error.value)
+    assert "Hung filesystems: " + patterns[0] in str(error.value)
+    released.set()
+    preflight.clear_cache()
+
+
+def test_validate_volumes(tmpdir):
+    """Test validate_volumes returns valid volumes."""
+    volumes = ((tmpdir.strpath, "/a"), (tmpdir.join("missing").strpath, "/b"))
+    assert preflight.validate_volumes(None, None, volumes[:1]) == volumes[:1]
+
+    with pytest.raises(click.BadParameter):
+        preflight.validate_volumes(None, None, volumes)
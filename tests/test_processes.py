@@ -0,0 +1,142 @@
+"""register_apps processes tests."""
+
+import subprocess
+import threading
+import time
+
+import pytest
+
+from register_apps import exceptions
+from register_apps import processes
+
+
+def test_run_streams_and_captures(capsys):
+    """Test run streams and captures output, including progress bars."""
+    command = [
+        "bash",
+        "-c",
+        "echo one; printf '50%%\\r100%%\\r'; echo two >&2; printf end",
+    ]
+    output = processes.run(command, "python", capture=True)
+
+    # stderr is streamed but not captured
+    assert output == "one\n50%\r100%\rend"
+    assert capsys.readouterr() == (output, "two\n")
+    assert processes.run(["true"], "python", echo=False) is None
+    assert not capsys.readouterr().out
+
+
+def test_run_errors_keep_tail(monkeypatch):
+    """Test failures keep the last lines of output."""
+    monkeypatch.setattr(processes, "TAIL_LINES", 2)
+
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        processes.run(["bash", "-c", "seq 10; exit 3"], "pip", echo=False)
+
+    assert error.value.returncode == 3
+    assert error.value.output == "9\n10\n"
+
+    # captured commands keep stderr in the tail
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        processes.run(
+            ["bash", "-c", "echo out; echo err >&2; exit 1"],
+            "pip",
+            echo=False,
+            capture=True,
+        )
+
+    assert sorted(error.value.output.splitlines()) == ["err", "out"]
+
+
+@pytest.mark.parametrize(
+    "output, transient",
+    [
+        ("Downloading numpy.whl (500 kB)", False),
+        ("Collecting pandas==1.5.3 (from -r 429 requirements)", False),
+        ("ERROR: HTTP error 503 while getting https://pypi.org", True),
+        ("HTTP/1.1 502 Bad Gateway", True),
+        ("unexpected status code 429", True),
+        ("received unexpected HTTP status: 500", True),
+    ],
+)
+def test_is_transient(output, transient):
+    """Test only http error codes are transient, not numbers in the output."""
+    error = subprocess.CalledProcessError(1, ["pip"], output=output)
+    assert processes.is_transient(error) == transient
+
+
+def test_run_timeout_kills_children(tmpdir, monkeypatch):
+    """Test timeouts kill the command and its children."""
+    monkeypatch.setenv("TOIL_REGISTER_PULL_TIMEOUT", "0.5")
+    marker = tmpdir.join("marker")
+    start = time.time()
+
+    with pytest.raises(subprocess.TimeoutExpired):
+        processes.run(
+            ["bash", "-c", f"(sleep 2; touch {marker}) & sleep 30"], "pull", echo=False
+        )
+
+    assert time.time() - start < 5
+    time.sleep(2.5)
+    assert not marker.check()
+
+
+def test_run_retries_transient_errors(tmpdir, capsys):
+    """Test transient errors are retried and permanent ones are not."""
+    counter = tmpdir.join("counter")
+    script = (
+        f"echo x >> {counter}; "
+        f"[ `wc -l < {counter}` -ge 3 ] || (echo 'Connection reset by peer'; exit 1)"
+    )
+
+    cleaned = []
+    processes.run(
+        ["bash", "-c", script],
+        "pip",
+        retry=True,
+        backoff=0.01,
+        on_retry=lambda: cleaned.append(1),
+    )
+
+    assert len(counter.readlines()) == 3 and len(cleaned) == 2
+    assert "Retrying pip" in capsys.readouterr().err
+
+    # permanent errors are not retried
+    counter.remove()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        processes.run(
+            [
+                "bash",
+                "-c",
+                f"echo x >> {counter}; echo 'No matching distribution'; exit 1",
+            ],
+            "pip",
+            retry=True,
+            backoff=0.01,
+        )
+
+    assert len(counter.readlines()) == 1
+
+
+def test_cancel_kills_running_commands(tmpdir):
+    """Test cancel kills the commands of cancellable functions and later ones."""
+    marker = tmpdir.join("marker")
+    cancelled = threading.Event()
+    run = processes.cancellable(processes.run, cancelled)
+    thread = threading.Timer(0.5, processes.cancel, [cancelled])
+    start = time.time()
+    thread.start()
+
+    with pytest.raises(exceptions.CancelledError):
+        run(["bash", "-c", f"(sleep 2; touch {marker}) & sleep 30"], "pull")
+
+    assert time.time() - start < 5
+
+    with pytest.raises(exceptions.CancelledError):
+        run(["true"], "pull")
+
+    # other commands are not affected
+    processes.run(["true"], "pull")
+    time.sleep(2)
+    assert not marker.check()
@@ -0,0 +1,91 @@
+"""register_apps profiling tests."""
+
+import json
+import subprocess
+
+from click.testing import CliRunner
+import pytest
+
+from register_apps import cli
+from register_apps import profiling
+from tests import utils
+
+
+def test_spans(tmpdir):
+    """Test spans are written as JSON lines and a Chrome trace."""
+    path, trace = tmpdir.join("spans.jsonl"), tmpdir.join("trace.json")
+
+    with profiling.span("disabled") as span:
+        span["bytes"] = 1
+
+    assert not profiling.is_enabled()
+    profiling.enable(path.strpath, trace.strpath)
+    profiling.enable(None)  # nested commands keep the outermost settings
+
+    with profiling.span("outer", app="a"):
+        with pytest.raises(subprocess.CalledProcessError):
+            with profiling.span("inner"):
+                subprocess.check_call(["false"])
+
+    profiling.finish()
+    assert profiling.is_enabled() and not trace.check()
+    profiling.finish()
+    assert not profiling.is_enabled()
+
+    inner, outer = [json.loads(i) for i in path.readlines()]
+    assert (inner["name"], inner["parent"], inner["status"]) == (
+        "inner",
+        "outer",
+        "error",
+    )
+    assert inner["exit_code"] == 1
+    assert (outer["name"], outer["app"], outer["status"]) == ("outer", "a", "ok")
+    assert outer["seconds"] >= inner["seconds"]
+
+    events = json.loads(trace.read())["traceEvents"]
+    assert [(i["name"], i["ph"]) for i in events] == [("inner", "X"), ("outer", "X")]
+    assert events[1]["args"]["app"] == "a"
+
+
+def test_register_singularity_profile(tmpdir):
+    """Test register_singularity records the spans of its phases."""
+    singularity, _ = utils.make_fake_singularity(tmpdir)
+    path, trace = tmpdir.join("spans.jsonl"), tmpdir.join("trace.json")
+    result = CliRunner().invoke(
+        cli.register_singularity,
+        [
+            "--image_repository",
+            "docker-pcapcore",
+            "--image_version",
+            "v0.1.1",
+            "--volumes",
+            "/tmp",
+            "/carlos",
+            "--optdir",
+            tmpdir.join("opt").strpath,
+            "--bindir",
+            tmpdir.join("bin").strpath,
+            "--singularity",
+            singularity,
+            "--command",
+            "echo",
+            "--target",
+            "echo_target",
+            "--profile",
+            path.strpath,
+            "--profile_trace",
+            trace.strpath,
+        ],
+    )
+
+    assert not result.exit_code, result.output
+    spans = {i["name"]: i for i in map(json.loads, path.readlines())}
+    assert spans["singularity_pull"]["exit_code"] == 0
+    assert spans["singularity_pull"]["bytes"] > 0
+    assert spans["singularity_pull"]["parent"] == "get_or_create_image"
+    assert spans["register_singularity"]["parent"] is None
+
+    for i in "lock", "digest", "link_image", "chmod", "write_executable", "index":
+        assert i in spans
+
+    assert len(json.loads(trace.read())["traceEvents"]) == len(path.readlines())
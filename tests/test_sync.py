@@ -0,0 +1,216 @@
+"""register_apps sync tests."""
+
+from click.testing import CliRunner
+import pytest
+
+from register_apps import exceptions
+from register_apps import images
+from register_apps import index
+from register_apps import main
+from register_apps import registries
+from register_apps import wrappers
+from tests import utils
+
+
+class StaticClient:
+
+    """Registry client that resolves every tag to the same digest."""
+
+    def get_digest(self, image_url):  # pylint: disable=no-self-use,unused-argument
+        """Return a fixed digest."""
+        return "sha256:static"
+
+
+def test_parse_docker_url():
+    """Test docker urls are split in registry, repository and reference."""
+    assert registries.parse_docker_url("docker://ubuntu") == (
+        "registry-1.docker.io",
+        "library/ubuntu",
+        "latest",
+    )
+
+    assert registries.parse_docker_url("docker://leukgen/pcap:v1") == (
+        "registry-1.docker.io",
+        "leukgen/pcap",
+        "v1",
+    )
+
+    assert registries.parse_docker_url("docker://localhost:5000/a/b@sha256:1") == (
+        "localhost:5000",
+        "a/b",
+        "sha256:1",
+    )
+
+    assert registries.parse_docker_url("docker://quay.io/org/tool") == (
+        "quay.io",
+        "org/tool",
+        "latest",
+    )
+
+    with pytest.raises(exceptions.ValidationError):
+        registries.parse_docker_url("shub://org/tool")
+
+
+def test_docker_registry_client():
+    """Test registry clients resolve digests and can be disabled."""
+    registry = utils.start_fake_registry({"user/tool:v1": "sha256:abc"})
+    url = f"docker://localhost:{registry.server_port}/user/tool"
+    client = registries.DockerRegistryClient()
+
+    try:
+        assert client.get_digest(f"{url}:v1") == "sha256:abc"
+        assert registry.registry["requests"] == ["/v2/user/tool/manifests/v1"] * 2
+        assert registries.resolve_digest(f"{url}:missing", client) is None
+    finally:
+        registry.shutdown()
+
+    with pytest.raises(exceptions.ConfigurationError):
+        registries.get_client("tests.test_sync:Missing")
+
+    assert registries.get_client(registries.DISABLED) is None
+    assert registries.resolve_digest(f"{url}:v1", None) is None
+    assert isinstance(registries.get_client(), utils.StubRegistryClient)
+
+
+def test_sync(tmpdir, monkeypatch):
+    """Test sync re-pulls and relinks images whose tags moved."""
+    monkeypatch.setenv("TOIL_REGISTER_REGISTRY", registries.DEFAULT_CLIENT)
+    digests = {"user/tool:latest": "sha256:one"}
+    registry = utils.start_fake_registry(digests)
+    content = tmpdir.join("content")
+    content.write("one")
+    singularity, calls = utils.make_fake_singularity(tmpdir, content=f"`cat {content}`")
+    optdir = tmpdir.mkdir("opt")
+    image_url = f"docker://localhost:{registry.server_port}/user/tool:latest"
+    runner = CliRunner()
+    args = ["--optdir", optdir.strpath, "--singularity", singularity]
+
+    try:
+        result = runner.invoke(
+            main.main,
+            [
+                "singularity",
+                "--image_repository",
+                "tool",
+                "--image_version",
+                "latest",
+                "--image_url",
+                image_url,
+                "--bindir",
+                tmpdir.join("bin").strpath,
+                "--command",
+                "cat",
+                "--target",
+                "tool",
+                "--volumes",
+                "/tmp",
+                "/tmp",
+                "--stage_dir",
+                tmpdir.join("scratch").strpath,
+            ]
+            + args,
+        )
+
+        assert not result.exit_code, result.output
+        store = images.get_store(optdir.strpath)
+        old = images.get_url_record(store, image_url)
+        assert old["registry_digest"] == "sha256:one"
+
+        result = runner.invoke(main.main, ["sync"] + args)
+        assert not result.exit_code, result.output
+        assert f"unchanged  {image_url}" in result.output
+
+        # tags that moved are reported without pulling in dry runs
+        digests["user/tool:latest"] = "sha256:two"
+        content.write("two")
+        result = runner.invoke(main.main, ["sync", "--dry_run"] + args)
+        assert f"changed    {image_url}" in result.output
+        assert len(calls.readlines()) == 1
+
+        result = runner.invoke(main.main, ["sync", "--name", "tool"] + args)
+        assert not result.exit_code, result.output
+        assert f"pulled     {image_url}" in result.output
+        assert len(calls.readlines()) == 2
+    finally:
+        registry.shutdown()
+
+    new = images.get_url_record(store, image_url)
+    image = optdir.join("tool", "latest", "tool_latest.sif")
+    entry = index.read_entries(optdir.strpath)[0]
+    wrapper = optdir.join("tool", "latest", "tool").read()
+    assert new["registry_digest"] == "sha256:two"
+    assert image.read() == "two\n"
+    assert entry["digest"] == new["digest"].split(":", 1)[1]
+    assert new["digest"].split(":", 1)[1] in wrapper
+    assert old["digest"].split(":", 1)[1] not in wrapper
+
+    # images registered before digests were recorded get a baseline
+    images.write_url_record(store, image_url, dict(new, registry_digest=None))
+    args += ["--registry_client", "tests.test_sync:StaticClient"]
+    result = runner.invoke(main.main, ["sync"] + args)
+    assert f"recorded   {image_url}" in result.output
+    assert images.get_url_record(store, image_url)["registry_digest"] == (
+        "sha256:static"
+    )
+
+
+def test_sync_multiple_targets(tmpdir, monkeypatch):
+    """Test sync relinks an image shared by many targets without stray links."""
+    monkeypatch.setenv("TOIL_REGISTER_REGISTRY", registries.DEFAULT_CLIENT)
+    digests = {"user/tool:latest": "sha256:one"}
+    registry = utils.start_fake_registry(digests)
+    content = tmpdir.join("content")
+    content.write("one")
+    singularity, _ = utils.make_fake_singularity(tmpdir, content=f"`cat {content}`")
+    optdir = tmpdir.mkdir("opt")
+    image_url = f"docker://localhost:{registry.server_port}/user/tool:latest"
+    args = ["--optdir", optdir.strpath, "--singularity", singularity]
+    runner = CliRunner()
+
+    try:
+        result = runner.invoke(
+            main.main,
+            [
+                "singularity",
+                "--image_repository",
+                "tool",
+                "--image_version",
+                "latest",
+                "--image_url",
+                image_url,
+                "--bindir",
+                tmpdir.join("bin").strpath,
+                "--targets",
+                "a=cat",
+                "--targets",
+                "b=cat",
+                "--volumes",
+                "/tmp",
+                "/tmp",
+            ]
+            + args,
+        )
+
+        assert not result.exit_code, result.output
+        digests["user/tool:latest"] = "sha256:two"
+        content.write("two")
+        result = runner.invoke(main.main, ["sync"] + args)
+        assert not result.exit_code, result.output
+        assert f"pulled     {image_url}" in result.output
+    finally:
+        registry.shutdown()
+
+    image = optdir.join("tool", "latest", "tool_latest.sif")
+    assert image.read() == "two\n"
+    assert not optdir.join("tool", "latest").listdir("*.tmp")
+    assert image.stat().nlink == 2
+
+
+def test_update_staging():
+    """Test staging preambles are updated for new images."""
+    script = wrappers.get_staging("/a.sif", "/scratch", 10, "old", 100, "digest")
+    updated = wrappers.update_staging(script, "old", 100, "new", 200)
+    assert updated == wrappers.get_staging(
+        "/a.sif", "/scratch", 10, "new", 200, "digest"
+    )
+    assert wrappers.update_staging("exec cat", "old", 100, "new", 200) == "exec cat"
@@ -0,0 +1,109 @@
+"""register_apps telemetry tests."""
+
+import json
+import subprocess
+
+from click.testing import CliRunner
+
+from register_apps import cli
+from register_apps import main
+from register_apps import telemetry
+from tests import utils
+
+
+def test_read_records_and_stats(tmpdir):
+    """Test telemetry records are read and summarized."""
+    log = telemetry.get_log(tmpdir.strpath, "app")
+    assert oct(log.stat().st_mode)[-3:] == "664"
+    telemetry.get_log(tmpdir.join("new").strpath, "app")
+    assert oct(tmpdir.join("new").stat().mode)[-4:] == "2775"
+
+    log.write_text(
+        "".join(
+            f"{100 + i}\thost{i % 2}\tv1\tapp\t{int(i == 9)}\t{i}000000\n"
+            for i in range(10)
+        )
+        + "200\thost\tv2\tapp\t0\t500000\n"
+        + "300\thost\tv2\tapp\t0\n"  # partial write
+        + "bad\thost\tv2\tapp\t0\t1\n"
+    )
+
+    tmpdir.join("other.log").write("100\thost\tv1\tother\t0\t1\n")
+    records = list(telemetry.read_records(tmpdir.strpath, name="ap*"))
+    assert len(records) == 11
+    assert records[0] == dict(
+        name="app",
+        timestamp=100,
+        host="host0",
+        version="v1",
+        target="app",
+        exit_code=0,
+        seconds=0,
+    )
+
+    assert len(list(telemetry.read_records(tmpdir.strpath, since=150))) == 1
+    assert telemetry.percentile([], 50) is None
+    assert telemetry.percentile([1, 2, 3, 4], 50) == 2
+    assert telemetry.percentile([1, 2, 3, 4], 99) == 4
+
+    v1, v2 = telemetry.get_stats(records)
+    assert (v1["version"], v1["calls"], v1["errors"], v1["hosts"]) == ("v1", 10, 1, 2)
+    assert (v1["p50"], v1["p90"], v1["p99"], v1["max"]) == (4, 8, 9, 9)
+    assert (v2["calls"], v2["p50"], v2["last"]) == (1, 0.5, 200)
+    assert [i["calls"] for i in telemetry.get_stats(records, by=("name",))] == [11]
+
+
+def test_register_singularity_telemetry(tmpdir):
+    """Test registered wrappers record telemetry for stats."""
+    singularity, _ = utils.make_fake_singularity(tmpdir)
+    calls = tmpdir.join("calls")
+    bindir = tmpdir.join("bin")
+    result = CliRunner().invoke(
+        cli.register_singularity,
+        [
+            "--image_repository",
+            "docker-pcapcore",
+            "--image_version",
+            "v0.1.1",
+            "--volumes",
+            "/tmp",
+            "/carlos",
+            "--optdir",
+            tmpdir.join("opt").strpath,
+            "--bindir",
+            bindir.strpath,
+            "--singularity",
+            singularity,
+            "--command",
+            "echo",
+            "--target",
+            "echo_target",
+            "--telemetry",
+            calls.strpath,
+        ],
+    )
+
+    assert not result.exit_code, result.output
+    subprocess.check_call([bindir.join("echo_target").strpath, "hello"])
+    subprocess.check_call([bindir.join("echo_target").strpath, "world"])
+    assert len(calls.join("docker-pcapcore.log").readlines()) == 2
+
+    runner = CliRunner()
+    result = runner.invoke(main.main, ["stats", "--telemetry", calls.strpath])
+    assert not result.exit_code, result.output
+    assert result.output.split("\n")[1].split()[:4] == [
+        "docker-pcapcore",
+        "v0.1.1",
+        "2",
+        "0",
+    ]
+
+    result = runner.invoke(
+        main.main,
+        ["stats", "--telemetry", calls.strpath, "--by", "target", "--json"],
+    )
+    assert not result.exit_code, result.output
+    assert json.loads(result.output)[0]["target"] == "echo_target"
+
+    result = runner.invoke(main.main, ["stats"])
+    assert result.exit_code and "--telemetry" in result.output
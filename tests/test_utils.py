@@ -3,6 +3,10 @@
 from os.path import join
 import os
 import tarfile
+import threading
+import time
+
+import pytest
 
 from register_apps import utils
 
@@ -46,6 +50,11 @@ def test_force_link(tmpdir):
     assert os.path.isfile(dst)
     assert not os.path.islink(dst)
 
+    # linking again doesn't leave temporary links behind
+    utils.force_link(src, dst)
+    assert sorted(os.listdir(str(tmpdir))) == ["dst", "src"]
+    assert os.stat(src).st_nlink == 2
+
 
 def test_force_link_overwrite(tmpdir):
     src = join(str(tmpdir), "src")
@@ -100,3 +109,75 @@ def test_tar_dir(tmpdir):
         with open(i, "r") as f:
             assert j in f.read()
 
+
+def test_lock(tmpdir):
+    """Test lock serializes concurrent critical sections."""
+    path = join(str(tmpdir), "lock")
+    events = []
+
+    def register(name):
+        with utils.lock(path, poll=0.01) as waited:
+            events.append((name, "start", waited))
+            time.sleep(0.1)
+            events.append((name, "end", waited))
+
+    threads = [threading.Thread(target=register, args=(i,)) for i in range(3)]
+
+    for i in threads:
+        i.start()
+
+    for i in threads:
+        i.join()
+
+    # critical sections never overlap and only the first didn't wait
+    assert [i[1] for i in events] == ["start", "end"] * 3
+    assert sorted(i[2] for i in events) == [False] * 2 + [True] * 4
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_lock_stale_and_timeout(tmpdir):
+    """Test stale locks are broken and busy locks time out."""
+    path = join(str(tmpdir), "lock")
+
+    with open(path, "w") as f:
+        f.write("held by another process")
+
+    with pytest.raises(TimeoutError):
+        with utils.lock(path, poll=0.01, timeout=0.05):
+            pass
+
+    os.utime(path, (time.time() - 10, time.time() - 10))
+
+    with utils.lock(path, poll=0.01, stale=5) as waited:
+        assert not waited
+
+
+def test_break_lock(tmpdir):
+    """Test stale locks are only broken if they didn't change since checked."""
+    path = join(str(tmpdir), "lock")
+
+    with open(path, "w") as f:
+        f.write("held by another process")
+
+    os.utime(path, (time.time() - 10, time.time() - 10))
+    stat = os.stat(path)
+    os.utime(path)
+    utils._break_lock(path, stat)
+    assert os.stat(path).st_ino == stat.st_ino
+    assert os.listdir(str(tmpdir)) == ["lock"]
+
+    utils._break_lock(path, os.stat(path))
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_lock_release_keeps_other_lock(tmpdir):
+    """Test releasing a lock broken by another process doesn't remove theirs."""
+    path = join(str(tmpdir), "lock")
+
+    with utils.lock(path, poll=0.01):
+        os.unlink(path)
+
+        with open(path, "w") as f:
+            f.write("taken by another process")
+
+    assert os.listdir(str(tmpdir)) == ["lock"]
@@ -0,0 +1,224 @@
+"""register_apps wrappers tests."""
+
+from pathlib import Path
+import os
+import socket
+import subprocess
+import time
+
+from register_apps import images
+from register_apps import wrappers
+from tests import utils
+
+
+def test_legacy_scripts():
+    """Test legacy wrappers are unchanged."""
+    volumes = [("/ifs", "/ifs"), ("/res", "/data")]
+    script = wrappers.get_singularity_script(
+        "singularity", "/img.simg", "bwa", volumes, "$TMP", "pcap_v1"
+    )
+
+    assert script == (
+        "#!/bin/bash\nsingularity exec --workdir $TMP/${USER}_pcap_v1_`uuidgen` "
+        '--bind /ifs:/ifs --bind /res:/data /img.simg bwa "$@"\n'
+    )
+
+    assert wrappers.get_toil_script("/bin/toil", "/img", volumes, "$TMP") == (
+        '#!/bin/bash\n/bin/toil "$@" --singularity /img '
+        "--volumes /ifs /ifs --volumes /res /data --workDir $TMP \n"
+    )
+
+    assert wrappers.get_python_script("/bin/tool") == '#!/bin/bash\n/bin/tool "$@" \n'
+
+
+def test_exec_scripts(tmpdir):
+    """Test exec wrappers replace the wrapper process."""
+    singularity, _ = utils.make_fake_singularity(tmpdir)
+    optexe = Path(tmpdir.strpath) / "target"
+    binexe = Path(tmpdir.strpath) / "link"
+    script = wrappers.get_singularity_script(
+        singularity=singularity,
+        image="/img.simg",
+        command="sh -c 'echo $$ $0' ",
+        volumes=[("/tmp", "/tmp")],
+        tmpvar="/tmp",
+        prefix="image_v1",
+        mode="exec",
+    )
+
+    assert "uuidgen" not in script
+    assert "exec " + singularity in script
+    wrappers.write_executable(optexe, binexe, script)
+
+    # the command replaces the wrapper process
+    process = subprocess.Popen([str(binexe), "arg"], stdout=subprocess.PIPE)
+    assert process.communicate()[0].decode().split() == [str(process.pid), "arg"]
+
+    workdirs = {
+        subprocess.check_output(
+            ["bash", "-c", "echo " + wrappers.get_workdir("/tmp", "p", "exec")]
+        )
+        for _ in range(5)
+    }
+
+    assert len(workdirs) == 5
+    assert wrappers.get_python_script("/bin/tool", "exec").startswith(
+        "#!/bin/bash\nexec /bin/tool"
+    )
+
+
+FAKE_INSTANCES = """#!/bin/bash
+# fake singularity that logs instance starts and stops
+echo "$@" >> {log}
+if [ "$1" == "exec" ]; then
+    [[ "$2" == instance://* ]] && shift 2 || shift 6
+    exec "$@"
+fi
+"""
+
+
+def test_instance_script(tmpdir, monkeypatch):
+    """Test instance wrappers reuse an instance stopped when idle."""
+    monkeypatch.setenv("TMPDIR", tmpdir.strpath)
+    log = tmpdir.join("singularity.log")
+    singularity = tmpdir.join("singularity")
+    singularity.write(FAKE_INSTANCES.format(log=log.strpath))
+    singularity.chmod(0o755)
+    optexe = Path(tmpdir.strpath) / "target"
+    script = wrappers.get_singularity_script(
+        singularity=singularity.strpath,
+        image="/img.simg",
+        command="echo",
+        volumes=[("/tmp", "/tmp")],
+        tmpvar="/tmp",
+        prefix="image_v1.0",
+        mode="instance",
+        timeout=1,
+    )
+
+    wrappers.write_executable(optexe, Path(tmpdir.strpath) / "link", script)
+
+    for i in range(3):
+        assert subprocess.check_output([str(optexe), str(i)]) == f"{i}\n".encode()
+
+    instance = "image_v1_0_{}_{}".format(
+        os.environ.get("USER", ""), socket.gethostname().split(".")[0]
+    ).replace("-", "_")
+    calls = [i.split()[:2] for i in log.readlines()]
+    assert calls.count(["instance", "start"]) == 1
+    assert calls.count(["exec", f"instance://{instance}"]) == 3
+
+    # the reaper waits for calls that are still using the instance
+    script = script.replace("echo", f"bash -c 'sleep 2.5; cat {log.strpath}'")
+    wrappers.write_executable(optexe, Path(tmpdir.strpath) / "link", script)
+    output = subprocess.check_output([str(optexe)]).decode().splitlines()
+    assert ["instance", "stop"] not in [i.split()[:2] for i in output[3:]]
+
+    # the reaper stops the idle instance
+    for _ in range(50):
+        if ["instance", "stop"] in [i.split()[:2] for i in log.readlines()[3:]]:
+            break
+        time.sleep(0.1)
+    else:  # pragma: no cover
+        raise AssertionError("Idle instance was not stopped.")
+
+
+def test_staging(tmpdir, monkeypatch):
+    """Test wrappers stage images in scratch and evict old ones."""
+    monkeypatch.setenv("USER", "me")
+    stage = tmpdir.join("scratch", ".register_apps_me")
+    executables = {}
+
+    for name in "ab":
+        image = tmpdir.join(f"{name}.simg")
+        image.write(name * 10)
+        executables[name] = Path(tmpdir.strpath) / name
+        wrappers.write_executable(
+            executables[name],
+            Path(tmpdir.strpath) / f"{name}_link",
+            wrappers.get_singularity_script(
+                singularity="echo",
+                image=image.strpath,
+                command="cmd",
+                volumes=[],
+                tmpvar="/tmp",
+                prefix=name,
+                mode="exec",
+                staging=wrappers.get_staging(
+                    image=image.strpath,
+                    stage_dir=tmpdir.join("scratch").strpath,
+                    limit=15,
+                    digest=images.get_file_digest(image.strpath),
+                    size=10,
+                    verify="digest",
+                ),
+            ),
+        )
+
+    def run(name):
+        return subprocess.check_output([str(executables[name])]).decode()
+
+    digest_a = images.get_file_digest(tmpdir.join("a.simg").strpath)
+    assert stage.join(f"{digest_a}.img").strpath in run("a")
+    assert stage.join(f"{digest_a}.img.ok").exists()
+    assert stage.join(f"{digest_a}.img").strpath in run("a")
+
+    # only one image fits, the least recently used is evicted
+    run("b")
+    assert not stage.join(f"{digest_a}.img").exists()
+    assert len(stage.listdir("*.img")) == 1
+
+    # corrupted copies are not staged and the original image is used
+    tmpdir.join("a.simg").write("c" * 10)
+    assert tmpdir.join("a.simg").strpath in run("a")
+    assert not stage.join(f"{digest_a}.img").exists()
+    assert not stage.listdir("*.img.*")
+
+
+def test_usage_stamp(tmpdir):
+    """Test usage stamps are touched by wrappers."""
+    script = wrappers.get_python_script("true", mode="exec")
+    script = wrappers.add_preamble(script, wrappers.get_usage_stamp(tmpdir.strpath))
+    assert script.startswith("#!/bin/bash\n: > ")
+
+    wrapper = tmpdir.join("wrapper")
+    wrapper.write(script)
+    wrapper.chmod(0o755)
+    subprocess.check_call([wrapper.strpath])
+    assert tmpdir.join(wrappers.STAMP_FILENAME).check()
+
+
+def test_telemetry(tmpdir):
+    """Test wrappers record the exit code and wall time of calls."""
+    log = tmpdir.join("calls.log")
+    telemetry = wrappers.get_telemetry(log.strpath, "v1", "tool")
+    script = wrappers.get_python_script("sh -c 'exit 3'", "exec", telemetry)
+    assert "exec" not in script.split("\n")[-2]
+    assert script.endswith("; __record\n")
+
+    wrapper = tmpdir.join("wrapper")
+    wrapper.write(script)
+    wrapper.chmod(0o755)
+    assert subprocess.call([wrapper.strpath]) == 3
+    assert subprocess.call([wrapper.strpath]) == 3
+
+    lines = log.read().splitlines()
+    timestamp, host, version, target, code, microseconds = lines[0].split("\t")
+    assert len(lines) == 2
+    assert abs(int(timestamp) - time.time()) < 60
+    assert host == socket.gethostname().split(".")[0]
+    assert (version, target, code) == ("v1", "tool", "3")
+    assert 0 < int(microseconds) < 60 * 10**6
+
+    # telemetry starts before staging
+    script = wrappers.get_singularity_script(
+        "singularity", "/img", "bwa", [], "$TMP", "p", "exec", 60, "stage", telemetry
+    )
+    assert script.index("__record()") < script.index("stage")
+    assert script.endswith('"$@"; __record\n')
+
+    script = wrappers.get_singularity_script(
+        "singularity", "/img", "bwa", [], "$TMP", "p", "instance", 60, None, telemetry
+    )
+    assert "exec singularity" not in script
+    assert script.endswith('"$@"; __record\n')
@@ -1,6 +1,24 @@
-
 """Utils for tests."""
+
+from http import server
+import os
+import socketserver
 import subprocess
+import threading
+import zipfile
+
+
+class StubRegistryClient:
+
+    """Registry client that resolves every tag without network requests."""
+
+    def get_digest(self, image_url):  # pylint: disable=no-self-use,unused-argument
+        """Return a fixed digest."""
+        return "sha256:stub"
+
+
+# registrations in tests never reach remote registries
+os.environ.setdefault("TOIL_REGISTER_REGISTRY", "tests.utils:StubRegistryClient")
 
 
 def is_singularity_available():
@@ -15,3 +33,131 @@ def is_singularity_available():
         return True
     except (subprocess.CalledProcessError, OSError):
         return False
+
+
+FAKE_SINGULARITY = """#!/bin/bash
+# fake singularity that pulls images with content {content}
+if [ "$1" == "pull" ]; then
+    echo "$2" >> {calls}
+    name=`basename "$2" | tr ':' '_'`
+    echo {content} > "$name.sif"
+else
+    shift 1; while [[ "$1" == --* ]]; do shift 2; done; shift 1; exec "$@"
+fi
+"""
+
+
+def make_fake_singularity(directory, content="$2"):
+    """
+    Create a fake singularity executable that records its pulls.
+
+    Arguments:
+        directory (py.path.local): directory where the executable is created.
+        content (str): shell expression written as the pulled image content.
+
+    Returns:
+        tuple: path to the executable and to the pull calls log.
+    """
+    singularity = directory.join("singularity")
+    calls = directory.join("pulls.log")
+    calls.write("")
+    singularity.write(FAKE_SINGULARITY.format(content=content, calls=calls.strpath))
+    singularity.chmod(0o755)
+    return singularity.strpath, calls
+
+
+def make_wheel(directory, name, version):
+    """
+    Create a minimal pure python wheel with a `name` console script.
+
+    The console script prints `name version` when called with `--version`.
+
+    Arguments:
+        directory (py.path.local): directory where the wheel is created.
+        name (str): package name.
+        version (str): package version.
+
+    Returns:
+        str: path to the wheel.
+    """
+    version = version.lstrip("v")
+    distinfo = f"{name}-{version}.dist-info"
+    wheel = directory.join(f"{name}-{version}-py2.py3-none-any.whl")
+    files = {
+        f"{name}.py": f"def main():\n    print('{name} {version}')\n",
+        f"{distinfo}/METADATA": (
+            f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n"
+        ),
+        f"{distinfo}/WHEEL": (
+            "Wheel-Version: 1.0\nGenerator: tests\n"
+            "Root-Is-Purelib: true\nTag: py2-none-any\nTag: py3-none-any\n"
+        ),
+        f"{distinfo}/entry_points.txt": (f"[console_scripts]\n{name} = {name}:main\n"),
+    }
+
+    with zipfile.ZipFile(wheel.strpath, "w") as zipped:
+        for path, content in files.items():
+            zipped.writestr(path, content)
+
+        record = "".join(f"{i},,\n" for i in files) + f"{distinfo}/RECORD,,\n"
+        zipped.writestr(f"{distinfo}/RECORD", record)
+
+    return wheel.strpath
+
+
+class FakeRegistryHandler(server.BaseHTTPRequestHandler):
+
+    """Serve manifest digests and anonymous tokens like a docker registry."""
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Return the digest of `/v2/<repository>/manifests/<tag>`."""
+        registry = self.server.registry
+        registry["requests"].append(self.path)
+
+        if self.headers.get("Authorization") != "Bearer secret":
+            realm = f"http://localhost:{self.server.server_port}/token"
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", f'Bearer realm="{realm}",service="x"')
+            self.end_headers()
+            return
+
+        repository, _, tag = self.path[len("/v2/") :].partition("/manifests/")
+        digest = registry["digests"].get(f"{repository}:{tag}")
+        self.send_response(200 if digest else 404)
+
+        if digest:
+            self.send_header("Docker-Content-Digest", digest)
+
+        self.end_headers()
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Return an anonymous token."""
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"token": "secret"}')
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Keep the test output clean."""
+
+
+class FakeRegistryServer(socketserver.ThreadingMixIn, server.HTTPServer):
+
+    """A local stand-in registry, `registry` has its `digests` and `requests`."""
+
+    daemon_threads = True
+
+
+def start_fake_registry(digests):
+    """
+    Start a local stand-in registry in a background thread.
+
+    Arguments:
+        digests (dict): digests keyed by `repository:tag`, can be updated.
+
+    Returns:
+        FakeRegistryServer: server, use `server.shutdown()` to stop it.
+    """
+    registry = FakeRegistryServer(("localhost", 0), FakeRegistryHandler)
+    registry.registry = {"digests": digests, "requests": []}
+    threading.Thread(target=registry.serve_forever, daemon=True).start()
+    return registry